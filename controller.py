@@ -2,9 +2,9 @@
 """
 import copy
 from datetime import datetime as dt
-from functools import partial
 import itertools
 import logging
+import time
 
 import matplotlib as mpl
 import numpy as np
@@ -23,6 +23,7 @@ from . import plots
 from . import settings
 from .utils import actions
 from .logger import qgis_log
+from .ts_driver.cancel import CancelToken, FetchCancelled
 from .ts_driver.ts_manager import tsm
 
 logger = logging.getLogger('tstools')
@@ -35,26 +36,108 @@ logger = logging.getLogger('tstools')
 class Worker(QtCore.QObject):
 
     update = QtCore.pyqtSignal(float)
+    stage = QtCore.pyqtSignal(str)
+    snapshot = QtCore.pyqtSignal(object)
+    partial_finished = QtCore.pyqtSignal()
     finished = QtCore.pyqtSignal()
+    cancelled = QtCore.pyqtSignal()
     errored = QtCore.pyqtSignal(str)
 
+    # Progress is only signalled once it advances by `progress_step` percent
+    # and `progress_interval` seconds have passed since the last signal
+    progress_step = 1.0
+    progress_interval = 0.1
+    # Snapshots of data are signalled at most every `snapshot_interval`
+    # seconds, except for Series that are completely read
+    snapshot_interval = 0.5
+    _snapshot_time = 0.0
+
     def __init__(self, parent):
         super(Worker, self).__init__()
         parent.fetch_data.connect(self.fetch)
 
-    @QtCore.pyqtSlot(object, object, str)
-    def fetch(self, ts, pos, crs_wkt):
+    @QtCore.pyqtSlot(object, object, str, object, object, int)
+    def fetch(self, ts, pos, crs_wkt, bands, cancel, snapshot_every):
         logger.info('Fetching from QThread (id: %s)' %
                     hex(self.thread().currentThreadId()))
         # Fetch data
         try:
-            for percent in ts.fetch_data(pos[0], pos[1], crs_wkt):
-                self.update.emit(percent)
+            if not hasattr(ts, 'fetch_remaining'):
+                # Driver cannot skip bands or stop reads itself
+                self._progress(ts.fetch_data(pos[0], pos[1], crs_wkt),
+                               cancel)
+            else:
+                # Plot snapshots of data as they are read
+                kwargs = {}
+                if snapshot_every > 0:
+                    kwargs = dict(snapshot=self._snapshot,
+                                  snapshot_every=snapshot_every)
+                    self._snapshot_time = 0.0
+                # Plot bands read first while reading the other bands
+                self._progress(ts.fetch_data(pos[0], pos[1], crs_wkt,
+                                             bands=bands, cancel=cancel,
+                                             **kwargs),
+                               cancel)
+                if any([series.remaining_bands is not None
+                        for series in ts.series]):
+                    self.partial_finished.emit()
+                    self._progress(ts.fetch_remaining(cancel=cancel),
+                                   cancel)
+            self._fetch_results(ts)
+        except FetchCancelled:
+            logger.info('Fetch cancelled')
+            self.cancelled.emit()
         except Exception as e:
             self.errored.emit(e.message)
         else:
             self.finished.emit()
 
+    def _snapshot(self, i_series, data, read, bands):
+        """ Emit a snapshot of the data of a Series read so far
+        """
+        now = time.time()
+        if read.all() or now - self._snapshot_time >= self.snapshot_interval:
+            self.snapshot.emit((i_series, data, read, bands))
+            self._snapshot_time = now
+
+    def _fetch_results(self, ts):
+        """ Read or calculate results for the data fetched
+
+        Data fetched are already kept by the driver, so results are always
+        fetched for them, even if cancelled meanwhile, so that data and
+        results are never of different pixels.
+        """
+        if ts.has_results:
+            self.stage.emit('Fetching results')
+        try:
+            ts.fetch_results()
+        except Exception as e:
+            # Data are still plotted without results
+            logger.error('Could not fetch results: %s' % e.message)
+
+    def _progress(self, progress, cancel):
+        """ Emit progress of a fetch, stopping it if cancelled
+
+        Signals are throttled so that their number does not depend on the
+        number of images read.
+        """
+        emitted, emitted_time = None, 0.0
+        percent = None
+        try:
+            for percent in progress:
+                cancel.check()
+                now = time.time()
+                if (emitted is None or
+                        (percent - emitted >= self.progress_step and
+                         now - emitted_time >= self.progress_interval)):
+                    self.update.emit(percent)
+                    emitted, emitted_time = percent, now
+        finally:
+            progress.close()
+
+        if percent is not None and percent != emitted:
+            self.update.emit(percent)
+
 
 class PlotHandler(QtCore.QObject):
     """ Workaround for connecting `pick_event` signals to `twinx()` axes
@@ -148,8 +231,12 @@ class Controller(QtCore.QObject):
     working = False
     worker = None
     work_thread = None
+    cancel = None
+    pending = None
+    # True once data of the request being fetched are plotted
+    partial_plotted = False
 
-    fetch_data = QtCore.pyqtSignal(object, object, str)
+    fetch_data = QtCore.pyqtSignal(object, object, str, object, object, int)
 
     initialized = False
 
@@ -165,14 +252,16 @@ class Controller(QtCore.QObject):
         """ Initialize timeseries selected by user
         """
         try:
-            tsm.ts = driver(location, config=custom_config)
+            ts = driver(location, config=custom_config)
         except Exception as e:
             msg = 'Failed to open timeseries: {msg}'.format(msg=e.message)
             qgis_log(msg, level=logging.ERROR, duration=5)
             raise  # TODO: REMOVE EXCEPTION
         else:
-            qgis_log('Loaded timeseries: {d}'.format(d=tsm.ts.description))
+            qgis_log('Loaded timeseries: {d}'.format(d=ts.description))
+            # Previous timeseries is closed once nothing is fetching from it
             self.disconnect()
+            tsm.ts = ts
             self.config_closed()
             self._ts_init()
             self.initialized = True
@@ -205,117 +294,221 @@ class Controller(QtCore.QObject):
 # PLOT TOOL
     @QtCore.pyqtSlot(object)
     def plot_request(self, pos):
+        """ Fetch data for a clicked point, superseding any current request
+
+        Only the latest click is fetched. If data are being fetched, that
+        request is cancelled and the click is queued in place of any click
+        queued before it.
+        """
+        qgis_log('Clicked a point: {p} ({t})'.format(p=pos, t=type(pos)),
+                 level=logging.INFO)
+
+        crs = self.iface.mapCanvas().mapSettings().destinationCrs()
+        crs_wkt = crs.toWkt()
+
+        bands = None
+        if settings.plot['fetch_plotted_first']:
+            bands = self._plotted_bands()
+
+        request = ((pos[0], pos[1]), crs_wkt, bands)
         if self.working:
-            qgis_log('Unable to initiate plot request: already working',
-                     logging.INFO)
+            logger.info('Superseding plot request in progress')
+            self.pending = request
+            self.cancel.cancel()
         else:
-            qgis_log('Clicked a point: {p} ({t})'.format(p=pos, t=type(pos)),
-                     level=logging.INFO)
-
-            crs = self.iface.mapCanvas().mapSettings().destinationCrs()
-            crs_wkt = crs.toWkt()
-
-            # Setup QProgressBar
-            self.progress_bar = self.iface.messageBar().createMessage(
-                'Retrieving data')
-
-            self.progress = QtGui.QProgressBar()
-            self.progress.setValue(0)
-            self.progress.setMaximum(100)
-            self.progress.setAlignment(QtCore.Qt.AlignLeft |
-                                       QtCore.Qt.AlignVCenter)
-
-            self.but_cancel = QtGui.QPushButton('Cancel')
-            self.but_cancel.pressed.connect(self.plot_request_cancel)
-
-            self.progress_bar.layout().addWidget(self.progress)
-            self.progress_bar.layout().addWidget(self.but_cancel)
-
-            self.iface.messageBar().pushWidget(
-                self.progress_bar, self.iface.messageBar().INFO)
-
-            # Setup worker and thread
-            self.working = True
-
-            self.work_thread = QtCore.QThread()
-            # self.worker = Worker()
-            self.worker = Worker(self)
-            self.worker.moveToThread(self.work_thread)
-            self.worker.update.connect(self.plot_request_update)
-            self.worker.finished.connect(self.plot_request_finish)
-            self.worker.errored.connect(self.plot_request_error)
-            self.work_thread.started.connect(partial(self.plot_request_start,
-                                             tsm.ts,
-                                             (pos[0], pos[1]),
-                                             crs_wkt))
-
-            if (getattr(self.controls, 'custom_form', None) is not None and
-                    hasattr(tsm.ts, 'set_custom_controls')):
-                try:
-                    options = self.controls.custom_form.get()
-                    tsm.ts.set_custom_controls(options)
-                except BaseException as e:
-                    logger.warning(
-                        'Could not use custom controls for timeseries')
-                    qgis_log(str(e), level=logging.WARNING)
-                    self.controls.custom_form.reset()
-                    return
-
-            # Run thread
-            logger.info('Timeseries (id: {i})'.format(i=hex(id(tsm.ts))))
-            logger.info('Current thread: ({i})'.format(
-                i=hex(self.thread().currentThreadId())))
-
-            self.work_thread.start()
-            logger.info('Started QThread (id: {i})'.format(
-                i=hex(self.work_thread.currentThreadId())))
-
-    @QtCore.pyqtSlot(object, tuple, str)
-    def plot_request_start(self, ts, pos, crs_wkt):
+            self._plot_request_start(*request)
+
+    def _plot_request_start(self, pos, crs_wkt, bands):
+        """ Send a request to fetch data to the worker thread
+        """
+        self.pending = None
+
+        if (getattr(self.controls, 'custom_form', None) is not None and
+                hasattr(tsm.ts, 'set_custom_controls')):
+            try:
+                options = self.controls.custom_form.get()
+                tsm.ts.set_custom_controls(options)
+            except BaseException as e:
+                logger.warning(
+                    'Could not use custom controls for timeseries')
+                qgis_log(str(e), level=logging.WARNING)
+                self.controls.custom_form.reset()
+                return
+
+        # Setup QProgressBar
+        self.progress_bar = self.iface.messageBar().createMessage(
+            'Retrieving data')
+
+        self.progress = QtGui.QProgressBar()
+        self.progress.setValue(0)
+        self.progress.setMaximum(100)
+        self.progress.setAlignment(QtCore.Qt.AlignLeft |
+                                   QtCore.Qt.AlignVCenter)
+
+        self.but_cancel = QtGui.QPushButton('Cancel')
+        self.but_cancel.pressed.connect(self.plot_request_cancel)
+
+        self.progress_bar.layout().addWidget(self.progress)
+        self.progress_bar.layout().addWidget(self.but_cancel)
+
+        self.iface.messageBar().pushWidget(
+            self.progress_bar, self.iface.messageBar().INFO)
+
+        self.working = True
+        self.cancel = CancelToken()
+        self._init_worker()
+
+        logger.info('Timeseries (id: {i})'.format(i=hex(id(tsm.ts))))
         logger.info('Fetch data signal sent for point: '
                     '{p} ({t})'.format(p=pos, t=type(pos)))
+        self.fetch_data.emit(tsm.ts, pos, crs_wkt, bands, self.cancel,
+                             settings.plot['snapshot_every'])
 
-        self.fetch_data.emit(ts, pos, crs_wkt)
+    def _init_worker(self):
+        """ Start the thread that fetches data, if it is not running
+
+        One worker and thread are kept for all requests, which the worker
+        handles in order.
+        """
+        if self.work_thread is not None:
+            return
+
+        self.work_thread = QtCore.QThread()
+        self.worker = Worker(self)
+        self.worker.moveToThread(self.work_thread)
+        self.worker.update.connect(self.plot_request_update)
+        self.worker.stage.connect(self.plot_request_stage)
+        self.worker.snapshot.connect(self.plot_request_snapshot)
+        self.worker.partial_finished.connect(self.plot_request_partial)
+        self.worker.finished.connect(self.plot_request_finish)
+        self.worker.cancelled.connect(self.plot_request_cancelled)
+        self.worker.errored.connect(self.plot_request_error)
+
+        logger.info('Current thread: ({i})'.format(
+            i=hex(self.thread().currentThreadId())))
+        self.work_thread.start()
+        logger.info('Started QThread (id: {i})'.format(
+            i=hex(self.work_thread.currentThreadId())))
+
+    def _plot_request_next(self, redraw=True):
+        """ Stop working, starting the latest queued click if there is one
+
+        Args:
+            redraw (bool): if no click is started, redraw plots showing
+                snapshots or bands read first with the data kept by the
+                driver
+
+        Returns:
+            bool: True if a queued click was started
+
+        """
+        self.working = False
+        partial_plotted, self.partial_plotted = self.partial_plotted, False
+        self._clear_snapshots()
+        self.iface.messageBar().clearWidgets()
+        if self.pending is None:
+            if redraw and partial_plotted:
+                self.update_plot()
+            return False
+        self._plot_request_start(*self.pending)
+        return True
 
     @QtCore.pyqtSlot(float)
     def plot_request_update(self, progress):
-        if self.working is True:
+        if self.working is True and not self.cancel.cancelled:
             self.progress.setValue(progress)
 
+    @QtCore.pyqtSlot(str)
+    def plot_request_stage(self, text):
+        if self.working is True and not self.cancel.cancelled:
+            self.progress_bar.setText(text)
+            # Stages without progress show a busy indicator
+            self.progress.setMaximum(0)
+
     @QtCore.pyqtSlot()
-    def plot_request_finish(self):
-        # Get results in this thread since it's so prone to error
+    def plot_request_partial(self):
+        """ Plot the bands read first while the other bands are read
+        """
+        if self.working is not True or self.cancel.cancelled:
+            return
+        self._clear_snapshots()
+        self._plot_partial()
+
+    @QtCore.pyqtSlot(object)
+    def plot_request_snapshot(self, snapshot):
+        """ Plot a snapshot of data read so far
+        """
+        if self.working is not True or self.cancel.cancelled:
+            return
+        tsm.ts.set_snapshot(*snapshot)
+        self._plot_partial()
+
+    def _clear_snapshots(self):
+        if hasattr(tsm.ts, 'clear_snapshots'):
+            tsm.ts.clear_snapshots()
+
+    def _plot_partial(self):
+        """ Plot data while a request is still being fetched
+        """
+        # Results are still those of the previous pixel
+        if (tsm.ts.has_results and
+                isinstance(self.plots[settings.plot_current],
+                           plots.ResidualPlot)):
+            return
+        shown = dict((k, settings.plot[k]) for k in ('fit', 'break', 'custom'))
+        if tsm.ts.has_results:
+            for k in shown:
+                settings.plot[k] = False
         try:
-            tsm.ts.fetch_results()
-        except Exception as e:
-            logger.error('Could not fetch results: %s' % e.message)
-            raise
+            self.update_plot()
         finally:
-            # Stop 'working'
-            self.working = False
-            self.work_thread.quit()
+            settings.plot.update(shown)
+        self.partial_plotted = True
 
-            # Clear GUI messages
-            logger.info('Plot request finished')
-            self.iface.messageBar().clearWidgets()
+    def _plotted_bands(self):
+        """ Return 0-indexed bands plotted, keyed by index of Series
+        """
+        bands = dict((i, []) for i in range(len(tsm.ts.series)))
+        plotted = np.where(np.logical_or(settings.plot['y_axis_1_band'],
+                                         settings.plot['y_axis_2_band']))[0]
+        for i in plotted:
+            bands[int(settings.plot_series[i])].append(
+                int(settings.plot_band_indices[i]))
+        return bands
 
-            # Update plots
-            self.update_plot()
+    @QtCore.pyqtSlot()
+    def plot_request_finish(self):
+        # Data finished before a newer click cancelled them are not shown
+        if self._plot_request_next(redraw=False):
+            return
+
+        # Results were fetched by the worker
+        logger.info('Plot request finished')
+
+        # Update plots
+        self.update_plot()
 
-            # Add geometry from clicked point
-            self.plot_request_geometry()
+        # Add geometry from clicked point
+        self.plot_request_geometry()
 
     @QtCore.pyqtSlot(str)
     def plot_request_error(self, txt):
-        self.iface.messageBar().clearWidgets()
         qgis_log(txt, logging.ERROR, duration=5)
-
-        self.working = False
-        self.work_thread.quit()
+        self._plot_request_next()
 
     @QtCore.pyqtSlot()
     def plot_request_cancel(self):
-        self.plot_request_finish()
+        # Worker stops after its current reads and signals `cancelled`
+        if self.working and self.cancel is not None:
+            logger.info('Cancelling plot request')
+            self.pending = None
+            self.cancel.cancel()
+            self.but_cancel.setEnabled(False)
+
+    @QtCore.pyqtSlot()
+    def plot_request_cancelled(self):
+        if not self._plot_request_next():
+            qgis_log('Plot request cancelled', logging.INFO)
 
     def plot_request_geometry(self):
         """ Add polygon of geometry from clicked X/Y coordinate """
@@ -404,9 +597,7 @@ class Controller(QtCore.QObject):
         """
         for layer in layers:
             for i, series in enumerate(tsm.ts.series):
-                rows_added = [row for row, path in
-                              enumerate(series.images['path'])
-                              if layer.source() == path]
+                rows_added = np.where(series.paths == layer.source())[0]
                 for row in rows_added:
                     logger.debug('Added image: {img}'.format(
                         img=series.images['id'][row]))
@@ -691,6 +882,19 @@ class Controller(QtCore.QObject):
         if not self.initialized:
             return
 
+        # Stop fetching data and the thread that fetches it
+        self.pending = None
+        if self.cancel is not None:
+            self.cancel.cancel()
+        if self.work_thread is not None:
+            self.work_thread.quit()
+            self.work_thread.wait()
+            self.work_thread, self.worker = None, None
+
+        # Write cache records kept in memory by the timeseries driver
+        if tsm.ts is not None:
+            tsm.ts.close()
+
         # Swallow error:
         #   layer registry can be deleted before this runs when closing QGIS
         try:
@@ -56,7 +56,11 @@ plot = {
     # Allow custom text/lines/etc from timeseries driver
     'custom': True,
     # Tolerance for clicking data points
-    'picker_tol': 2
+    'picker_tol': 2,
+    # Read plotted bands first when clicking, and other bands afterwards
+    'fetch_plotted_first': True,
+    # Plot data every N images read, newest first, when clicking (0 is off)
+    'snapshot_every': 100
 }
 
 # Dictionary to store plot symbology options
@@ -0,0 +1,141 @@
+""" Stand-ins for GDAL images and Series indexes shared by tests
+"""
+import datetime as dt
+import os
+import threading
+import time
+
+import numpy as np
+
+
+def make_index(n_images, n_bands=3, width=10, height=10, paths=None,
+               folder='stack'):
+    """ Return a Series index (see `Series.to_index`) of a small stack
+
+    Args:
+        n_images (int): number of images, acquired every 16 days from 2000
+        n_bands (int): number of bands of each image
+        width (int): number of columns of each image
+        height (int): number of rows of each image
+        paths (list, optional): paths of each image. Defaults to
+            ``<folder>/<ID>/<ID>_stack``
+        folder (str): folder of images if ``paths`` are not given
+
+    Returns:
+        dict: Series index
+
+    """
+    dates = [dt.date(2000, 1, 1) + dt.timedelta(days=16 * i)
+             for i in range(n_images)]
+    ids = ['LT5012031%sXXX01' % d.strftime('%Y%j') for d in dates]
+    if paths is None:
+        paths = [os.path.join(folder, _id, '%s_stack' % _id) for _id in ids]
+    return {
+        'image_IDs': ids,
+        'filenames': [os.path.basename(path) for path in paths],
+        'paths': list(paths),
+        'ordinals': [d.toordinal() for d in dates],
+        'band_names': ['Band %i' % (b + 1) for b in range(n_bands)],
+        'geotransform': [0.0, 30.0, 0.0, 0.0, 0.0, -30.0],
+        'crs': '',
+        'width': width,
+        'height': height,
+        'count': n_bands,
+        'dtype': np.dtype(np.int16).str
+    }
+
+
+class ImageStack(object):
+    """ Stands in for `gdal.Open` of the images of a stack held in an array
+
+    Images are named by their index within the stack, as are the images of
+    ``make_index(n_images, paths=['0', '1', ...])``.
+
+    Args:
+        data (np.ndarray): (nband, nimage, nrow, ncol) array of the stack
+
+    Attributes:
+        reads (list): row offset and number of rows of each read
+
+    """
+    def __init__(self, data):
+        self.data = data
+        self.reads = []
+
+    def __call__(self, filename, mode):
+        return _StackImage(self, int(filename))
+
+
+class _StackImage(object):
+    """ Stands in for an open GDAL dataset of one image of an `ImageStack`
+    """
+    def __init__(self, stack, i_image):
+        self.stack = stack
+        self.data = stack.data[:, i_image]
+        self.RasterCount, self.RasterYSize, self.RasterXSize = \
+            self.data.shape
+
+    def ReadAsArray(self, xoff, yoff, xsize, ysize):
+        self.stack.reads.append((yoff, ysize))
+        return self.data[:, yoff:yoff + ysize, xoff:xoff + xsize].copy()
+
+
+class PixelReader(object):
+    """ Stands in for `reader.read_pixel`, reading the pixels of Series from
+    arrays instead of images
+
+    Data of an image depend on the pixel read (see `pixel`), so data of
+    different pixels are not the same. Optionally cancels a request once a
+    number of images are read.
+
+    Args:
+        series (list): Series whose images are read
+        n_bands (int): number of bands of each image
+        n_images (int): number of images of each Series
+        cancel (CancelToken, optional): token cancelled after
+            ``cancel_after`` reads
+        cancel_after (int): number of reads before cancelling
+        delay (float): seconds taken by each read, so that reads within
+            threads overlap
+
+    Attributes:
+        reads (int): number of images read
+        max_reading (int): largest number of images read at once
+
+    """
+    def __init__(self, series, n_bands, n_images, cancel=None,
+                 cancel_after=0, delay=0):
+        self.truth = np.arange(n_bands * n_images, dtype=np.int16).reshape(
+            n_bands, n_images) + 1
+        self.column = {}
+        for s in series:
+            self.column.update((path, i) for i, path in
+                               enumerate(s.images['path']))
+        self.cancel, self.cancel_after = cancel, cancel_after
+        self.delay = delay
+        self.reads = 0
+        self.reading, self.max_reading = 0, 0
+        self._lock = threading.Lock()
+
+    def pixel(self, x, y, n=None):
+        """ Return the data of the first ``n`` images of a pixel """
+        return self.truth[:, :n] + 100 * x + 1000 * y
+
+    def __call__(self, filename, x, y, bands=None, out=None):
+        with self._lock:
+            self.reads += 1
+            if self.cancel is not None and self.reads == self.cancel_after:
+                self.cancel.cancel()
+            self.reading += 1
+            self.max_reading = max(self.reading, self.max_reading)
+        if self.delay:
+            time.sleep(self.delay)
+        with self._lock:
+            self.reading -= 1
+        dat = self.pixel(x, y)[:, self.column[filename]]
+        if bands is not None:
+            dat = dat[np.asarray(bands)]
+        if out is not None:
+            out[:] = dat
+            return out
+        return dat.copy()
@@ -0,0 +1,163 @@
+""" Tests for cache quotas and eviction within `ts_driver.cache_manager`
+"""
+import os
+import sqlite3
+
+import pytest
+
+from ..ts_driver import cache_manager
+from ..ts_driver.cache_manager import CacheManager
+from ..ts_driver.cache_store import SQLitePixelStore
+from ..ts_driver.catalog import CATALOG_FILENAME
+
+
+class _Clock(object):
+    """ Stands in for the `time` module, ticking once per call """
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        self.now += 1.0
+        return self.now
+
+
+@pytest.fixture
+def cache(tmpdir, monkeypatch):
+    """ A cache folder with three 100 byte entries, "a" with a sidecar """
+    monkeypatch.setattr(cache_manager, 'time', _Clock())
+    for key in ('a', 'b', 'c'):
+        tmpdir.join(key).write('x' * 100)
+    tmpdir.join('a.sha1').write('x' * 10)
+    return str(tmpdir)
+
+
+def _keys(folder):
+    return sorted(f for f in os.listdir(folder)
+                  if not f.startswith((CacheManager.filename, '.')))
+
+
+def test_enforce_no_quota(cache):
+    manager = CacheManager(cache)
+    assert manager.enforce() == 0
+    assert _keys(cache) == ['a', 'a.sha1', 'b', 'c']
+
+
+def test_enforce_within_quota(cache):
+    manager = CacheManager(cache, quota_bytes=310)
+    assert manager.enforce() == 0
+    assert _keys(cache) == ['a', 'a.sha1', 'b', 'c']
+
+
+def test_enforce_lru(cache):
+    manager = CacheManager(cache, quota_bytes=250, policy='lru')
+    for key in ('a', 'b', 'c', 'a'):
+        manager.record('pixel', key)
+
+    assert manager.enforce() == 1
+    assert _keys(cache) == ['a', 'a.sha1', 'c']
+
+
+def test_enforce_lfu(cache):
+    manager = CacheManager(cache, quota_bytes=250, policy='lfu')
+    for key in ('b', 'a', 'a', 'a', 'c', 'c'):
+        manager.record('pixel', key)
+
+    # "b" was used least often, even though it was not used least recently
+    assert manager.enforce() == 1
+    assert _keys(cache) == ['a', 'a.sha1', 'c']
+
+
+def test_enforce_evicts_sidecars(cache):
+    manager = CacheManager(cache, quota_bytes=100, policy='lru')
+    for key in ('a', 'b', 'c'):
+        manager.record('pixel', key)
+
+    assert manager.enforce() == 2
+    assert _keys(cache) == ['c']
+
+
+def test_enforce_ignores_metadata(cache):
+    with open(os.path.join(cache, CATALOG_FILENAME), 'w') as f:
+        f.write('x' * 1000)
+    manager = CacheManager(cache, quota_bytes=310)
+    manager.record(None, 'a')
+
+    assert manager.enforce() == 0
+    assert os.path.isfile(os.path.join(cache, CATALOG_FILENAME))
+
+
+def test_enforce_forgets_removed_entries(cache):
+    manager = CacheManager(cache, quota_bytes=1000)
+    for key in ('a', 'b'):
+        manager.record('pixel', key)
+    os.remove(os.path.join(cache, 'b'))
+
+    assert manager.enforce() == 0
+    keys = [key for key, _, _, _ in manager.entries()]
+    assert sorted(keys) == ['a', 'c']
+    assert [row[0] for row in manager._connection().execute(
+        'SELECT key FROM access')] == ['a']
+
+
+def test_record_enforces_quota(cache):
+    manager = CacheManager(cache, quota_bytes=250, enforce_every=2)
+    manager.record(None, 'a')
+    assert _keys(cache) == ['a', 'a.sha1', 'b', 'c']
+
+    # Quota is checked every `enforce_every` writes to the cache, evicting
+    # "c" because it was never used
+    manager.record(None, 'b')
+    assert _keys(cache) == ['a', 'a.sha1', 'b']
+
+
+def test_unknown_policy(cache):
+    manager = CacheManager(cache, quota_bytes=250, policy='fifo')
+    assert manager.policy == cache_manager.EVICTION_POLICIES[0]
+    assert manager.enforce() == 1
+
+
+def _access(cache):
+    """ Return access records written to the database of a cache folder """
+    conn = sqlite3.connect(os.path.join(cache, CacheManager.filename))
+    try:
+        return sorted(conn.execute('SELECT key, hits FROM access'))
+    finally:
+        conn.close()
+
+
+def test_close_flushes(cache):
+    manager = CacheManager(cache, flush_every=20)
+    manager.record('pixel', 'a')
+    manager.record(None, 'b')
+    manager.close()
+
+    # Fewer than `flush_every` requests are written once closed
+    assert _access(cache) == [('a', 1), ('b', 0)]
+    assert manager._conn is None
+
+    # Closed managers can still be used
+    manager.record('pixel', 'a')
+    assert manager.report()['hits'] == 2
+
+
+def test_flush_at_exit(cache):
+    manager = CacheManager(cache, flush_every=20)
+    manager.record('pixel', 'c')
+
+    cache_manager._flush_managers()
+
+    assert _access(cache) == [('c', 1)]
+
+
+def test_sqlite_store_closed(cache, monkeypatch):
+    with open(os.path.join(cache, SQLitePixelStore.filename), 'w'):
+        pass
+    closed = []
+    monkeypatch.setattr(SQLitePixelStore, 'close',
+                        lambda store: closed.append(store))
+
+    manager = CacheManager(cache, quota_bytes=100)
+    manager.entries()
+    manager.enforce()
+
+    assert len(closed) == 3
@@ -0,0 +1,278 @@
+""" Tests for pixel cache stores within `ts_driver.cache_store`
+"""
+import sqlite3
+import threading
+
+import numpy as np
+import pytest
+
+from ..ts_driver import cache_store, ts_utils
+from ..ts_driver.cache_store import NPZPixelStore, SQLitePixelStore
+
+IMAGE_IDS = ['LT50120312000%03iXXX01' % doy for doy in range(1, 161, 16)]
+
+
+class _Series(object):
+    """ Holds the data of a pixel in the way `Series` does """
+    description = 'Test Series'
+    cache_prefix = 'yatsm_'
+    cache_suffix = '.npy'
+
+    def __init__(self, image_IDs=IMAGE_IDS, count=3, dtype=np.int16):
+        self.images = {'id': np.array(image_IDs, dtype=object)}
+        self.n = len(image_IDs)
+        self.count = count
+        self.dtype = np.dtype(dtype)
+        self.fingerprint = ts_utils.image_fingerprint(image_IDs, count, dtype)
+        self.data = np.arange(count * self.n, dtype=dtype).reshape(
+            count, self.n)
+
+
+def _name(series, x=1, y=2):
+    return ts_utils.name_cache_pixel(x, y, (series.count, series.n),
+                                     prefix=series.cache_prefix,
+                                     suffix=series.cache_suffix)
+
+
+@pytest.fixture
+def sqlite_store(tmpdir):
+    return SQLitePixelStore.from_folder(str(tmpdir))
+
+
+# NPZPixelStore
+def test_npz_find_previous(tmpdir):
+    store = NPZPixelStore(str(tmpdir))
+    old = _Series(IMAGE_IDS[:-2])
+    store.write_pixel(_name(old), old)
+    older = _Series(IMAGE_IDS[:-3])
+    store.write_pixel(_name(older), older)
+
+    name, image_IDs, Y = store.find_previous(1, 2, _Series())
+
+    assert name == _name(old)
+    assert list(image_IDs) == IMAGE_IDS[:-2]
+    np.testing.assert_array_equal(Y, old.data)
+
+
+def test_npz_find_previous_unreadable(tmpdir, caplog):
+    store = NPZPixelStore(str(tmpdir))
+    old = _Series(IMAGE_IDS[:-2])
+    tmpdir.join(_name(old)).write('not a NumPy zipped array')
+    older = _Series(IMAGE_IDS[:-3])
+    store.write_pixel(_name(older), older)
+
+    name, _, _ = store.find_previous(1, 2, _Series())
+
+    assert name == _name(older)
+    assert 'Could not read previous pixel cache' in caplog.text
+
+
+def test_npz_find_previous_removed(tmpdir, monkeypatch, caplog):
+    store = NPZPixelStore(str(tmpdir))
+    old = _Series(IMAGE_IDS[:-2])
+    store.write_pixel(_name(old), old)
+    older = _Series(IMAGE_IDS[:-3])
+    store.write_pixel(_name(older), older)
+
+    def _cache_lock(cache_folder):
+        raise AssertionError('Searching should not lock the cache folder')
+
+    def _load_removed(filename, _load=ts_utils.load_cache_npz):
+        if filename.endswith(_name(old)):
+            tmpdir.join(_name(old)).remove()
+        return _load(filename)
+    monkeypatch.setattr(ts_utils, 'cache_lock', _cache_lock)
+    monkeypatch.setattr(ts_utils, 'load_cache_npz', _load_removed)
+
+    # Caches removed by other users while searching are skipped
+    name, _, _ = store.find_previous(1, 2, _Series())
+
+    assert name == _name(older)
+    assert 'Could not read previous pixel cache' in caplog.text
+
+
+# SQLitePixelStore
+def test_sqlite_roundtrip(sqlite_store):
+    series = _Series()
+    name = _name(series)
+    assert not sqlite_store.has_pixel(name)
+
+    sqlite_store.write_pixel(name, series)
+
+    assert sqlite_store.has_pixel(name)
+    dat = sqlite_store.read_pixel(name, series)
+    np.testing.assert_array_equal(dat, series.data)
+    assert dat.dtype == np.int16
+    assert sqlite_store.entries() == [(name, series.data.nbytes)]
+    assert sqlite_store.entry_key(name) == 'pixel_cache.sqlite/' + name
+
+
+def test_sqlite_replace_delete(sqlite_store):
+    series = _Series()
+    name = _name(series)
+    sqlite_store.write_pixel(name, series)
+
+    series.data = series.data * 2
+    sqlite_store.write_pixel(name, series)
+    np.testing.assert_array_equal(sqlite_store.read_pixel(name, series),
+                                  series.data)
+    assert len(sqlite_store.entries()) == 1
+
+    sqlite_store.delete_pixel(name)
+    assert not sqlite_store.has_pixel(name)
+    with pytest.raises(IndexError):
+        sqlite_store.read_pixel(name, series)
+
+
+def test_sqlite_validates(sqlite_store):
+    series = _Series()
+    name = _name(series)
+    sqlite_store.write_pixel(name, series)
+
+    with pytest.raises(IndexError):
+        sqlite_store.read_pixel(name, _Series(IMAGE_IDS[::-1]))
+
+
+def test_sqlite_find_previous(sqlite_store):
+    old = _Series(IMAGE_IDS[:-2])
+    sqlite_store.write_pixel(_name(old), old)
+    older = _Series(IMAGE_IDS[:-3])
+    sqlite_store.write_pixel(_name(older), older)
+    sqlite_store.write_pixel(_name(old, x=2), old)
+
+    series = _Series()
+    name, image_IDs, Y = sqlite_store.find_previous(1, 2, series)
+
+    # The cache of the same pixel with the most images is found
+    assert name == _name(old)
+    assert list(image_IDs) == IMAGE_IDS[:-2]
+    np.testing.assert_array_equal(Y, old.data)
+    assert sqlite_store.find_previous(3, 3, series) is None
+    assert sqlite_store.find_previous(1, 2, older) is None
+
+
+def test_sqlite_missing(sqlite_store, tmpdir):
+    series = _Series()
+
+    # A missing database is an empty cache and is not created by reading
+    assert not sqlite_store.has_pixel(_name(series))
+    with pytest.raises(IndexError):
+        sqlite_store.read_pixel(_name(series), series)
+    assert sqlite_store.find_previous(1, 2, series) is None
+    assert sqlite_store.entries() == []
+    assert tmpdir.listdir() == []
+
+
+def test_sqlite_read_only(sqlite_store, tmpdir, monkeypatch):
+    series = _Series()
+    sqlite_store.write_pixel(_name(series), series)
+    sqlite_store.close()
+    monkeypatch.setattr(cache_store.os, 'access', lambda path, mode: False)
+
+    store = SQLitePixelStore.from_folder(str(tmpdir))
+    assert store.has_pixel(_name(series))
+    np.testing.assert_array_equal(store.read_pixel(_name(series), series),
+                                  series.data)
+    with pytest.raises(sqlite3.OperationalError):
+        store.write_pixel(_name(series, x=2), series)
+    assert [f.basename for f in tmpdir.listdir()] == \
+        [SQLitePixelStore.filename]
+
+
+def test_sqlite_close(sqlite_store):
+    series = _Series()
+    sqlite_store.write_pixel(_name(series), series)
+    conn = sqlite_store._connection()
+
+    sqlite_store.close()
+
+    with pytest.raises(sqlite3.ProgrammingError):
+        conn.execute('SELECT 1')
+    # Closed stores can still be used
+    assert sqlite_store.has_pixel(_name(series))
+
+
+def test_sqlite_threads(sqlite_store):
+    series = _Series()
+    errors = []
+
+    def _write(x):
+        try:
+            for y in range(10):
+                sqlite_store.write_pixel(_name(series, x, y), series)
+                sqlite_store.read_pixel(_name(series, x, y), series)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=_write, args=(x, ))
+               for x in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert not errors
+    assert len(sqlite_store.entries()) == 40
+
+
+# open_store
+@pytest.mark.parametrize(('backend', 'cls'), [
+    ('npz', NPZPixelStore),
+    ('sqlite', SQLitePixelStore),
+    ('hdf5', NPZPixelStore)
+])
+def test_open_store(tmpdir, backend, cls):
+    assert isinstance(cache_store.open_store(backend, str(tmpdir)), cls)
+
+
+# MemoryCache
+def test_memory_cache():
+    cache = cache_store.MemoryCache(max_bytes=1024)
+    value = np.zeros(10, dtype=np.int16)
+
+    assert cache.get('a') is None
+    cache.put('a', value)
+
+    assert cache.get('a') is value
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'evictions': 0,
+                             'entries': 1, 'nbytes': 20, 'max_bytes': 1024}
+
+    # Replacing a value does not count it twice
+    cache.put('a', np.zeros(20, dtype=np.int16))
+    assert cache.nbytes == 40
+    assert len(cache) == 1
+
+
+def test_memory_cache_evict():
+    cache = cache_store.MemoryCache(max_bytes=300)
+    for key in 'abc':
+        cache.put(key, np.zeros(100, dtype=np.uint8))
+    cache.get('a')
+
+    cache.put('d', np.zeros(100, dtype=np.uint8))
+
+    # Least recently used value is dropped to stay within size
+    assert cache.get('b') is None
+    assert all(cache.get(key) is not None for key in 'acd')
+    assert cache.evictions == 1
+
+    cache.resize(100)
+    assert len(cache) == 1
+    assert cache.get('d') is not None
+
+
+def test_memory_cache_disabled():
+    cache = cache_store.MemoryCache(max_bytes=0)
+    cache.put('a', np.zeros(10))
+    assert cache.get('a') is None
+    assert len(cache) == 0
+
+
+def test_estimate_nbytes():
+    value = (np.zeros(10), {'a': np.zeros(5, dtype=np.int16)}, [np.zeros(2)])
+    assert cache_store.estimate_nbytes(value) == 80 + 10 + 16
+
+    class _Model(object):
+        def __init__(self):
+            self.coef = np.zeros(100)
+    assert cache_store.estimate_nbytes(_Model()) > 800
@@ -0,0 +1,106 @@
+""" Tests for persisted image catalogs within `ts_driver.catalog`
+"""
+import os
+import time
+
+from ..ts_driver import catalog
+
+PARAMS = {'pattern': 'L*stack', 'ignore_dirs': [], 'date_format': '%Y%j'}
+
+
+class _Series(object):
+    """ Returns an index of images in the way `Series` does """
+    def __init__(self, paths):
+        self.paths = paths
+
+    def to_index(self):
+        return {'paths': self.paths, 'image_IDs': [
+            os.path.basename(os.path.dirname(p)) for p in self.paths]}
+
+
+def _age(location, seconds=60):
+    """ Set modification time of all directories in ``location`` to the past
+    """
+    mtime = time.time() - seconds
+    for root, dirs, files in os.walk(location):
+        os.utime(root, (mtime, mtime))
+
+
+def _make_dataset(tmpdir, ids=('LT50120312000001XXX01',
+                               'LT50120312000017XXX01')):
+    location = tmpdir.join('dataset')
+    paths = []
+    for _id in ids:
+        image = location.join('images', _id, '%s_stack' % _id)
+        image.ensure()
+        paths.append(str(image))
+    _age(str(location))
+    return str(location), paths
+
+
+def test_catalog_roundtrip(tmpdir):
+    location, paths = _make_dataset(tmpdir)
+    filename = str(tmpdir.join('cache', catalog.CATALOG_FILENAME))
+    tmpdir.mkdir('cache')
+    scan_state = {location: [0.0, [], ['images'], 0.0]}
+
+    catalog.write_catalog(filename, location, PARAMS, _Series(paths),
+                          scan_state=scan_state)
+    index, state = catalog.read_catalog(filename, location, PARAMS)
+
+    assert index == _Series(paths).to_index()
+    assert state == scan_state
+
+
+def test_catalog_missing(tmpdir):
+    location, _ = _make_dataset(tmpdir)
+    filename = str(tmpdir.join(catalog.CATALOG_FILENAME))
+
+    assert catalog.read_catalog(filename, location, PARAMS) == (None, {})
+
+
+def test_catalog_other_params(tmpdir):
+    location, paths = _make_dataset(tmpdir)
+    filename = str(tmpdir.join(catalog.CATALOG_FILENAME))
+    catalog.write_catalog(filename, location, PARAMS, _Series(paths),
+                          scan_state={location: []})
+
+    params = dict(PARAMS, pattern='*.tif')
+    # Directory listings of another search are not reused either
+    assert catalog.read_catalog(filename, location, params) == (None, {})
+    other = str(tmpdir.mkdir('other'))
+    assert catalog.read_catalog(filename, other, PARAMS) == (None, {})
+
+
+def test_catalog_new_image(tmpdir):
+    location, paths = _make_dataset(tmpdir)
+    filename = str(tmpdir.join(catalog.CATALOG_FILENAME))
+    scan_state = {location: [0.0, [], ['images'], 0.0]}
+    catalog.write_catalog(filename, location, PARAMS, _Series(paths),
+                          scan_state=scan_state)
+
+    _make_dataset(tmpdir, ids=('LT50120312000033XXX01', ))
+
+    # Listings are kept so only changed directories are searched again
+    assert catalog.read_catalog(filename, location, PARAMS) == (
+        None, scan_state)
+
+
+def test_catalog_recently_modified(tmpdir):
+    location, paths = _make_dataset(tmpdir)
+    _age(location, seconds=0)
+    filename = str(tmpdir.join(catalog.CATALOG_FILENAME))
+    catalog.write_catalog(filename, location, PARAMS, _Series(paths))
+
+    # Directories modified just before writing may have changed unnoticed
+    index, _ = catalog.read_catalog(filename, location, PARAMS)
+    assert index is None
+
+
+def test_catalog_unreadable(tmpdir, caplog):
+    location, _ = _make_dataset(tmpdir)
+    filename = tmpdir.join(catalog.CATALOG_FILENAME)
+    filename.write('{not json')
+
+    assert catalog.read_catalog(str(filename), location, PARAMS) == (None, {})
+    assert 'Could not read image catalog' in caplog.text
@@ -0,0 +1,327 @@
+""" Tests for scheduling requests to fetch data within the `Controller`
+and fetching data within its `Worker`
+"""
+from functools import partial
+
+import numpy as np
+import pytest
+
+pytest.importorskip('PyQt4')
+pytest.importorskip('qgis')
+
+from PyQt4 import QtCore  # noqa
+
+from .. import controller, settings  # noqa
+from ..controller import Controller  # noqa
+from ..ts_driver.cancel import CancelToken, FetchCancelled  # noqa
+
+
+class _Iface(object):
+    """ Stands in for the QGIS interface, ignoring calls """
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self
+
+    def toWkt(self):
+        return ''
+
+
+@pytest.fixture
+def qapp():
+    return QtCore.QCoreApplication.instance() or QtCore.QCoreApplication([])
+
+
+@pytest.fixture
+def ctrl(monkeypatch):
+    monkeypatch.setitem(settings.plot, 'fetch_plotted_first', False)
+    monkeypatch.setattr(controller, 'qgis_log', lambda *args, **kwargs: None)
+    ctrl = Controller(_Iface(), None, [])
+    ctrl.started = []
+
+    def _start(pos, crs_wkt, bands):
+        ctrl.working = True
+        ctrl.cancel = controller.CancelToken()
+        ctrl.pending = None
+        ctrl.started.append(pos)
+    monkeypatch.setattr(ctrl, '_plot_request_start', _start)
+    monkeypatch.setattr(ctrl, '_clear_snapshots', lambda: None)
+    monkeypatch.setattr(ctrl, 'update_plot', lambda: None)
+    monkeypatch.setattr(ctrl, 'plot_request_geometry', lambda: None)
+    return ctrl
+
+
+def test_plot_request(ctrl):
+    ctrl.plot_request((1, 2))
+
+    assert ctrl.started == [(1, 2)]
+    assert ctrl.working
+
+
+def test_plot_request_latest_wins(ctrl):
+    ctrl.plot_request((1, 2))
+    cancel = ctrl.cancel
+
+    for pos in [(3, 4), (5, 6), (7, 8)]:
+        ctrl.plot_request(pos)
+
+    # The request in progress is cancelled and only the latest click waits
+    assert cancel.cancelled
+    assert ctrl.started == [(1, 2)]
+    assert ctrl.pending[0] == (7, 8)
+
+    ctrl.plot_request_cancelled()
+
+    assert ctrl.started == [(1, 2), (7, 8)]
+    assert ctrl.pending is None
+    assert not ctrl.cancel.cancelled
+
+
+def test_plot_request_finished_superseded(ctrl, monkeypatch):
+    updated = []
+    monkeypatch.setattr(ctrl, 'update_plot', lambda: updated.append(True))
+    ctrl.plot_request((1, 2))
+    ctrl.plot_request((3, 4))
+
+    # Data finished before the worker saw the cancellation are not plotted
+    ctrl.plot_request_finish()
+
+    assert ctrl.started == [(1, 2), (3, 4)]
+    assert updated == []
+
+    ctrl.plot_request_finish()
+    assert not ctrl.working
+    assert updated == [True]
+
+
+def test_plot_request_cancel(ctrl):
+    ctrl.plot_request((1, 2))
+    ctrl.but_cancel = _Iface()
+    ctrl.plot_request((3, 4))
+
+    # Cancelling by the user drops queued clicks too
+    ctrl.plot_request_cancel()
+    ctrl.plot_request_cancelled()
+
+    assert ctrl.started == [(1, 2)]
+    assert not ctrl.working
+
+
+def test_plot_request_cancelled_redraw(ctrl, monkeypatch):
+    updated = []
+    monkeypatch.setattr(ctrl, 'update_plot', lambda: updated.append(True))
+    ctrl.but_cancel = _Iface()
+
+    # Plots of data that were not kept are replaced
+    ctrl.plot_request((1, 2))
+    ctrl.partial_plotted = True
+    ctrl.plot_request_cancel()
+    ctrl.plot_request_cancelled()
+    assert updated == [True]
+
+    # Plots are left alone if nothing was plotted while fetching
+    ctrl.plot_request((3, 4))
+    ctrl.plot_request_cancel()
+    ctrl.plot_request_cancelled()
+    assert updated == [True]
+
+    # A queued click plots its own data instead
+    ctrl.plot_request((5, 6))
+    ctrl.partial_plotted = True
+    ctrl.plot_request((7, 8))
+    ctrl.plot_request_cancelled()
+    assert ctrl.started == [(1, 2), (3, 4), (5, 6), (7, 8)]
+    assert updated == [True]
+
+
+def test_init_worker_once(ctrl, qapp):
+    ctrl._init_worker()
+    worker, thread = ctrl.worker, ctrl.work_thread
+    try:
+        ctrl._init_worker()
+
+        # One worker and thread are reused for every request
+        assert ctrl.worker is worker
+        assert ctrl.work_thread is thread
+        assert thread.isRunning()
+    finally:
+        thread.quit()
+        thread.wait()
+
+
+# Worker
+class _Parent(QtCore.QObject):
+    """ Sends requests to fetch data to a `Worker` """
+    fetch_data = QtCore.pyqtSignal(object, object, str, object, object, int)
+
+
+class _Series(object):
+    remaining_bands = None
+
+
+class _TimeSeries(object):
+    """ Stands in for a timeseries driver, recording calls made
+
+    Optionally cancels a request once ``cancel_at`` percent is yielded.
+    """
+    has_results = True
+
+    def __init__(self, n=10, cancel_at=None):
+        self.n, self.cancel_at = n, cancel_at
+        self.series = [_Series()]
+        self.calls = []
+
+    def fetch_data(self, mx, my, crs_wkt, bands=None, cancel=None,
+                   snapshot=None, snapshot_every=100):
+        self.calls.append('fetch_data')
+        for i in range(1, self.n + 1):
+            percent = i * 100.0 / self.n
+            if percent == self.cancel_at:
+                cancel.cancel()
+            yield percent
+        if bands:
+            self.series[0].remaining_bands = [1]
+
+    def fetch_remaining(self, cancel=None):
+        self.calls.append('fetch_remaining')
+        self.series[0].remaining_bands = None
+        yield 100.0
+
+    def fetch_results(self):
+        self.calls.append('fetch_results')
+
+
+def _record(signals, name, *args):
+    signals.append((name, ) + args)
+
+
+@pytest.fixture
+def worker():
+    worker = controller.Worker(_Parent())
+    worker.signals = []
+    for name in ('update', 'stage', 'snapshot', 'partial_finished',
+                 'finished', 'cancelled', 'errored'):
+        getattr(worker, name).connect(partial(_record, worker.signals, name))
+    return worker
+
+
+def _signals(worker, *names):
+    return [s for s in worker.signals if s[0] in names]
+
+
+def test_fetch_results_stage(worker):
+    ts = _TimeSeries()
+
+    worker.fetch(ts, (0, 0), '', None, CancelToken(), 0)
+
+    # Results are fetched by the worker once data are read
+    assert ts.calls == ['fetch_data', 'fetch_results']
+    assert _signals(worker, 'stage', 'finished') == [
+        ('stage', 'Fetching results'), ('finished', )]
+
+
+def test_fetch_results_cancelled(worker):
+    ts = _TimeSeries(cancel_at=50.0)
+
+    worker.fetch(ts, (0, 0), '', None, CancelToken(), 0)
+
+    assert ts.calls == ['fetch_data']
+    assert _signals(worker, 'stage', 'finished', 'cancelled') == [
+        ('cancelled', )]
+
+
+def test_fetch_results_not_cancelled(worker, monkeypatch):
+    ts = _TimeSeries()
+    cancel = CancelToken()
+
+    def _fetch_results():
+        ts.calls.append('fetch_results')
+        cancel.cancel()
+    monkeypatch.setattr(ts, 'fetch_results', _fetch_results)
+
+    worker.fetch(ts, (0, 0), '', None, cancel, 0)
+
+    # Results of data already kept are fetched, even if cancelled meanwhile
+    assert ts.calls == ['fetch_data', 'fetch_results']
+    assert _signals(worker, 'finished', 'cancelled') == [('finished', )]
+
+
+def test_fetch_results_error(worker, monkeypatch):
+    ts = _TimeSeries()
+
+    def _fail():
+        raise ValueError('Could not fit model')
+    monkeypatch.setattr(ts, 'fetch_results', _fail)
+
+    worker.fetch(ts, (0, 0), '', None, CancelToken(), 0)
+
+    # Data are still plotted without results
+    assert _signals(worker, 'finished', 'errored') == [('finished', )]
+
+
+def test_fetch_results_none(worker, monkeypatch):
+    ts = _TimeSeries()
+    monkeypatch.setattr(ts, 'has_results', False)
+
+    worker.fetch(ts, (0, 0), '', None, CancelToken(), 0)
+
+    assert ts.calls == ['fetch_data', 'fetch_results']
+    assert _signals(worker, 'stage') == []
+
+
+def test_progress_throttled(worker):
+    ts = _TimeSeries(n=1000)
+
+    worker.fetch(ts, (0, 0), '', None, CancelToken(), 0)
+
+    # Reads quicker than the interval signal only the first and last progress
+    assert _signals(worker, 'update') == [('update', 0.1), ('update', 100.0)]
+
+
+def test_progress_step(worker, monkeypatch):
+    monkeypatch.setattr(worker, 'progress_interval', 0.0)
+    monkeypatch.setattr(worker, 'progress_step', 10.0)
+    ts = _TimeSeries(n=100)
+
+    worker.fetch(ts, (0, 0), '', None, CancelToken(), 0)
+
+    assert _signals(worker, 'update') == [
+        ('update', float(p)) for p in range(1, 100, 10)] + [('update', 100.0)]
+
+
+def test_progress_cancelled(worker):
+    cancel = CancelToken()
+    ts = _TimeSeries(n=1000, cancel_at=50.0)
+    progress = ts.fetch_data(0, 0, '', cancel=cancel)
+
+    with pytest.raises(FetchCancelled):
+        worker._progress(progress, cancel)
+
+    # Reads stop once cancelled
+    with pytest.raises(StopIteration):
+        next(progress)
+
+
+def test_fetch_partial(worker):
+    ts = _TimeSeries()
+
+    worker.fetch(ts, (0, 0), '', {0: [0]}, CancelToken(), 0)
+
+    # Bands read first are plotted while the other bands are read
+    assert ts.calls == ['fetch_data', 'fetch_remaining', 'fetch_results']
+    assert _signals(worker, 'partial_finished', 'finished') == [
+        ('partial_finished', ), ('finished', )]
+
+
+def test_snapshot_throttled(worker, monkeypatch):
+    monkeypatch.setattr(worker, 'snapshot_interval', 60.0)
+    data = np.zeros((3, 4))
+    read = np.array([False, False, True, True])
+
+    worker._snapshot(0, data, read, None)
+    worker._snapshot(0, data, read, None)
+    worker._snapshot(1, data, read, None)
+    worker._snapshot(0, data, np.ones(4, dtype=np.bool), None)
+
+    # Snapshots of completely read Series are always signalled
+    snapshots = _signals(worker, 'snapshot')
+    assert len(snapshots) == 2
+    assert snapshots[1][1][2].all()
@@ -0,0 +1,100 @@
+""" Tests for converting stacks into and reading from timeseries cubes
+"""
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip('osgeo')
+
+from ..ts_driver import cube, reader  # noqa
+from ..ts_driver.cube import CubeSeries, INDEX_FILENAME  # noqa
+from ..ts_driver.reader import DatasetPool  # noqa
+from ..ts_driver.series import Series  # noqa
+from .conftest import ImageStack, make_index  # noqa
+
+N_IMAGES, N_BANDS, NROW, NCOL = 6, 3, 7, 5
+TRUTH = np.arange(N_BANDS * N_IMAGES * NROW * NCOL, dtype=np.int16).reshape(
+    N_BANDS, N_IMAGES, NROW, NCOL)
+
+
+def _index(n_images=N_IMAGES):
+    """ Return a Series index of images named by their index within `TRUTH`
+    """
+    return make_index(n_images, n_bands=N_BANDS, width=NCOL, height=NROW,
+                      paths=['%i' % i for i in range(n_images)])
+
+
+@pytest.fixture
+def images(monkeypatch):
+    images = ImageStack(TRUTH)
+    monkeypatch.setattr(reader.gdal, 'Open', images)
+    monkeypatch.setattr(cube, 'dataset_pool', DatasetPool(size=0))
+    return images
+
+
+def _cube_series(location, monkeypatch):
+    series = CubeSeries(location)
+
+    def _locate(mx, my, crs_wkt):
+        series.px, series.py = int(mx), int(my)
+    monkeypatch.setattr(series, '_locate', _locate)
+    return series
+
+
+def test_convert_stack(tmpdir, images, monkeypatch):
+    location = str(tmpdir.join('cube'))
+    series = Series(None, index=_index())
+
+    rows = list(cube.convert_stack(series, location, chunk_rows=3))
+
+    assert rows == [0, 3, 6]
+    assert len(images.reads) == 3 * N_IMAGES
+    index = cube.read_cube_index(location)
+    assert index['chunks'] == ['r0.npy', 'r3.npy', 'r6.npy']
+    assert np.load(os.path.join(location, 'r6.npy')).shape == (
+        1, NCOL, N_BANDS, N_IMAGES)
+
+    cube_series = _cube_series(location, monkeypatch)
+    assert cube_series.fingerprint == series.fingerprint
+    for y in range(NROW):
+        for x in range(NCOL):
+            list(cube_series.fetch_data(x, y, ''))
+            np.testing.assert_array_equal(cube_series.data,
+                                          TRUTH[:, :, y, x])
+            assert cube_series.data.dtype == np.int16
+    assert cube_series.metrics.counters['cube_hits'] == NROW * NCOL
+
+
+def test_convert_stack_resume(tmpdir, images):
+    location = str(tmpdir.join('cube'))
+    series = Series(None, index=_index())
+
+    # Interrupt conversion after the first chunk
+    for row in cube.convert_stack(series, location, chunk_rows=3):
+        break
+    assert not os.path.isfile(os.path.join(location, INDEX_FILENAME))
+
+    images.reads = []
+    assert list(cube.convert_stack(series, location, chunk_rows=3)) == [3, 6]
+    assert len(images.reads) == 2 * N_IMAGES
+    assert os.path.isfile(os.path.join(location, INDEX_FILENAME))
+
+    # Nothing is rewritten for a complete cube
+    assert list(cube.convert_stack(series, location, chunk_rows=3)) == []
+
+
+def test_convert_stack_new_images(tmpdir, images, monkeypatch):
+    location = str(tmpdir.join('cube'))
+    list(cube.convert_stack(Series(None, index=_index(N_IMAGES - 1)),
+                            location, chunk_rows=3))
+
+    # Chunks written for other images are rewritten
+    series = Series(None, index=_index())
+    assert list(cube.convert_stack(series, location, chunk_rows=3)) == [
+        0, 3, 6]
+
+    cube_series = _cube_series(location, monkeypatch)
+    assert cube_series.n == N_IMAGES
+    list(cube_series.fetch_data(2, 4, ''))
+    np.testing.assert_array_equal(cube_series.data, TRUTH[:, :, 4, 2])
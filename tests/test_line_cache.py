@@ -0,0 +1,99 @@
+""" Tests for building line caches within `ts_driver.line_cache`
+"""
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip('osgeo')
+
+from ..ts_driver import line_cache, reader, ts_utils  # noqa
+from ..ts_driver.reader import DatasetPool  # noqa
+from ..ts_driver.series import Series  # noqa
+from .conftest import ImageStack, make_index  # noqa
+
+N_IMAGES, N_BANDS, NROW, NCOL = 6, 3, 7, 5
+TRUTH = np.arange(N_BANDS * N_IMAGES * NROW * NCOL, dtype=np.int16).reshape(
+    N_BANDS, N_IMAGES, NROW, NCOL)
+
+
+@pytest.fixture
+def images(monkeypatch):
+    images = ImageStack(TRUTH)
+    monkeypatch.setattr(reader.gdal, 'Open', images)
+    monkeypatch.setattr(line_cache, 'dataset_pool', DatasetPool(size=0))
+    return images
+
+
+@pytest.fixture
+def series(images):
+    index = make_index(N_IMAGES, n_bands=N_BANDS, width=NCOL, height=NROW,
+                       paths=['%i' % i for i in range(N_IMAGES)])
+    return Series(None, index=index,
+                  config={'cache_prefix': 'yatsm_', 'cache_suffix': '.npy'})
+
+
+def _line(series, cache_folder, row, fmt):
+    return os.path.join(cache_folder, ts_utils.name_cache_line(
+        row, series.data.shape, prefix=series.cache_prefix,
+        suffix=series.cache_suffix, ext='.' + fmt))
+
+
+@pytest.mark.parametrize('fmt', ['npz', 'npy'])
+def test_build_line_cache(series, images, tmpdir, fmt):
+    cache_folder = str(tmpdir.join('cache'))
+
+    done = list(line_cache.build_line_cache(series, cache_folder,
+                                            block_rows=3, fmt=fmt))
+
+    assert done == [3, 6, 7]
+    # Each image is read once per block of rows
+    assert sorted(set(images.reads)) == [(0, 3), (3, 3), (6, 1)]
+    assert len(images.reads) == 3 * N_IMAGES
+    for row in range(NROW):
+        filename = _line(series, cache_folder, row, fmt)
+        for col in range(NCOL):
+            if fmt == 'npy':
+                dat = ts_utils.read_cache_line_column(filename, series, col)
+            else:
+                dat = ts_utils.read_cache_line(filename, series)[..., col]
+            np.testing.assert_array_equal(dat, TRUTH[:, :, row, col])
+
+
+def test_build_line_cache_rows(series, images, tmpdir):
+    cache_folder = str(tmpdir)
+
+    done = list(line_cache.build_line_cache(series, cache_folder,
+                                            rows=(2, 100), block_rows=10))
+
+    assert done == [5]
+    assert images.reads == [(2, 5)] * N_IMAGES
+    assert not os.path.exists(_line(series, cache_folder, 1, 'npz'))
+
+
+def test_build_line_cache_resume(series, images, tmpdir):
+    cache_folder = str(tmpdir)
+    list(line_cache.build_line_cache(series, cache_folder, rows=(0, 2)))
+    list(line_cache.build_line_cache(series, cache_folder, rows=(3, 4)))
+    images.reads = []
+
+    done = list(line_cache.build_line_cache(series, cache_folder,
+                                            block_rows=4))
+
+    # Existing rows are skipped and blocks do not span them
+    assert done == [3, 4, 7]
+    assert sorted(set(images.reads)) == [(2, 1), (4, 3)]
+    assert list(line_cache.build_line_cache(series, cache_folder)) == [7]
+
+
+def test_build_line_cache_invalid(series, images, tmpdir):
+    cache_folder = str(tmpdir)
+    list(line_cache.build_line_cache(series, cache_folder, fmt='npy'))
+    with open(_line(series, cache_folder, 1, 'npy') + '.sha1', 'w') as f:
+        f.write('other images')
+    images.reads = []
+
+    done = list(line_cache.build_line_cache(series, cache_folder, fmt='npy'))
+
+    assert done == [6, 7]
+    assert sorted(set(images.reads)) == [(1, 1)]
@@ -0,0 +1,91 @@
+""" Tests for counters and timers within `ts_driver.metrics`
+"""
+import json
+import threading
+
+from ..ts_driver.metrics import Metrics, dump_metrics
+
+
+def test_count():
+    metrics = Metrics()
+
+    metrics.count('pixel_cache_hits')
+    metrics.count('pixel_cache_hits')
+    metrics.count('bytes_read', 160)
+
+    assert metrics.counters == {'pixel_cache_hits': 2, 'bytes_read': 160}
+
+
+def test_timer():
+    metrics = Metrics()
+    metrics.add_time('read_images', 2.0)
+    metrics.add_time('read_images', 1.0)
+    with metrics.timer('locate'):
+        pass
+
+    assert metrics.timers['read_images'] == {
+        'count': 2, 'total': 3.0, 'last': 1.0, 'max': 2.0}
+    assert metrics.timers['locate']['count'] == 1
+
+
+def test_timer_error():
+    metrics = Metrics()
+    try:
+        with metrics.timer('read_pixel_cache'):
+            raise IOError('Cannot read cache')
+    except IOError:
+        pass
+
+    # Phases ending in errors are still timed
+    assert metrics.timers['read_pixel_cache']['count'] == 1
+
+
+def test_as_dict_reset():
+    metrics = Metrics()
+    metrics.count('fetches')
+    metrics.add_time('fetch_data', 1.0)
+
+    d = metrics.as_dict()
+    metrics.count('fetches')
+    metrics.add_time('fetch_data', 1.0)
+
+    # Copies are not changed by later counts
+    assert d == {'counters': {'fetches': 1},
+                 'timers': {'fetch_data': {'count': 1, 'total': 1.0,
+                                           'last': 1.0, 'max': 1.0}}}
+    metrics.reset()
+    assert metrics.as_dict() == {'counters': {}, 'timers': {}}
+
+
+def test_threads():
+    metrics = Metrics()
+
+    def _count():
+        for _ in range(1000):
+            metrics.count('images_read')
+            metrics.add_time('read_images', 0.001)
+
+    threads = [threading.Thread(target=_count) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert metrics.counters['images_read'] == 8000
+    assert metrics.timers['read_images']['count'] == 8000
+
+
+def test_dump_metrics(tmpdir):
+    metrics = Metrics()
+    metrics.count('fetches')
+    filename = str(tmpdir.join('metrics', 'session.json'))
+
+    dump_metrics(filename, {'series': [metrics.as_dict()]})
+    metrics.count('fetches')
+    dump_metrics(filename, {'series': [metrics.as_dict()]})
+
+    with open(filename) as f:
+        d = json.load(f)
+    assert d['series'][0]['counters'] == {'fetches': 2}
+    assert tmpdir.join('metrics').listdir() == [tmpdir.join('metrics',
+                                                            'session.json')]
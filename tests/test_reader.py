@@ -0,0 +1,336 @@
+""" Tests for pooling datasets and reading pixels within `ts_driver.reader`
+"""
+import gc
+import threading
+import weakref
+
+import numpy as np
+import pytest
+
+pytest.importorskip('osgeo')
+
+from ..ts_driver import reader  # noqa
+from ..ts_driver.reader import BlockCache, DatasetPool  # noqa
+
+
+class _Dataset(object):
+    """ Stands in for an open GDAL dataset of one (nband, 1, 1) pixel """
+    RasterCount = 4
+    data = np.arange(1, 5, dtype=np.int16)
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.reads = []
+
+    def GetRasterBand(self, band):
+        return self
+
+    @property
+    def DataType(self):
+        return 'int16'
+
+    def ReadRaster(self, x, y, xsize, ysize, band_list=None):
+        self.reads.append(band_list)
+        return self.data[np.asarray(band_list) - 1].tobytes()
+
+
+class _Image(object):
+    """ Stands in for an open GDAL dataset of a (nband, nrow, ncol) image
+    stored in 4x4 pixel blocks
+    """
+    data = np.arange(3 * 10 * 10, dtype=np.int16).reshape(3, 10, 10)
+    RasterCount, RasterYSize, RasterXSize = data.shape
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.reads = 0
+
+    def GetRasterBand(self, band):
+        return self
+
+    def GetBlockSize(self):
+        return [4, 4]
+
+    def ReadAsArray(self, xoff, yoff, xsize, ysize):
+        self.reads += 1
+        return self.data[:, yoff:yoff + ysize, xoff:xoff + xsize].copy()
+
+
+class _Opener(object):
+    """ Stands in for `gdal.Open`, keeping track of datasets opened """
+    def __init__(self, cls=_Dataset):
+        self.cls = cls
+        self.opened = []
+        self._lock = threading.Lock()
+
+    def __call__(self, filename, mode):
+        ds = self.cls(filename)
+        with self._lock:
+            self.opened.append(weakref.ref(ds))
+        return ds
+
+    def n_open(self):
+        gc.collect()
+        return len([ref for ref in self.opened if ref() is not None])
+
+
+@pytest.fixture
+def opener(monkeypatch):
+    opener = _Opener()
+    monkeypatch.setattr(reader.gdal, 'Open', opener)
+    return opener
+
+
+def _scan(pool, filenames):
+    for f in filenames:
+        with pool.dataset(f) as ds:
+            assert ds.filename == f
+
+
+FILENAMES = ['image_%i.tif' % i for i in range(10)]
+
+
+def test_dataset_pool_reuse(opener):
+    pool = DatasetPool(size=len(FILENAMES))
+
+    _scan(pool, FILENAMES)
+    _scan(pool, FILENAMES)
+
+    assert pool.stats() == {'opens': 10, 'hits': 10, 'evictions': 0,
+                            'open': 10, 'size': 10}
+    assert len(opener.opened) == 10
+
+
+def test_dataset_pool_checkout(opener):
+    pool = DatasetPool(size=2)
+
+    with pool.dataset('a') as ds1:
+        # A dataset in use is not handed out twice
+        with pool.dataset('a') as ds2:
+            assert ds1 is not ds2
+        assert len(pool) == 1
+    # Only one handle per filename is kept
+    ds1 = ds2 = None
+    assert len(pool) == 1
+    assert opener.n_open() == 1
+
+
+def test_dataset_pool_cyclic_scan(opener):
+    pool = DatasetPool(size=4)
+
+    _scan(pool, FILENAMES)
+    _scan(pool, FILENAMES)
+
+    # The first datasets are kept open instead of cycling through all of them
+    assert pool.hits == 4
+    assert pool.opens == 16
+    assert len(pool) == 4
+    assert opener.n_open() == 4
+
+
+def test_dataset_pool_eviction_closes(opener):
+    pool = DatasetPool(size=len(FILENAMES))
+    _scan(pool, FILENAMES)
+    assert opener.n_open() == 10
+
+    pool.resize(3)
+    assert len(pool) == 3
+    assert opener.n_open() == 3
+
+    pool.evict(FILENAMES[-1])
+    assert opener.n_open() == 2
+
+    pool.clear()
+    assert len(pool) == 0
+    assert opener.n_open() == 0
+    assert pool.evictions == 10
+
+
+def test_dataset_pool_switch(opener):
+    pool = DatasetPool(size=4)
+    _scan(pool, FILENAMES[:4])
+
+    # Datasets of another time series are pooled once the pool is cleared
+    pool.clear()
+    _scan(pool, FILENAMES[4:8])
+    _scan(pool, FILENAMES[4:8])
+
+    assert pool.hits == 4
+    assert opener.n_open() == 4
+
+
+def test_dataset_pool_disabled(opener):
+    pool = DatasetPool(size=0)
+
+    _scan(pool, FILENAMES)
+
+    assert len(pool) == 0
+    assert opener.n_open() == 0
+    assert pool.opens == 10
+
+
+@pytest.mark.parametrize('size', [0, 3, 10])
+def test_dataset_pool_threads(opener, size):
+    pool = DatasetPool(size=size)
+    in_use = set()
+    errors = []
+    lock = threading.Lock()
+
+    def _read():
+        for _ in range(20):
+            for f in FILENAMES:
+                with pool.dataset(f) as ds:
+                    with lock:
+                        if id(ds) in in_use:
+                            errors.append(f)
+                        in_use.add(id(ds))
+                    with lock:
+                        in_use.discard(id(ds))
+
+    threads = [threading.Thread(target=_read) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert not errors
+    assert pool.opens + pool.hits == 8 * 20 * len(FILENAMES)
+    assert len(pool) <= size
+    assert opener.n_open() == len(pool)
+
+
+# read_pixel_GDAL
+@pytest.fixture
+def pixel_reader(opener, monkeypatch):
+    monkeypatch.setattr(reader.gdal_array, 'GDALTypeCodeToNumericTypeCode',
+                        np.dtype)
+    monkeypatch.setattr(reader, 'dataset_pool', DatasetPool(size=1))
+    return opener
+
+
+@pytest.mark.parametrize(('bands', 'band_list'), [
+    (None, [1, 2, 3, 4]),
+    ([0, 2], [1, 3]),
+    (np.array([3]), [4])
+])
+def test_read_pixel_GDAL(pixel_reader, bands, band_list):
+    dat = reader.read_pixel_GDAL('a', 0, 0, bands=bands)
+
+    np.testing.assert_array_equal(dat, band_list)
+    assert dat.dtype == np.int16
+    # All bands are read with one call
+    with reader.dataset_pool.dataset('a') as ds:
+        assert ds.reads == [band_list]
+
+
+def test_read_pixel_GDAL_out(pixel_reader):
+    scratch = np.zeros((4, 3), dtype=np.int16)
+
+    dat = reader.read_pixel_GDAL('a', 0, 0, out=scratch[:, 1])
+
+    assert dat.base is scratch
+    np.testing.assert_array_equal(scratch[:, 1], _Dataset.data)
+    assert not scratch[:, [0, 2]].any()
+
+
+# BlockCache
+@pytest.fixture
+def image_pool(monkeypatch):
+    opener = _Opener(cls=_Image)
+    monkeypatch.setattr(reader.gdal, 'Open', opener)
+    monkeypatch.setattr(reader, 'dataset_pool', DatasetPool(size=1))
+    return opener
+
+
+def _block_reads(filename='a'):
+    with reader.dataset_pool.dataset(filename) as ds:
+        return ds.reads
+
+
+def test_block_cache_neighbors(image_pool):
+    cache = BlockCache(max_bytes=1024 ** 2)
+
+    for y, x in [(0, 0), (1, 2), (3, 3), (2, 1)]:
+        np.testing.assert_array_equal(cache.read_pixel('a', x, y),
+                                      _Image.data[:, y, x])
+
+    # Pixels within the first block are read with one read
+    assert _block_reads() == 1
+    assert cache.stats()['misses'] == 1
+    assert cache.stats()['hits'] == 3
+    assert len(cache) == 1
+
+
+def test_block_cache_edges(image_pool):
+    cache = BlockCache(max_bytes=1024 ** 2)
+
+    for y in range(_Image.RasterYSize):
+        for x in range(_Image.RasterXSize):
+            np.testing.assert_array_equal(cache.read_pixel('a', x, y),
+                                          _Image.data[:, y, x])
+
+    # 3x3 blocks, including partial blocks at the right and bottom edges
+    assert _block_reads() == 9
+    assert cache.nbytes == _Image.data.nbytes
+
+
+def test_block_cache_bands_out(image_pool):
+    cache = BlockCache(max_bytes=1024 ** 2)
+    out = np.zeros(2, dtype=np.int16)
+
+    dat = cache.read_pixel('a', 5, 6, bands=[2, 0], out=out)
+
+    assert dat is out
+    np.testing.assert_array_equal(out, _Image.data[[2, 0], 6, 5])
+
+
+def test_block_cache_evict(image_pool):
+    block_nbytes = _Image.data[:, :4, :4].nbytes
+    cache = BlockCache(max_bytes=2 * block_nbytes)
+
+    cache.read_pixel('a', 0, 0)
+    cache.read_pixel('a', 4, 0)
+    cache.read_pixel('a', 0, 0)
+    cache.read_pixel('a', 0, 4)
+
+    # Least recently used block is dropped to stay within size
+    assert len(cache) == 2
+    assert cache.nbytes == 2 * block_nbytes
+    assert cache.evictions == 1
+    cache.read_pixel('a', 0, 0)
+    assert cache.hits == 2
+    cache.read_pixel('a', 4, 0)
+    assert cache.misses == 4
+
+    cache.resize(0)
+    assert len(cache) == 0
+    assert cache.nbytes == 0
+
+
+def test_block_cache_disabled(image_pool):
+    cache = BlockCache(max_bytes=0)
+
+    cache.read_pixel('a', 0, 0)
+    cache.read_pixel('a', 0, 1)
+
+    assert _block_reads() == 2
+    assert len(cache) == 0
+
+
+def test_read_pixel_block_cache(image_pool, monkeypatch):
+    monkeypatch.setattr(reader, 'block_cache', BlockCache(1024 ** 2))
+
+    reader.read_pixel('a', 0, 0)
+    reader.read_pixel('a', 1, 1)
+
+    assert reader.block_cache.hits == 1
+    assert _block_reads() == 1
+
+
+def test_max_pool_size(monkeypatch):
+    resource = pytest.importorskip('resource')
+    monkeypatch.setattr(resource, 'getrlimit', lambda _: (1024, 4096))
+
+    assert reader.max_pool_size(100) == 100
+    assert reader.max_pool_size(1500) == 1024 - 256
+    assert reader.max_pool_size(1500, reserve=2000) == 0
@@ -0,0 +1,338 @@
+""" Tests for reading images within `Series`
+"""
+import datetime as dt
+import os
+import time
+
+import numpy as np
+import pytest
+
+pytest.importorskip('osgeo')
+
+from ..ts_driver import series as series_module, ts_utils  # noqa
+from ..ts_driver.cancel import CancelToken, FetchCancelled  # noqa
+from ..ts_driver.series import Series  # noqa
+from .conftest import PixelReader, make_index  # noqa
+
+N_IMAGES, N_BANDS = 20, 3
+
+
+def _series(monkeypatch, index=None):
+    series = Series(None, index=index or make_index(N_IMAGES))
+    series.px, series.py = 1, 2
+
+    def _locate(mx, my, crs_wkt):
+        series.px, series.py = 1, 2
+    monkeypatch.setattr(series, '_locate', _locate)
+    return series
+
+
+@pytest.fixture
+def series(monkeypatch):
+    return _series(monkeypatch)
+
+
+def _reader(series, monkeypatch, **kwargs):
+    reader = PixelReader([series], N_BANDS, N_IMAGES, delay=0.002, **kwargs)
+    monkeypatch.setattr(series_module, 'read_pixel', reader)
+    return reader
+
+
+@pytest.mark.parametrize('threads', [1, 4])
+def test_read_images(series, monkeypatch, threads):
+    reader = _reader(series, monkeypatch)
+
+    read = list(series._read_images(threads=threads))
+
+    assert sorted(read) == list(range(N_IMAGES))
+    np.testing.assert_array_equal(series._scratch_data, reader.pixel(1, 2))
+    assert reader.max_reading <= threads
+    if threads > 1:
+        assert reader.max_reading > 1
+
+
+@pytest.mark.parametrize('threads', [1, 4])
+def test_read_images_cancel(series, monkeypatch, threads):
+    cancel = CancelToken()
+    reader = _reader(series, monkeypatch, cancel=cancel, cancel_after=5)
+
+    read = []
+    with pytest.raises(FetchCancelled):
+        for i_img in series._read_images(threads=threads, cancel=cancel):
+            read.append(i_img)
+
+    # Queued images are skipped and no read continues after cancelling
+    reads = reader.reads
+    assert reads < N_IMAGES
+    time.sleep(0.05)
+    assert reader.reads == reads
+    assert len(read) <= reads
+    assert series.metrics.counters['cancelled'] == 1
+
+
+@pytest.mark.parametrize('threads', [1, 4])
+def test_read_images_resume(series, monkeypatch, threads):
+    cancel = CancelToken()
+    reader = _reader(series, monkeypatch, cancel=cancel, cancel_after=5)
+
+    read = []
+    with pytest.raises(FetchCancelled):
+        for i_img in series._read_images(threads=threads, cancel=cancel):
+            read.append(i_img)
+
+    # Images yielded before cancelling were read completely
+    np.testing.assert_array_equal(series._scratch_data[:, read],
+                                  reader.pixel(1, 2)[:, read])
+
+    missing = [i for i in range(N_IMAGES) if i not in read]
+    resumed = list(series._read_images(threads=threads, indices=missing,
+                                       cancel=CancelToken()))
+
+    assert sorted(read + resumed) == list(range(N_IMAGES))
+    np.testing.assert_array_equal(series._scratch_data, reader.pixel(1, 2))
+
+
+@pytest.mark.parametrize('threads', [1, 4])
+def test_fetch_data(series, monkeypatch, threads):
+    reader = _reader(series, monkeypatch)
+
+    progress = list(series.fetch_data(0, 0, '', threads=threads))
+
+    assert progress == [float(i) for i in range(1, N_IMAGES + 1)]
+    np.testing.assert_array_equal(series.data, reader.pixel(1, 2))
+    assert series.metrics.counters['images_read'] == N_IMAGES
+
+
+def _cache_files(cache_folder):
+    return sorted(f for f in os.listdir(cache_folder) if f.endswith('.npz'))
+
+
+@pytest.mark.parametrize('n_new', [1, 5])
+def test_fetch_data_upgrade_cache(monkeypatch, tmpdir, n_new):
+    cache_folder = str(tmpdir)
+    old = _series(monkeypatch, make_index(N_IMAGES - n_new))
+    _reader(old, monkeypatch)
+    list(old.fetch_data(0, 0, '', cache_folder=cache_folder,
+                        read_cache=True, write_cache=True))
+    assert old.metrics.counters['cache_writes'] == 1
+
+    series = _series(monkeypatch)
+    reader = _reader(series, monkeypatch)
+    progress = list(series.fetch_data(0, 0, '', cache_folder=cache_folder,
+                                      read_cache=True, write_cache=True))
+
+    # Only the new images are read and the old cache is replaced
+    assert reader.reads == n_new
+    assert len(progress) == N_IMAGES
+    assert series.metrics.counters['cache_upgrades'] == 1
+    assert 'cache_errors' not in series.metrics.counters
+    np.testing.assert_array_equal(series.data, reader.pixel(1, 2))
+    assert _cache_files(cache_folder) == [series.cache_entry]
+
+    list(series.fetch_data(0, 0, '', cache_folder=cache_folder,
+                           read_cache=True, write_cache=True))
+    assert series.cache_source == 'pixel'
+    assert reader.reads == n_new
+
+
+def test_fetch_data_upgrade_legacy_cache(series, monkeypatch, tmpdir):
+    # Caches written by earlier versions hold image IDs as objects
+    reader = _reader(series, monkeypatch)
+    name = ts_utils.name_cache_pixel(1, 2, (N_BANDS, N_IMAGES - 1))
+    np.savez(str(tmpdir.join(name)), Y=reader.pixel(1, 2)[:, :-1],
+             image_IDs=np.array(series.images['id'][:-1], dtype=object))
+
+    list(series.fetch_data(0, 0, '', cache_folder=str(tmpdir),
+                           read_cache=True, write_cache=True))
+
+    assert reader.reads == 1
+    assert series.metrics.counters['cache_upgrades'] == 1
+    np.testing.assert_array_equal(series.data, reader.pixel(1, 2))
+    assert _cache_files(str(tmpdir)) == [series.cache_entry]
+
+
+class _BrokenStore(object):
+    """ Stands in for a pixel cache store that cannot be opened """
+    def has_pixel(self, name):
+        raise IOError('unable to open database file')
+
+    def find_previous(self, x, y, series):
+        return None
+
+
+def test_fetch_data_cache_store_error(series, monkeypatch):
+    reader = _reader(series, monkeypatch)
+
+    list(series.fetch_data(0, 0, '', read_cache=True,
+                           cache_store=_BrokenStore()))
+
+    # Errors opening the cache are misses
+    assert series.metrics.counters['cache_errors'] == 1
+    assert reader.reads == N_IMAGES
+    np.testing.assert_array_equal(series.data, reader.pixel(1, 2))
+
+
+class _Dataset(object):
+    """ Stands in for an image opened with GDAL """
+    RasterXSize, RasterYSize, RasterCount = 10, 10, N_BANDS
+    DataType = 'int16'
+
+    def __init__(self, filename, mode):
+        pass
+
+    def GetRasterBand(self, band):
+        return self
+
+    def GetDescription(self):
+        return ''
+
+    def GetGeoTransform(self):
+        return (0.0, 30.0, 0.0, 0.0, 0.0, -30.0)
+
+    def GetProjection(self):
+        return ''
+
+
+def test_init_images(monkeypatch):
+    monkeypatch.setattr(series_module.gdal, 'Open', _Dataset)
+    monkeypatch.setattr(series_module.gdal_array,
+                        'GDALTypeCodeToNumericTypeCode', np.dtype)
+    images = [os.path.join('stack', 'LT50120312000033XXX01', 'img_stack'),
+              # Dates are parsed from filenames if not within IDs
+              os.path.join('stack', 'unknown', 'LT50120311999365XXX01'),
+              os.path.join('stack', 'LT50120312000001XXX01', 'img_stack')]
+
+    series = Series(images)
+
+    dates = [dt.date(1999, 12, 31), dt.date(2000, 1, 1),
+             dt.date(2000, 2, 2)]
+    assert list(series.images['path']) == [images[1], images[2], images[0]]
+    assert list(series.images['ordinal']) == [d.toordinal() for d in dates]
+    assert list(series.images['doy']) == [365, 1, 33]
+    assert list(series.images['year']) == [1999, 2000, 2000]
+    assert [d.date() for d in series.images['date']] == dates
+
+
+def test_init_images_invalid(monkeypatch):
+    monkeypatch.setattr(series_module.gdal, 'Open', _Dataset)
+    with pytest.raises(Exception) as e:
+        Series([os.path.join('stack', 'unknown', 'img_stack')])
+    assert 'Could not parse date' in str(e.value)
+
+
+def test_paths(series):
+    assert series.paths.dtype.kind == 'U'
+    assert list(series.paths) == list(series.images['path'])
+
+    path = series.images['path'][3]
+    np.testing.assert_array_equal(np.where(series.paths == path)[0], [3])
+
+
+def test_fetch_data_bands(series, monkeypatch, tmpdir):
+    reader = _reader(series, monkeypatch)
+    cache_folder = str(tmpdir)
+
+    list(series.fetch_data(0, 0, '', cache_folder=cache_folder,
+                           write_cache=True, bands=[2]))
+
+    # Only the bands asked for are read, and nothing is cached yet
+    np.testing.assert_array_equal(series.data[2], reader.pixel(1, 2)[2])
+    assert not series.data[:2].any()
+    np.testing.assert_array_equal(series.remaining_bands, [0, 1])
+    assert _cache_files(cache_folder) == []
+
+    data = series.data
+    progress = list(series.fetch_remaining())
+
+    assert progress == [float(i) for i in range(1, N_IMAGES + 1)]
+    np.testing.assert_array_equal(series.data, reader.pixel(1, 2))
+    assert series.remaining_bands is None
+    assert reader.reads == 2 * N_IMAGES
+    # Data in use elsewhere are not modified
+    assert not data[:2].any()
+    assert _cache_files(cache_folder) == [series.cache_entry]
+
+
+def test_fetch_data_bands_all(series, monkeypatch):
+    reader = _reader(series, monkeypatch)
+
+    list(series.fetch_data(0, 0, '', bands=[2, 0, 1, 0]))
+
+    np.testing.assert_array_equal(series.data, reader.pixel(1, 2))
+    assert series.remaining_bands is None
+    assert list(series.fetch_remaining()) == []
+
+
+@pytest.mark.parametrize('threads', [1, 4])
+def test_fetch_data_cancel(series, monkeypatch, tmpdir, threads):
+    cache_folder = str(tmpdir)
+    cancel = CancelToken()
+    reader = _reader(series, monkeypatch, cancel=cancel, cancel_after=5)
+
+    with pytest.raises(FetchCancelled):
+        list(series.fetch_data(0, 0, '', cache_folder=cache_folder,
+                               read_cache=True, write_cache=True,
+                               threads=threads, cancel=cancel))
+
+    # Data read in part are neither kept nor cached
+    assert not series.data.any()
+    assert not [f for f in os.listdir(cache_folder) if f.endswith('.npz')]
+
+    # Fetching again reads and caches all images
+    list(series.fetch_data(0, 0, '', cache_folder=cache_folder,
+                           read_cache=True, write_cache=True,
+                           threads=threads, cancel=CancelToken()))
+    np.testing.assert_array_equal(series.data, reader.pixel(1, 2))
+    assert series.cache_source is None
+
+    reads = reader.reads
+    list(series.fetch_data(0, 0, '', cache_folder=cache_folder,
+                           read_cache=True, write_cache=True,
+                           threads=threads))
+    assert series.cache_source == 'pixel'
+    assert reader.reads == reads
+    np.testing.assert_array_equal(series.data, reader.pixel(1, 2))
+
+
+def _move(series, monkeypatch, px, py):
+    """ Locate the next pixel fetched at ``px`` and ``py`` """
+    def _locate(mx, my, crs_wkt):
+        series.px, series.py = px, py
+    monkeypatch.setattr(series, '_locate', _locate)
+
+
+def test_fetch_data_cancel_position(series, monkeypatch):
+    reader = _reader(series, monkeypatch)
+    list(series.fetch_data(0, 0, ''))
+    data = series.data
+
+    _move(series, monkeypatch, 3, 4)
+    reader.cancel, reader.cancel_after = CancelToken(), reader.reads + 5
+    with pytest.raises(FetchCancelled):
+        list(series.fetch_data(0, 0, '', cancel=reader.cancel))
+
+    # The Series stays at the pixel it held
+    assert (series.px, series.py) == (1, 2)
+    assert series.data is data
+
+
+@pytest.mark.parametrize('threads', [1, 4])
+def test_fetch_remaining_cancel(series, monkeypatch, tmpdir, threads):
+    cache_folder = str(tmpdir)
+    reader = _reader(series, monkeypatch)
+    list(series.fetch_data(0, 0, ''))
+    data = series.data
+
+    _move(series, monkeypatch, 3, 4)
+    list(series.fetch_data(0, 0, '', cache_folder=cache_folder,
+                           write_cache=True, bands=[2], threads=threads))
+    assert (series.px, series.py) == (3, 4)
+    reader.cancel, reader.cancel_after = CancelToken(), reader.reads + 5
+    with pytest.raises(FetchCancelled):
+        list(series.fetch_remaining(threads=threads, cancel=reader.cancel))
+
+    # Data with bands left unread are neither kept nor cached
+    assert (series.px, series.py) == (1, 2)
+    assert series.data is data
+    assert series.remaining_bands is None
+    assert _cache_files(cache_folder) == []
@@ -0,0 +1,56 @@
+""" Tests for converting PALSAR data to dB within the Landsat/PALSAR driver
+"""
+import numpy as np
+import pytest
+
+pytest.importorskip('osgeo')
+pytest.importorskip('matplotlib')
+pytest.importorskip('patsy')
+pytest.importorskip('sklearn.externals.joblib')
+
+from ..ts_driver.drivers.timeseries_opticalradar import YATSMLandsatPALSARTS  # noqa
+from .conftest import make_index  # noqa
+from .test_timeseries_stacked import N_IMAGES, XY, _driver  # noqa
+
+
+def _db(dn):
+    dn = dn.astype(np.float)
+    db = (dn - 1) * 0.15 - 31.0
+    db[2] = db[0] / db[1]
+    return db
+
+
+@pytest.fixture
+def driver(tmpdir, monkeypatch):
+    return _driver(tmpdir, monkeypatch,
+                   indices=[make_index(N_IMAGES),
+                            make_index(N_IMAGES, folder='ALOS')],
+                   cls=YATSMLandsatPALSARTS)
+
+
+def test_fetch_data_db(driver):
+    driver, reader = driver
+    landsat, radar = driver.series
+
+    list(driver.fetch_data(XY[0], XY[1], ''))
+
+    # Landsat data are kept as read, and RADAR data are in dB
+    np.testing.assert_array_equal(landsat.data, reader.pixel(1, 2))
+    assert landsat.data.dtype == np.int16
+    np.testing.assert_allclose(radar.data, _db(reader.pixel(1, 2)))
+    _, y = driver.get_data(1, 2, mask=False)
+    np.testing.assert_allclose(y, _db(reader.pixel(1, 2))[2])
+
+
+def test_fetch_data_db_revisit(driver):
+    driver, reader = driver
+    radar = driver.series[1]
+
+    list(driver.fetch_data(XY[0], XY[1], ''))
+    list(driver.fetch_data(XY[0] + 30, XY[1], ''))
+    np.testing.assert_allclose(radar.data, _db(reader.pixel(2, 2)))
+    list(driver.fetch_data(XY[0], XY[1], ''))
+
+    # Data read from memory are converted once
+    assert driver.metrics.counters['memory_cache_hits'] == 1
+    np.testing.assert_allclose(radar.data, _db(reader.pixel(1, 2)))
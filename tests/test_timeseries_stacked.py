@@ -0,0 +1,280 @@
+""" Tests for fetching data within the stacked timeseries driver
+"""
+from collections import OrderedDict
+import json
+
+import numpy as np
+import pytest
+
+pytest.importorskip('osgeo')
+
+from ..ts_driver import reader as reader_module  # noqa
+from ..ts_driver import series as series_module  # noqa
+from ..ts_driver.cache_manager import CacheManager  # noqa
+from ..ts_driver.cache_store import MemoryCache  # noqa
+from ..ts_driver.cancel import CancelToken, FetchCancelled  # noqa
+from ..ts_driver.drivers.timeseries_stacked import StackedTimeSeries  # noqa
+from ..ts_driver.metrics import Metrics  # noqa
+from ..ts_driver.reader import BlockCache, DatasetPool  # noqa
+from ..ts_driver.series import Series  # noqa
+from ..ts_driver.ts_utils import ConfigItem  # noqa
+from ..utils import geo_utils  # noqa
+from .conftest import PixelReader, make_index  # noqa
+
+N_IMAGES, N_BANDS = 20, 3
+#: tuple: map coordinates of pixel at column 1, row 2
+XY = (45.0, -75.0)
+
+
+def _driver(tmpdir, monkeypatch, indices=None, cls=StackedTimeSeries,
+            **config):
+    """ Return a driver of Series described by ``indices`` and a reader of
+    their pixels
+    """
+    monkeypatch.setattr(geo_utils, 'reproject_point',
+                        lambda x, y, from_crs, to_crs: (x, y))
+
+    driver = cls.__new__(cls)
+    driver.location = str(tmpdir)
+    driver.config = OrderedDict(StackedTimeSeries.config)
+    driver.config['mask_band'] = ConfigItem('Mask band', [0])
+    driver.config['read_threads'] = ConfigItem('Parallel image reads', 1)
+    for key, value in config.items():
+        driver.config[key] = ConfigItem(key, value)
+    driver.series = [Series(None, index=index)
+                     for index in (indices or [make_index(N_IMAGES)])]
+    driver.metrics = Metrics()
+    driver._memory_cache = MemoryCache(1024 ** 2)
+
+    reader = PixelReader(driver.series, N_BANDS, N_IMAGES)
+    monkeypatch.setattr(series_module, 'read_pixel', reader)
+    return driver, reader
+
+
+def test_fetch_data_memory_cache(tmpdir, monkeypatch):
+    driver, reader = _driver(tmpdir, monkeypatch)
+    series = driver.series[0]
+
+    list(driver.fetch_data(XY[0], XY[1], ''))
+    assert reader.reads == N_IMAGES
+    np.testing.assert_array_equal(series.data, reader.pixel(1, 2))
+
+    # Revisiting a pixel reads it from memory
+    list(driver.fetch_data(XY[0] + 30, XY[1], ''))
+    list(driver.fetch_data(XY[0], XY[1], ''))
+
+    assert reader.reads == 2 * N_IMAGES
+    assert driver.metrics.counters['memory_cache_hits'] == 1
+    assert (series.px, series.py) == (1, 2)
+    np.testing.assert_array_equal(series.data, reader.pixel(1, 2))
+
+    # Data in memory are not changed through the Series
+    series.data[:] = 0
+    list(driver.fetch_data(XY[0], XY[1], ''))
+    np.testing.assert_array_equal(series.data, reader.pixel(1, 2))
+
+
+def test_update_mask_results_key(tmpdir, monkeypatch):
+    driver, reader = _driver(tmpdir, monkeypatch)
+    list(driver.fetch_data(XY[0], XY[1], ''))
+    key = driver._results_key()
+    driver._memory_cache.put(key, 'results')
+
+    # Results are kept unless the values masked change
+    driver.update_mask(list(driver.mask_values))
+    assert driver._memory_cache.get(key) == 'results'
+
+    driver.update_mask([2, 3])
+    assert driver._results_key() != key
+    assert len(driver._memory_cache) == 0
+
+
+def test_close_flushes_cache_access(tmpdir, monkeypatch):
+    driver, reader = _driver(tmpdir, monkeypatch)
+    driver.cache_folder = str(tmpdir)
+    driver._cache_manager = CacheManager(str(tmpdir))
+
+    list(driver.fetch_data(XY[0], XY[1], ''))
+    driver.close()
+
+    assert CacheManager(str(tmpdir)).report()['misses'] == 1
+
+
+def test_close_releases_datasets(tmpdir, monkeypatch):
+    driver, reader = _driver(tmpdir, monkeypatch)
+    pool = DatasetPool(size=2)
+    blocks = BlockCache(1024)
+    monkeypatch.setattr(reader_module, 'dataset_pool', pool)
+    monkeypatch.setattr(reader_module, 'block_cache', blocks)
+    for image in driver.series[0].images['path'][:2]:
+        pool._checkin(image, object())
+    blocks._blocks['a'] = np.zeros(1)
+    blocks._block_sizes['a'] = blocks.nbytes = 8
+
+    driver.close()
+
+    assert len(pool) == 0
+    assert len(blocks) == 0 and blocks.nbytes == 0
+
+
+def test_get_metrics(tmpdir, monkeypatch):
+    driver, reader = _driver(tmpdir, monkeypatch)
+    driver._metrics_file = str(tmpdir.join('metrics', 'session.json'))
+
+    list(driver.fetch_data(XY[0], XY[1], ''))
+    list(driver.fetch_data(XY[0] + 30, XY[1], ''))
+    list(driver.fetch_data(XY[0], XY[1], ''))
+
+    metrics = driver.get_metrics()
+    assert metrics['counters']['memory_cache_hits'] == 1
+    assert metrics['timers']['fetch_data']['count'] == 3
+    series = metrics['series'][0]
+    assert series['counters']['images_read'] == 2 * N_IMAGES
+    assert series['counters']['bytes_read'] == 2 * reader.pixel(1, 2).nbytes
+    assert set(['dataset_pool', 'block_cache', 'memory_cache']) <= set(metrics)
+
+    # Each fetch rewrites the session's metrics file
+    with open(driver._metrics_file) as f:
+        assert json.load(f)['timers']['fetch_data']['count'] == 3
+
+    driver.reset_metrics()
+    assert driver.get_metrics()['series'][0]['counters'] == {}
+
+
+def test_fetch_data_bands(tmpdir, monkeypatch):
+    driver, reader = _driver(tmpdir, monkeypatch, mask_band=[3])
+    series = driver.series[0]
+
+    list(driver.fetch_data(XY[0], XY[1], '', bands={0: [0]}))
+
+    # Plotted and mask bands are read first
+    np.testing.assert_array_equal(series.remaining_bands, [1])
+    np.testing.assert_array_equal(series.data[[0, 2]],
+                                  reader.pixel(1, 2)[[0, 2]])
+    assert not series.data[1].any()
+    assert len(driver._memory_cache) == 0
+    # Bands not yet read are not plotted
+    assert driver.get_data(0, 0)[1].size == N_IMAGES
+    assert driver.get_data(0, 1)[1].size == 0
+    assert driver.get_data(0, 1, mask=False)[1].size == 0
+
+    list(driver.fetch_remaining())
+
+    np.testing.assert_array_equal(series.data, reader.pixel(1, 2))
+    np.testing.assert_array_equal(driver.get_data(0, 1, mask=False)[1],
+                                  reader.pixel(1, 2)[1])
+    assert reader.reads == 2 * N_IMAGES
+    # Only complete data are kept in memory
+    assert len(driver._memory_cache) == 1
+    list(driver.fetch_data(XY[0], XY[1], '', bands={0: [0]}))
+    assert reader.reads == 2 * N_IMAGES
+    assert series.remaining_bands is None
+
+
+def _cancel_after(reader, n):
+    """ Return a token cancelled once ``n`` more images are read """
+    reader.cancel, reader.cancel_after = CancelToken(), reader.reads + n
+    return reader.cancel
+
+
+def test_fetch_data_cancel(tmpdir, monkeypatch):
+    indices = [make_index(N_IMAGES), make_index(N_IMAGES, folder='other')]
+    driver, reader = _driver(tmpdir, monkeypatch, indices=indices)
+    list(driver.fetch_data(XY[0], XY[1], ''))
+    data = [series.data for series in driver.series]
+
+    # Cancelled once the first Series is read
+    cancel = _cancel_after(reader, N_IMAGES + 5)
+    with pytest.raises(FetchCancelled):
+        list(driver.fetch_data(XY[0] + 30, XY[1], '', cancel=cancel))
+
+    # No Series moves to the new pixel
+    for series, _data in zip(driver.series, data):
+        assert (series.px, series.py) == (1, 2)
+        assert series.data is _data
+
+
+def test_fetch_remaining_cancel(tmpdir, monkeypatch):
+    indices = [make_index(N_IMAGES), make_index(N_IMAGES, folder='other')]
+    driver, reader = _driver(tmpdir, monkeypatch, indices=indices)
+    list(driver.fetch_data(XY[0], XY[1], ''))
+    data = [series.data for series in driver.series]
+    list(driver.fetch_data(XY[0] + 30, XY[1], '', bands={0: [0], 1: [0]}))
+
+    # Cancelled once the remaining bands of the first Series are read
+    cancel = _cancel_after(reader, N_IMAGES + 5)
+    with pytest.raises(FetchCancelled):
+        list(driver.fetch_remaining(cancel=cancel))
+
+    for series, _data in zip(driver.series, data):
+        assert (series.px, series.py) == (1, 2)
+        assert series.data is _data
+        assert series.remaining_bands is None
+    assert list(driver.fetch_remaining()) == []
+
+    # Fetching again reads the pixel completely
+    list(driver.fetch_data(XY[0] + 30, XY[1], ''))
+    for series in driver.series:
+        np.testing.assert_array_equal(series.data, reader.pixel(2, 2))
+
+
+def test_fetch_data_closed(tmpdir, monkeypatch):
+    indices = [make_index(N_IMAGES), make_index(N_IMAGES, folder='other')]
+    driver, reader = _driver(tmpdir, monkeypatch, indices=indices)
+    list(driver.fetch_data(XY[0], XY[1], ''))
+    data = [series.data for series in driver.series]
+
+    # Callers checking their own token close the generator instead
+    progress = driver.fetch_data(XY[0] + 30, XY[1], '')
+    for percent in progress:
+        if percent > 75:
+            break
+    progress.close()
+
+    for series, _data in zip(driver.series, data):
+        assert (series.px, series.py) == (1, 2)
+        assert series.data is _data
+
+
+def test_fetch_data_snapshots(tmpdir, monkeypatch):
+    driver, reader = _driver(tmpdir, monkeypatch)
+    snapshots = []
+
+    list(driver.fetch_data(XY[0], XY[1], '',
+                           snapshot=lambda *args: snapshots.append(args),
+                           snapshot_every=5))
+
+    assert len(snapshots) == 4
+    # Newest images are read first, and images not read are zero
+    i_series, data, read, bands = snapshots[0]
+    assert i_series == 0 and bands is None
+    np.testing.assert_array_equal(np.where(read)[0],
+                                  range(N_IMAGES - 5, N_IMAGES))
+    np.testing.assert_array_equal(data[:, read], reader.pixel(1, 2)[:, read])
+    assert not data[:, ~read].any()
+    # Snapshots are copies of data being read
+    assert data is not driver.series[0]._scratch_data
+    _, data, read, _ = snapshots[-1]
+    assert read.all()
+    np.testing.assert_array_equal(data, reader.pixel(1, 2))
+
+
+def test_set_snapshot(tmpdir, monkeypatch):
+    driver, reader = _driver(tmpdir, monkeypatch)
+    list(driver.fetch_data(XY[0], XY[1], ''))
+    data = np.zeros((N_BANDS, N_IMAGES), dtype=np.int16)
+    read = np.zeros(N_IMAGES, dtype=np.bool)
+    data[0, -3:], read[-3:] = 7, True
+
+    driver.set_snapshot(0, data, read, bands=np.array([0]))
+
+    # Only images and bands read so far are shown
+    X, y = driver.get_data(0, 0, mask=False)
+    np.testing.assert_array_equal(y, [7, 7, 7])
+    assert list(X['id']) == list(driver.series[0].images['id'][-3:])
+    X, y = driver.get_data(0, 1, mask=False)
+    assert y.size == 0
+
+    driver.clear_snapshots()
+    _, y = driver.get_data(0, 1, mask=False)
+    np.testing.assert_array_equal(y, reader.pixel(1, 2)[1])
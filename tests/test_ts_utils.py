@@ -0,0 +1,288 @@
+""" Tests for `ts_driver.ts_utils`
+"""
+import datetime as dt
+import errno
+import os
+import time
+
+import numpy as np
+import pytest
+
+from ..ts_driver import ts_utils
+
+IMAGE_IDS = ['LT50120312000%03iXXX01' % doy for doy in range(1, 161, 16)]
+
+
+class _Series(object):
+    """ Describes cached data in the way `Series` does """
+    description = 'Test Series'
+
+    def __init__(self, image_IDs=IMAGE_IDS, count=3, dtype=np.int16):
+        self.images = {'id': np.array(image_IDs)}
+        self.n = len(image_IDs)
+        self.count = count
+        self.fingerprint = ts_utils.image_fingerprint(image_IDs, count, dtype)
+
+
+def _write_npz(tmpdir, **arrays):
+    filename = str(tmpdir.join('cache.npz'))
+    np.savez(filename, **arrays)
+    return filename
+
+
+# image_fingerprint
+def test_image_fingerprint_is_stable():
+    fp = ts_utils.image_fingerprint(IMAGE_IDS, 3, np.int16)
+    assert fp == ts_utils.image_fingerprint(list(IMAGE_IDS), 3, 'int16')
+    assert len(fp) == 40
+
+
+@pytest.mark.parametrize(('image_IDs', 'nband', 'dtype'), [
+    (IMAGE_IDS[::-1], 3, np.int16),
+    (IMAGE_IDS[:-1], 3, np.int16),
+    (IMAGE_IDS, 4, np.int16),
+    (IMAGE_IDS, 3, np.float32),
+])
+def test_image_fingerprint_changes(image_IDs, nband, dtype):
+    fp = ts_utils.image_fingerprint(IMAGE_IDS, 3, np.int16)
+    assert ts_utils.image_fingerprint(image_IDs, nband, dtype) != fp
+
+
+# _validate_cache
+def test_validate_cache_fingerprint(tmpdir):
+    series = _Series()
+    filename = _write_npz(tmpdir, Y=np.zeros((3, series.n)),
+                          fingerprint=series.fingerprint)
+    ts_utils._validate_cache(np.load(filename), series)
+
+
+def test_validate_cache_fingerprint_mismatch(tmpdir):
+    series = _Series()
+    filename = _write_npz(tmpdir, Y=np.zeros((3, series.n)),
+                          image_IDs=np.array(IMAGE_IDS),
+                          fingerprint=_Series(count=4).fingerprint)
+    # The fingerprint is used even though the image IDs match
+    with pytest.raises(IndexError):
+        ts_utils._validate_cache(np.load(filename), series)
+
+
+def test_validate_cache_image_IDs(tmpdir):
+    filename = _write_npz(tmpdir, Y=np.zeros((3, len(IMAGE_IDS))),
+                          image_IDs=np.array(IMAGE_IDS))
+    ts_utils._validate_cache(np.load(filename), _Series())
+    with pytest.raises(IndexError):
+        ts_utils._validate_cache(np.load(filename),
+                                 _Series(image_IDs=IMAGE_IDS[::-1]))
+
+
+@pytest.mark.parametrize('arrays', [
+    {'fingerprint': 'abc'},
+    {'Y': np.zeros((3, len(IMAGE_IDS)))},
+])
+def test_validate_cache_format(tmpdir, arrays):
+    filename = _write_npz(tmpdir, **arrays)
+    with pytest.raises(IndexError):
+        ts_utils._validate_cache(np.load(filename), _Series())
+
+
+# read_cache_line_column
+def test_read_cache_line_column(tmpdir):
+    series = _Series()
+    filename = str(tmpdir.join('line.npy'))
+    Y = np.arange(3 * series.n * 5, dtype=np.int16).reshape(3, series.n, 5)
+    ts_utils.write_cache_line_npy(filename, Y, series.fingerprint)
+
+    np.testing.assert_array_equal(
+        ts_utils.read_cache_line_column(filename, series, 2), Y[..., 2])
+    assert os.path.isfile(filename + '.sha1')
+
+
+@pytest.mark.parametrize(('col', 'series'), [
+    (5, _Series()),
+    (-1, _Series()),
+    (0, _Series(count=2)),
+    (0, _Series(image_IDs=IMAGE_IDS + ['LT50120312000200XXX01'])),
+])
+def test_read_cache_line_column_shape(tmpdir, col, series):
+    filename = str(tmpdir.join('line.npy'))
+    Y = np.zeros((3, len(IMAGE_IDS), 5), dtype=np.int16)
+    ts_utils.write_cache_line_npy(filename, Y, series.fingerprint)
+
+    with pytest.raises(IndexError):
+        ts_utils.read_cache_line_column(filename, series, col)
+
+
+# atomic_write
+def test_atomic_write(tmpdir):
+    filename = str(tmpdir.join('cache.npz'))
+    tmpdir.join('cache.npz').write('old')
+
+    with ts_utils.atomic_write(filename, 'w') as f:
+        f.write('new')
+        # The previous file is kept until the new one is written
+        assert tmpdir.join('cache.npz').read() == 'old'
+
+    assert tmpdir.join('cache.npz').read() == 'new'
+    assert os.listdir(str(tmpdir)) == ['cache.npz']
+
+
+def test_atomic_write_error(tmpdir):
+    filename = str(tmpdir.join('cache.npz'))
+    tmpdir.join('cache.npz').write('old')
+
+    with pytest.raises(ValueError):
+        with ts_utils.atomic_write(filename, 'w') as f:
+            f.write('partial')
+            raise ValueError('Could not write')
+
+    assert tmpdir.join('cache.npz').read() == 'old'
+    assert os.listdir(str(tmpdir)) == ['cache.npz']
+
+
+# cache_lock
+@pytest.fixture
+def umask():
+    old = os.umask(0o022)
+    yield
+    os.umask(old)
+
+
+def test_cache_lock_shared(tmpdir, umask):
+    with ts_utils.cache_lock(str(tmpdir)):
+        pass
+
+    # Other users sharing the cache folder can lock it
+    mode = os.stat(str(tmpdir.join(ts_utils.CACHE_LOCK_FILENAME))).st_mode
+    assert mode & 0o777 == 0o666
+    with ts_utils.cache_lock(str(tmpdir)):
+        pass
+
+
+def test_cache_lock_unwritable(tmpdir, monkeypatch, caplog):
+    def _open_lock(filename):
+        raise IOError(errno.EACCES, 'Permission denied', filename)
+    monkeypatch.setattr(ts_utils, '_open_lock', _open_lock)
+    monkeypatch.setattr(ts_utils, '_unlocked_folders', set())
+    filename = str(tmpdir.join('cache.npz'))
+
+    for _ in range(2):
+        with ts_utils.cache_lock(str(tmpdir)), \
+                ts_utils.atomic_write(filename, 'w') as f:
+            f.write('new')
+
+    # Cache files are still written, warning once that no lock is held
+    assert tmpdir.join('cache.npz').read() == 'new'
+    assert caplog.text.count('without locking') == 1
+
+
+# find_files
+def _tree(tmpdir):
+    """ Create a dataset of images, some ignored or deeply nested """
+    location = tmpdir.mkdir('dataset')
+    for path in ('A/LT5_1_stack', 'A/LT5_1_stack.hdr', 'B/LT5_2_stack',
+                 'B/sub/LT5_3_stack', 'results/LT5_4_stack'):
+        location.join(*path.split('/')).ensure()
+    return str(location)
+
+
+def _listed(monkeypatch):
+    """ Record each directory listed by `find_files` """
+    listed = []
+    _list_dir = ts_utils._list_dir
+
+    def _record(path, pattern):
+        listed.append(os.path.relpath(path, os.path.dirname(path)))
+        return _list_dir(path, pattern)
+    monkeypatch.setattr(ts_utils, '_list_dir', _record)
+    return listed
+
+
+@pytest.mark.parametrize('threads', [1, 4])
+def test_find_files(tmpdir, monkeypatch, threads):
+    location = _tree(tmpdir)
+    listed = _listed(monkeypatch)
+
+    found = ts_utils.find_files(location, 'LT5*stack',
+                                ignore_dirs=['results'], maxdepth=2,
+                                threads=threads)
+
+    assert found == [os.path.join(location, 'A', 'LT5_1_stack'),
+                     os.path.join(location, 'B', 'LT5_2_stack')]
+    # Ignored and too deep directories are never listed
+    assert sorted(listed) == ['A', 'B', 'dataset']
+
+
+def test_find_files_incremental(tmpdir, monkeypatch):
+    location = _tree(tmpdir)
+    mtime = time.time() - 60
+    for root, dirs, files in os.walk(location):
+        os.utime(root, (mtime, mtime))
+    state = {}
+    found = ts_utils.find_files(location, 'LT5*stack', state=state)
+    listed = _listed(monkeypatch)
+
+    assert ts_utils.find_files(location, 'LT5*stack', state=state) == found
+    assert listed == []
+
+    # Only directories modified since the last search are listed again
+    tmpdir.join('dataset', 'B', 'LT5_5_stack').ensure()
+    tmpdir.join('dataset', 'results').remove()
+    found = ts_utils.find_files(location, 'LT5*stack', state=state)
+
+    assert sorted(listed) == ['B', 'dataset']
+    assert os.path.join(location, 'B', 'LT5_5_stack') in found
+    assert len(found) == 4
+    assert os.path.join(location, 'results') not in state
+
+
+# parse_dates
+@pytest.mark.parametrize(('date_format', 'strings'), [
+    ('%Y%j', ['2000001', '2000366', '1999365', '1985200']),
+    ('%Y%m%d', ['20000101', '20000229', '19991231', '19850719']),
+    ('%Y-%m-%d', ['2000-01-01', '2000-02-29', '1999-12-31']),
+    ('%y%j', ['00001', '99365', '85200']),
+])
+def test_parse_dates(date_format, strings):
+    dates, valid = ts_utils.parse_dates(strings, date_format)
+
+    assert valid.all()
+    expected = [dt.datetime.strptime(s, date_format).date() for s in strings]
+    assert [d.item() for d in dates] == expected
+
+
+@pytest.mark.parametrize(('date_format', 'strings'), [
+    ('%Y%j', ['1999366', '2000000', '200001', '20000011', '2000a01']),
+    ('%Y%m%d', ['19990229', '20001301', '20000100', '20000132']),
+    ('%Y-%m-%d', ['2000/01/01', '2000-1-01']),
+])
+def test_parse_dates_invalid(date_format, strings):
+    _, valid = ts_utils.parse_dates(strings, date_format)
+    assert not valid.any()
+
+
+def test_parse_dates_mixed():
+    dates, valid = ts_utils.parse_dates(['2000001', 'bad', '2000032'],
+                                        '%Y%j')
+    np.testing.assert_array_equal(valid, [True, False, True])
+    assert dates[2] == np.datetime64('2000-02-01')
+
+
+@pytest.mark.parametrize('date_format', ['%Y%b%d', '%Y%j%H', ''])
+def test_parse_dates_unsupported(date_format):
+    dates, valid = ts_utils.parse_dates(['2000001', '2000002'], date_format)
+    assert dates.size == 2
+    assert not valid.any()
+
+
+def test_dates_conversions():
+    dates = np.array(['1985-07-19', '2000-02-29', '2000-12-31'],
+                     dtype='datetime64[D]')
+    expected = [d.item() for d in dates]
+
+    ordinal = ts_utils.dates_to_ordinal(dates)
+
+    assert list(ordinal) == [d.toordinal() for d in expected]
+    assert list(ts_utils.dates_to_doy(dates)) == [
+        int(d.strftime('%j')) for d in expected]
+    assert list(ts_utils.dates_to_year(dates)) == [d.year for d in expected]
+    np.testing.assert_array_equal(ts_utils.ordinal_to_dates(ordinal), dates)
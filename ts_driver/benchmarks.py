@@ -0,0 +1,291 @@
+""" Benchmarks for the timeseries reading machinery on synthetic datasets
+
+Benchmarks are run outside of QGIS from the directory containing the plugin,
+for example::
+
+    python -m tstools.ts_driver.benchmarks pixel --images 500 --bands 8
+"""
+from __future__ import print_function
+
+import argparse
+import datetime as dt
+import os
+import shutil
+import tempfile
+import timeit
+
+import numpy as np
+from osgeo import gdal, gdal_array
+
+from . import reader, ts_utils
+from .series import Series
+
+
+def synthetic_image_ids(n, start=dt.date(1985, 1, 1), step=8):
+    """ Return Landsat-like image IDs with the date at index 9:16 (%Y%j)
+
+    Args:
+        n (int): number of image IDs
+        start (datetime.date): date of first image
+        step (int): number of days between images
+
+    Returns:
+        list: image IDs
+
+    """
+    ids = []
+    for i in range(n):
+        d = start + dt.timedelta(days=i * step)
+        ids.append('LT5012031%sXXX01' % d.strftime('%Y%j'))
+    return ids
+
+
+def make_synthetic_stack(location, n_images=100, n_bands=8,
+                         nrow=256, ncol=256, dtype=np.int16,
+                         pattern='%s_stack.gtif'):
+    """ Write a synthetic "stacked" timeseries dataset of GeoTIFF images
+
+    Images are written one per directory, named by their image ID, so the
+    dataset can be opened with `StackedTimeSeries`.
+
+    Args:
+        location (str): directory to write dataset into
+        n_images (int): number of images
+        n_bands (int): number of bands in each image
+        nrow (int): number of rows in each image
+        ncol (int): number of columns in each image
+        dtype (np.dtype): image data type
+        pattern (str): filename pattern formatted with image ID
+
+    Returns:
+        list: filenames of images written
+
+    """
+    driver = gdal.GetDriverByName('GTiff')
+    gdal_dtype = gdal_array.NumericTypeCodeToGDALTypeCode(np.dtype(dtype))
+    rng = np.random.RandomState(0)
+
+    filenames = []
+    for _id in synthetic_image_ids(n_images):
+        d = os.path.join(location, _id)
+        if not os.path.isdir(d):
+            os.makedirs(d)
+        fname = os.path.join(d, pattern % _id)
+
+        ds = driver.Create(fname, ncol, nrow, n_bands, gdal_dtype,
+                           ['TILED=YES'])
+        ds.SetGeoTransform((0, 30, 0, nrow * 30, 0, -30))
+        for b in range(n_bands):
+            arr = rng.randint(0, 10000, size=(nrow, ncol)).astype(dtype)
+            ds.GetRasterBand(b + 1).WriteArray(arr)
+        ds = None
+        filenames.append(fname)
+
+    return filenames
+
+
+def _read_pixel_per_band(filename, x, y):
+    """ Reference implementation reading one band at a time """
+    with reader.dataset_pool.dataset(filename) as ds:
+        dtype = gdal_array.GDALTypeCodeToNumericTypeCode(
+            ds.GetRasterBand(1).DataType)
+        dat = np.empty(ds.RasterCount, dtype=dtype)
+        for i in range(ds.RasterCount):
+            dat[i] = ds.GetRasterBand(i + 1).ReadAsArray(x, y, 1, 1)
+    return dat
+
+
+def bench_pixel(n_images=200, n_bands=8, repeat=5, pool_size=64):
+    """ Compare per-band and single-call multi-band pixel reads
+
+    Multi-band reads are also timed with a dataset pool smaller than the
+    stack, where each read of all images cycles through more datasets than
+    the pool holds, and without a dataset pool.
+
+    Args:
+        n_images (int): number of images in synthetic stack
+        n_bands (int): number of bands in each image
+        repeat (int): number of times to repeat each benchmark
+        pool_size (int): size of the dataset pool smaller than the stack
+
+    Returns:
+        dict: best time in seconds to read one pixel from all images
+
+    """
+    location = tempfile.mkdtemp(prefix='tstools_bench_')
+    try:
+        filenames = make_synthetic_stack(location, n_images, n_bands)
+        scratch = np.zeros((n_bands, n_images), dtype=np.float)
+
+        def per_band():
+            for i, f in enumerate(filenames):
+                scratch[:, i] = _read_pixel_per_band(f, 10, 10)
+
+        def multi_band():
+            for i, f in enumerate(filenames):
+                reader.read_pixel_GDAL(f, 10, 10, out=scratch[:, i])
+
+        def timed(size):
+            reader.dataset_pool.clear()
+            reader.dataset_pool.resize(size)
+            # Warm the dataset pool so only reads are timed
+            multi_band()
+            return min(timeit.repeat(multi_band, number=1, repeat=repeat))
+
+        results = {
+            'multi_band_no_pool': timed(0),
+            'multi_band_small_pool': timed(min(pool_size, n_images)),
+            'multi_band': timed(n_images)
+        }
+        results['per_band'] = min(timeit.repeat(per_band, number=1,
+                                                repeat=repeat))
+        return results
+    finally:
+        reader.dataset_pool.clear()
+        shutil.rmtree(location)
+
+
+def bench_line(n_images=500, n_bands=8, ncol=10000, repeat=5):
+    """ Compare reading one pixel from zipped and memory-mapped line caches
+
+    Args:
+        n_images (int): number of images in synthetic stack
+        n_bands (int): number of bands in each image
+        ncol (int): number of columns in each row
+        repeat (int): number of times to repeat each benchmark
+
+    Returns:
+        dict: best time in seconds to read one pixel from a line cache
+
+    """
+    location = tempfile.mkdtemp(prefix='tstools_bench_')
+    try:
+        filenames = make_synthetic_stack(location, n_images, n_bands,
+                                         nrow=1, ncol=ncol)
+        series = Series(filenames)
+        rng = np.random.RandomState(0)
+        Y = rng.randint(0, 10000, size=(n_bands, n_images, ncol)).astype(
+            np.int16)
+
+        npz = os.path.join(location, ts_utils.name_cache_line(
+            0, series.data.shape))
+        npy = os.path.join(location, ts_utils.name_cache_line(
+            0, series.data.shape, ext='.npy'))
+        ts_utils.write_cache_line(npz, Y, series.images['id'],
+                                  series.fingerprint)
+        ts_utils.write_cache_line_npy(npy, Y, series.fingerprint)
+
+        col = ncol // 2
+
+        def read_npz():
+            return ts_utils.read_cache_line(npz, series)[..., col]
+
+        def read_npy():
+            return ts_utils.read_cache_line_column(npy, series, col)
+
+        assert np.array_equal(read_npz(), read_npy())
+
+        return {
+            'npz': min(timeit.repeat(read_npz, number=1, repeat=repeat)),
+            'npy_mmap': min(timeit.repeat(read_npy, number=1, repeat=repeat))
+        }
+    finally:
+        reader.dataset_pool.clear()
+        shutil.rmtree(location)
+
+
+def _parse_dates_strptime(strings, date_format):
+    """ Reference implementation parsing one date at a time """
+    out = np.empty(len(strings), dtype=[('date', object), ('ordinal', 'u4'),
+                                        ('doy', 'u2')])
+    for i, s in enumerate(strings):
+        date = dt.datetime.strptime(s, date_format)
+        out[i]['date'] = date
+        out[i]['ordinal'] = date.toordinal()
+        out[i]['doy'] = int(date.strftime('%j'))
+    return out
+
+
+def bench_dates(n_images=10000, repeat=5):
+    """ Compare per-image and vectorized parsing of image dates
+
+    Args:
+        n_images (int): number of image IDs to parse
+        repeat (int): number of times to repeat each benchmark
+
+    Returns:
+        dict: best time in seconds to parse the dates of all images
+
+    """
+    strings = [_id[9:16] for _id in synthetic_image_ids(n_images, step=1)]
+
+    def per_image():
+        return _parse_dates_strptime(strings, '%Y%j')
+
+    def vectorized():
+        dates, valid = ts_utils.parse_dates(strings, '%Y%j')
+        return (dates.astype('datetime64[us]').astype(object),
+                ts_utils.dates_to_ordinal(dates),
+                ts_utils.dates_to_doy(dates))
+
+    ref = per_image()
+    dates, ordinal, doy = vectorized()
+    assert np.array_equal(ref['ordinal'], ordinal)
+    assert np.array_equal(ref['doy'], doy)
+    assert list(ref['date']) == list(dates)
+
+    return {
+        'per_image': min(timeit.repeat(per_image, number=1, repeat=repeat)),
+        'vectorized': min(timeit.repeat(vectorized, number=1, repeat=repeat))
+    }
+
+
+def _print_results(title, results):
+    print(title)
+    for k, v in sorted(results.items()):
+        print('    {k:<24s} {v:10.6f}s'.format(k=k, v=v))
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    subparsers = parser.add_subparsers(dest='benchmark')
+
+    p = subparsers.add_parser('pixel', help='Per-band vs multi-band reads')
+    p.add_argument('--images', type=int, default=200)
+    p.add_argument('--bands', type=int, default=8)
+    p.add_argument('--repeat', type=int, default=5)
+    p.add_argument('--pool-size', type=int, default=64)
+
+    p = subparsers.add_parser('line', help='Zipped vs memory-mapped line '
+                                           'caches')
+    p.add_argument('--images', type=int, default=500)
+    p.add_argument('--bands', type=int, default=8)
+    p.add_argument('--columns', type=int, default=10000)
+    p.add_argument('--repeat', type=int, default=5)
+
+    p = subparsers.add_parser('dates', help='Per-image vs vectorized date '
+                                            'parsing')
+    p.add_argument('--images', type=int, default=10000)
+    p.add_argument('--repeat', type=int, default=5)
+
+    args = parser.parse_args(args)
+
+    if args.benchmark == 'pixel':
+        _print_results(
+            'Read one pixel from {i} images of {b} bands'.format(
+                i=args.images, b=args.bands),
+            bench_pixel(args.images, args.bands, args.repeat,
+                        args.pool_size))
+    elif args.benchmark == 'line':
+        _print_results(
+            'Read one pixel from a line of {c} columns, {i} images and {b} '
+            'bands'.format(c=args.columns, i=args.images, b=args.bands),
+            bench_line(args.images, args.bands, args.columns, args.repeat))
+    elif args.benchmark == 'dates':
+        _print_results(
+            'Parse dates of {i} images'.format(i=args.images),
+            bench_dates(args.images, args.repeat))
+
+
+if __name__ == '__main__':
+    main()
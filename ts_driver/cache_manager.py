@@ -0,0 +1,349 @@
+""" Cache size quotas, eviction, and usage reports for cache folders
+
+The `CacheManager` records when each cache entry is read or written, along
+with counts of cache hits and misses, in a small SQLite database within the
+cache folder. When the total size of a cache folder exceeds a quota, entries
+are evicted either by least recent use ("lru") or least frequent use
+("lfu").
+
+Cache folders can be inspected and trimmed outside of QGIS from the directory
+containing the plugin, for example::
+
+    python -m tstools.ts_driver.cache_manager report /path/to/stack/cache
+    python -m tstools.ts_driver.cache_manager enforce /path/to/stack/cache \
+        --quota-mb 2048 --policy lfu
+"""
+from __future__ import print_function
+
+import argparse
+import atexit
+from contextlib import contextmanager
+import logging
+import os
+import sqlite3
+import threading
+import time
+import weakref
+
+from .cache_store import SQLitePixelStore
+from .catalog import CATALOG_FILENAME
+from .ts_utils import cache_lock
+
+logger = logging.getLogger('tstools')
+
+#: list: names of available eviction policies
+EVICTION_POLICIES = ['lru', 'lfu']
+
+#: weakref.WeakSet: managers whose requests are flushed when Python exits
+_managers = weakref.WeakSet()
+
+
+class CacheManager(object):
+    """ Track access to, and enforce a size quota on, a cache folder
+
+    Args:
+        cache_folder (str): location of cache folder
+        quota_bytes (int): maximum size of cache folder in bytes, or 0 for no
+            limit
+        policy (str): eviction policy, either "lru" (least recently used) or
+            "lfu" (least frequently used). Unknown policies are logged and
+            replaced by "lru"
+        enforce_every (int): number of cache writes between quota checks
+        flush_every (int): number of cache requests recorded in memory
+            before they are written to the access database. Requests still in
+            memory are written by `close` and when Python exits
+
+    """
+    filename = 'cache_access.sqlite'
+
+    _create = (
+        'CREATE TABLE IF NOT EXISTS access ('
+        'key TEXT PRIMARY KEY, last_access REAL, hits INTEGER)',
+        'CREATE TABLE IF NOT EXISTS requests ('
+        'kind TEXT PRIMARY KEY, count INTEGER)'
+    )
+
+    def __init__(self, cache_folder, quota_bytes=0, policy='lru',
+                 enforce_every=50, flush_every=20):
+        if policy not in EVICTION_POLICIES:
+            logger.warning('Unknown cache eviction policy "%s" (options: %s).'
+                           ' Using "%s"' % (policy,
+                                            ', '.join(EVICTION_POLICIES),
+                                            EVICTION_POLICIES[0]))
+            policy = EVICTION_POLICIES[0]
+        self.cache_folder = cache_folder
+        self.quota_bytes = quota_bytes
+        self.policy = policy
+        self.enforce_every = enforce_every
+        self.flush_every = flush_every
+
+        self._writes = 0
+        self._conn = None
+        self._lock = threading.Lock()
+        self._requests, self._access, self._pending = {}, {}, 0
+        _managers.add(self)
+
+    def record(self, source, key):
+        """ Record the outcome of a cache request
+
+        Requests are kept in memory and written to the access database every
+        ``flush_every`` requests (see `flush`), so a click does not commit a
+        transaction to a possibly network mounted cache folder.
+
+        Args:
+            source (str or None): where data were found, either a kind of
+                cache (e.g., "pixel" or "line") or None if data were not
+                cached
+            key (str or None): key of cache entry read or written (see
+                ``entry_key`` of pixel cache stores), or None if no entry was
+                used
+
+        """
+        kind = 'hit' if source else 'miss'
+        with self._lock:
+            self._requests[kind] = self._requests.get(kind, 0) + 1
+            if key:
+                hits = self._access.get(key, (0, 0))[1]
+                self._access[key] = (time.time(), hits + (1 if source else 0))
+            self._pending += 1
+            flush = self._pending >= self.flush_every
+        if flush:
+            self.flush()
+
+        if not source and key:
+            self._writes += 1
+            if self.quota_bytes and self._writes >= self.enforce_every:
+                self.enforce()
+
+    def flush(self):
+        """ Write cache requests recorded in memory to the access database
+        """
+        with self._lock:
+            requests, access = self._requests, self._access
+            self._requests, self._access, self._pending = {}, {}, 0
+        if not requests and not access:
+            return
+
+        conn = self._connection()
+        with conn:
+            for kind, count in requests.items():
+                conn.execute('INSERT OR IGNORE INTO requests VALUES (?, 0)',
+                             (kind, ))
+                conn.execute('UPDATE requests SET count = count + ? '
+                             'WHERE kind = ?', (count, kind))
+            for key, (last_access, hits) in access.items():
+                conn.execute('INSERT OR IGNORE INTO access VALUES (?, 0, 0)',
+                             (key, ))
+                conn.execute('UPDATE access SET last_access = ?, '
+                             'hits = hits + ? WHERE key = ?',
+                             (last_access, hits, key))
+
+    def close(self):
+        """ Write cache requests recorded in memory and close the access
+        database
+
+        The database is opened again if the manager is used after closing.
+        """
+        self.flush()
+        with self._lock:
+            conn, self._conn = self._conn, None
+        if conn is not None:
+            conn.close()
+
+    def entries(self):
+        """ Return all entries within the cache folder
+
+        Returns:
+            list: tuples of key, size in bytes, last access time, and number
+                of hits for each cache entry
+
+        """
+        self.flush()
+        sizes = {}
+        for fname in os.listdir(self.cache_folder):
+            # Skip access metadata, SQLite databases (including journals),
+            # the image catalog, and hidden lock and temporary files
+            if fname.startswith((self.filename, SQLitePixelStore.filename,
+                                 CATALOG_FILENAME, '.')):
+                continue
+            path = os.path.join(self.cache_folder, fname)
+            if not os.path.isfile(path):
+                continue
+            # Sidecar files belong to the entry they describe
+            key = fname[:-len('.sha1')] if fname.endswith('.sha1') else fname
+            sizes[key] = sizes.get(key, 0) + os.path.getsize(path)
+
+        with self._sqlite_store() as store:
+            if store is not None:
+                for name, nbytes in store.entries():
+                    sizes[store.entry_key(name)] = nbytes
+
+        access = dict(
+            (key, (last_access, hits)) for key, last_access, hits in
+            self._connection().execute(
+                'SELECT key, last_access, hits FROM access'))
+
+        return [(key, nbytes) + access.get(key, (0, 0))
+                for key, nbytes in sizes.items()]
+
+    def enforce(self):
+        """ Evict cache entries until the cache folder is within its quota
+
+        Returns:
+            int: number of entries evicted
+
+        """
+        self._writes = 0
+        if not self.quota_bytes:
+            return 0
+
+        with cache_lock(self.cache_folder):
+            return self._enforce()
+
+    def _enforce(self):
+        entries = self.entries()
+        total = sum([e[1] for e in entries])
+
+        # Forget entries removed by other means (e.g., upgraded pixels)
+        conn = self._connection()
+        keys = set(e[0] for e in entries)
+        with conn:
+            conn.executemany('DELETE FROM access WHERE key = ?', [
+                (key, ) for (key, ) in
+                conn.execute('SELECT key FROM access').fetchall()
+                if key not in keys])
+
+        if total <= self.quota_bytes:
+            return 0
+
+        if self.policy == 'lru':
+            entries.sort(key=lambda e: e[2])
+        else:
+            entries.sort(key=lambda e: (e[3], e[2]))
+
+        evicted = []
+        with self._sqlite_store() as store:
+            for key, nbytes, _, _ in entries:
+                if total <= self.quota_bytes:
+                    break
+                try:
+                    self._delete(key, store)
+                except (IOError, OSError) as e:
+                    logger.warning('Could not evict cache entry %s: %s' %
+                                   (key, e))
+                    continue
+                evicted.append((key, ))
+                total -= nbytes
+
+        with conn:
+            conn.executemany('DELETE FROM access WHERE key = ?', evicted)
+        logger.debug('Evicted %i cache entries from %s' %
+                     (len(evicted), self.cache_folder))
+
+        return len(evicted)
+
+    def report(self):
+        """ Return size, number of entries, and hit rate of the cache folder
+
+        Returns:
+            dict: cache folder usage
+
+        """
+        entries = self.entries()
+        requests = dict(self._connection().execute(
+            'SELECT kind, count FROM requests'))
+        hits, misses = requests.get('hit', 0), requests.get('miss', 0)
+
+        return {
+            'cache_folder': self.cache_folder,
+            'nbytes': sum([e[1] for e in entries]),
+            'entries': len(entries),
+            'quota_bytes': self.quota_bytes,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / float(hits + misses) if hits + misses else 0.0
+        }
+
+    @contextmanager
+    def _sqlite_store(self):
+        """ Yield the SQLite pixel store of the cache folder, or None if
+        there is none, closing it afterwards
+        """
+        filename = os.path.join(self.cache_folder, SQLitePixelStore.filename)
+        if not os.path.isfile(filename):
+            yield None
+            return
+        store = SQLitePixelStore(filename)
+        try:
+            yield store
+        finally:
+            store.close()
+
+    def _delete(self, key, store):
+        prefix = SQLitePixelStore.filename + '/'
+        if key.startswith(prefix):
+            store.delete_pixel(key[len(prefix):])
+            return
+
+        path = os.path.join(self.cache_folder, key)
+        os.remove(path)
+        if os.path.isfile(path + '.sha1'):
+            os.remove(path + '.sha1')
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(
+                os.path.join(self.cache_folder, self.filename),
+                timeout=30, check_same_thread=False)
+            for create in self._create:
+                self._conn.execute(create)
+        return self._conn
+
+
+@atexit.register
+def _flush_managers():
+    """ Write cache requests of all managers before Python exits """
+    for manager in list(_managers):
+        try:
+            manager.flush()
+        except Exception as e:
+            logger.warning('Could not write cache access records for %s: %s'
+                           % (manager.cache_folder, e))
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description='Report on or enforce quotas for cache folders')
+    subparsers = parser.add_subparsers(dest='command')
+
+    p = subparsers.add_parser('report', help='Report cache folder usage')
+    p.add_argument('cache_folders', nargs='+', help='Cache folder(s)')
+
+    p = subparsers.add_parser('enforce', help='Evict entries over a quota')
+    p.add_argument('cache_folders', nargs='+', help='Cache folder(s)')
+    p.add_argument('--quota-mb', type=int, required=True,
+                   help='Cache quota in megabytes')
+    p.add_argument('--policy', default='lru', choices=EVICTION_POLICIES,
+                   help='Eviction policy (default: %(default)s)')
+
+    args = parser.parse_args(args)
+
+    for cache_folder in args.cache_folders:
+        if args.command == 'report':
+            report = CacheManager(cache_folder).report()
+            print('{cache_folder}\n'
+                  '    size:     {mb:.1f} MB\n'
+                  '    entries:  {entries}\n'
+                  '    hit rate: {hit_rate:.1%} '
+                  '({hits} hits, {misses} misses)'.format(
+                      mb=report['nbytes'] / 1024.0 ** 2, **report))
+        elif args.command == 'enforce':
+            manager = CacheManager(cache_folder,
+                                   quota_bytes=args.quota_mb * 1024 ** 2,
+                                   policy=args.policy)
+            print('{0}: evicted {1} entries'.format(cache_folder,
+                                                    manager.enforce()))
+
+
+if __name__ == '__main__':
+    main()
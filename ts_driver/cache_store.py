@@ -0,0 +1,464 @@
+""" Storage backends for pixel caches
+
+A pixel cache "store" saves and validates the data of one `Series` for one
+pixel, identified by the name returned from `ts_utils.name_cache_pixel`.
+Stores provide the following methods:
+
+    has_pixel(name): return True if a pixel is within the store
+    read_pixel(name, series): return cached data if it passes validation
+    write_pixel(name, series): save the current data of a Series
+    delete_pixel(name): remove a pixel from the store
+    entry_key(name): return the key of a pixel within the cache folder, as
+        used by `cache_manager.CacheManager`
+    find_previous(x, y, series): return the name, image IDs, and data of a
+        cached pixel written for an older set of images, or None
+
+This module also provides `MemoryCache`, used by drivers to keep recently
+queried pixels in memory.
+"""
+from collections import OrderedDict
+import logging
+import os
+import re
+import sqlite3
+import sys
+import threading
+try:
+    from urllib import pathname2url
+except ImportError:  # Python 3
+    from urllib.request import pathname2url
+import zipfile
+
+import numpy as np
+
+from . import ts_utils
+
+logger = logging.getLogger('tstools')
+
+#: list: names of available pixel cache backends
+CACHE_BACKENDS = ['npz', 'sqlite']
+
+
+class NPZPixelStore(object):
+    """ Pixel cache storing each pixel as a NumPy zipped array file
+
+    The numbers of images of pixels within the cache folder are indexed once
+    per store, so `find_previous` checks a few filenames instead of listing
+    the cache folder on every cache miss.
+
+    Args:
+        cache_folder (str): location of cache folder
+
+    """
+    def __init__(self, cache_folder):
+        self.cache_folder = cache_folder
+        self._nimages = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return 'NPZPixelStore(%s)' % self.cache_folder
+
+    def has_pixel(self, name):
+        return os.path.isfile(os.path.join(self.cache_folder, name))
+
+    def read_pixel(self, name, series):
+        return ts_utils.read_cache_pixel(
+            os.path.join(self.cache_folder, name), series)
+
+    def write_pixel(self, name, series):
+        ts_utils.write_cache_pixel(
+            os.path.join(self.cache_folder, name), series)
+        key = (series.cache_prefix, series.cache_suffix, series.count)
+        with self._lock:
+            if key in self._nimages:
+                self._nimages[key].add(series.n)
+
+    def delete_pixel(self, name):
+        with ts_utils.cache_lock(self.cache_folder):
+            os.remove(os.path.join(self.cache_folder, name))
+
+    def entry_key(self, name):
+        return name
+
+    def find_previous(self, x, y, series):
+        # Caches are written atomically and caches removed while searching
+        # fail to load, so the cache folder is not locked. Prefer caches with
+        # the most images
+        for n in sorted(self._image_counts(series), reverse=True):
+            if n >= series.n:
+                continue
+            name = ts_utils.name_cache_pixel(x, y, (series.count, n),
+                                             prefix=series.cache_prefix,
+                                             suffix=series.cache_suffix)
+            filename = os.path.join(self.cache_folder, name)
+            if not os.path.isfile(filename):
+                continue
+            try:
+                z = ts_utils.load_cache_npz(filename)
+                return name, z['image_IDs'], z['Y']
+            except (IOError, OSError, KeyError, ValueError,
+                    zipfile.BadZipfile) as e:
+                logger.warning('Could not read previous pixel cache %s: %s'
+                               % (filename, e))
+        return None
+
+    def _image_counts(self, series):
+        """ Return numbers of images of pixels cached for a kind of Series
+        """
+        key = (series.cache_prefix, series.cache_suffix, series.count)
+        with self._lock:
+            if key not in self._nimages:
+                regex = re.compile(r'^%sx\d+_y\d+_n(\d+)_b%i%s\.npz$' % (
+                    re.escape(series.cache_prefix), series.count,
+                    re.escape(series.cache_suffix)))
+                counts = set()
+                if os.path.isdir(self.cache_folder):
+                    for fname in os.listdir(self.cache_folder):
+                        match = regex.match(fname)
+                        if match:
+                            counts.add(int(match.group(1)))
+                self._nimages[key] = counts
+            return self._nimages[key]
+
+
+class SQLitePixelStore(object):
+    """ Pixel cache storing many pixels within one SQLite database file
+
+    Each pixel is a row containing the `Series` fingerprint used for
+    validation, its image IDs, and the raw bytes of the `Series` data. SQLite
+    connections cannot be shared between threads, so one connection is
+    opened per thread.
+
+    The database is only created when a pixel is written, so a missing
+    database reads as an empty cache. Databases within cache folders that
+    cannot be written to, such as read-only shared folders, are opened
+    read-only.
+
+    Args:
+        filename (str): filename of SQLite database
+
+    """
+    filename = 'pixel_cache.sqlite'
+
+    _create = ('CREATE TABLE IF NOT EXISTS pixel ('
+               'name TEXT PRIMARY KEY, fingerprint TEXT, image_IDs TEXT, '
+               'dtype TEXT, nband INTEGER, nimage INTEGER, Y BLOB)')
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._local = threading.local()
+
+    def __repr__(self):
+        return 'SQLitePixelStore(%s)' % self.filename
+
+    @classmethod
+    def from_folder(cls, cache_folder):
+        """ Return a store using the default filename within a cache folder
+        """
+        return cls(os.path.join(cache_folder, cls.filename))
+
+    def has_pixel(self, name):
+        conn = self._connection()
+        if conn is None:
+            return False
+        cur = conn.execute('SELECT 1 FROM pixel WHERE name = ?', (name, ))
+        return cur.fetchone() is not None
+
+    def read_pixel(self, name, series):
+        """ Returns data read in from cache if passes validation
+
+        Args:
+            name (str): name of pixel cache entry
+            series (Series): Series within timeseries driver to read
+
+        Returns:
+            np.ndarray: 2D np.ndarray of 'Y' data for series
+
+        Raises:
+            IndexError: raise IndexError if cached data does not exist or
+                does not match images used in timeseries series
+
+        """
+        conn = self._connection()
+        row = None
+        if conn is not None:
+            row = conn.execute('SELECT fingerprint FROM pixel WHERE name = ?',
+                               (name, )).fetchone()
+        if row is None:
+            raise IndexError('Could not find cache data for %s' % name)
+        if row[0] != series.fingerprint:
+            raise IndexError('Could not find cache data for series %s. '
+                             'image_IDs are not the same' % series.description)
+
+        dtype, nband, nimage, Y = conn.execute(
+            'SELECT dtype, nband, nimage, Y FROM pixel WHERE name = ?',
+            (name, )).fetchone()
+        return np.frombuffer(Y, dtype=dtype).reshape(nband, nimage).copy()
+
+    def write_pixel(self, name, series):
+        """ Save one series data to the database
+
+        Args:
+            name (str): name of pixel cache entry
+            series (Series): Series within timeseries driver to save
+
+        """
+        logger.debug('Caching pixel %s to %s' % (name, self.filename))
+        data = np.ascontiguousarray(series.data)
+        conn = self._connection(create=True)
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO pixel VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (name, series.fingerprint, '\n'.join(series.images['id']),
+                 data.dtype.str,
+                 data.shape[0], data.shape[1],
+                 sqlite3.Binary(data.tobytes())))
+
+    def delete_pixel(self, name):
+        conn = self._connection()
+        if conn is None:
+            return
+        with conn:
+            conn.execute('DELETE FROM pixel WHERE name = ?', (name, ))
+
+    def entry_key(self, name):
+        return os.path.basename(self.filename) + '/' + name
+
+    def entries(self):
+        """ Return the name and size in bytes of each pixel in the store
+        """
+        conn = self._connection()
+        if conn is None:
+            return []
+        return conn.execute('SELECT name, length(Y) FROM pixel').fetchall()
+
+    def find_previous(self, x, y, series):
+        pattern = ts_utils.name_cache_pixel(x, y, (series.count, '%'),
+                                            prefix=series.cache_prefix,
+                                            suffix=series.cache_suffix)
+        conn = self._connection()
+        if conn is None:
+            return None
+        row = conn.execute(
+            'SELECT name, image_IDs, dtype, nband, nimage, Y FROM pixel '
+            'WHERE name LIKE ? AND nimage < ? ORDER BY nimage DESC LIMIT 1',
+            (pattern, series.n)).fetchone()
+        if row is None:
+            return None
+
+        name, image_IDs, dtype, nband, nimage, Y = row
+        return (name, np.array(image_IDs.split('\n'), dtype=object),
+                np.frombuffer(Y, dtype=dtype).reshape(nband, nimage))
+
+    def close(self):
+        """ Close the database connection of the calling thread, if open
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def _connection(self, create=False):
+        """ Return the database connection of the calling thread
+
+        Args:
+            create (bool): create the database if it does not exist
+
+        Returns:
+            sqlite3.Connection: connection, or None if the database does not
+                exist and ``create`` is False
+
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            return conn
+
+        exists = os.path.isfile(self.filename)
+        if not exists and not create:
+            return None
+        folder = os.path.dirname(os.path.abspath(self.filename))
+        if (os.access(folder, os.W_OK) and
+                (not exists or os.access(self.filename, os.W_OK))):
+            conn = sqlite3.connect(self.filename, timeout=30)
+            conn.execute(self._create)
+        else:
+            conn = _connect_read_only(self.filename)
+        self._local.conn = conn
+        return conn
+
+
+def _connect_read_only(filename):
+    """ Open a SQLite database read-only, without creating it or its journal
+    """
+    uri = 'file:%s?mode=ro' % pathname2url(os.path.abspath(filename))
+    try:
+        return sqlite3.connect(uri, timeout=30, uri=True)
+    except TypeError:
+        # Python 2 cannot open URIs, but SQLite opens databases it cannot
+        # write to read-only
+        return sqlite3.connect(filename, timeout=30)
+
+
+class MemoryCache(object):
+    """ A least recently used in-memory cache bounded by total size
+
+    Used by drivers to keep the data and model results of recently queried
+    pixels so that revisiting a pixel needs no disk access or model fitting.
+
+    Args:
+        max_bytes (int): maximum size of all cached values in bytes. A size
+            of 0 disables the cache
+
+    Attributes:
+        hits (int): number of values found within the cache
+        misses (int): number of values not found within the cache
+        evictions (int): number of values dropped to stay within
+            ``max_bytes``
+        nbytes (int): current estimated size of all cached values in bytes
+
+    """
+    def __init__(self, max_bytes=0):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.nbytes = 0
+
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._values)
+
+    def get(self, key):
+        """ Return a cached value, or None if it is not cached
+
+        Args:
+            key (tuple): key of value
+
+        Returns:
+            object: cached value, or None
+
+        """
+        with self._lock:
+            item = self._values.pop(key, None)
+            if item is None:
+                self.misses += 1
+                return None
+            self._values[key] = item
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, value, nbytes=None):
+        """ Cache a value, evicting least recently used values if needed
+
+        Args:
+            key (tuple): key of value
+            value (object): value to cache. Values should not be modified
+                after they are cached
+            nbytes (int, optional): size of value, estimated with
+                `estimate_nbytes` if not given
+
+        """
+        if self.max_bytes <= 0:
+            return
+        if nbytes is None:
+            nbytes = estimate_nbytes(value)
+        with self._lock:
+            old = self._values.pop(key, None)
+            if old is not None:
+                self.nbytes -= old[1]
+            self._values[key] = (value, nbytes)
+            self.nbytes += nbytes
+            self._evict()
+
+    def resize(self, max_bytes):
+        """ Change maximum size of the cache, evicting values if needed
+
+        Args:
+            max_bytes (int): maximum size of all cached values in bytes
+
+        """
+        with self._lock:
+            self.max_bytes = max(int(max_bytes), 0)
+            self._evict()
+
+    def clear(self):
+        """ Drop all cached values """
+        with self._lock:
+            self.evictions += len(self._values)
+            self._values.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        """ Return cache counters
+
+        Returns:
+            dict: number of hits, misses, evictions, the number of values and
+                bytes cached, and the maximum size of the cache
+
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._values),
+                'nbytes': self.nbytes,
+                'max_bytes': self.max_bytes
+            }
+
+    def _evict(self):
+        while self._values and self.nbytes > self.max_bytes:
+            _, (_, nbytes) = self._values.popitem(last=False)
+            self.nbytes -= nbytes
+            self.evictions += 1
+
+
+def estimate_nbytes(value, _depth=0):
+    """ Return an estimate of the memory used by a value
+
+    NumPy arrays, and sequences or objects containing them, are measured by
+    the size of their data. Containers are only measured a few levels deep.
+
+    Args:
+        value (object): value to measure
+
+    Returns:
+        int: estimated size in bytes
+
+    """
+    if hasattr(value, 'nbytes'):
+        return int(value.nbytes)
+    if _depth > 2:
+        return sys.getsizeof(value)
+    if isinstance(value, (list, tuple)):
+        return sum(estimate_nbytes(v, _depth + 1) for v in value)
+    if isinstance(value, dict):
+        return sum(estimate_nbytes(v, _depth + 1) for v in value.values())
+    if hasattr(value, '__dict__'):
+        return (sys.getsizeof(value) +
+                estimate_nbytes(vars(value), _depth + 1))
+    return sys.getsizeof(value)
+
+
+def open_store(backend, cache_folder):
+    """ Return a pixel cache store for a backend within a cache folder
+
+    Unknown backends are logged and replaced by "npz", so a mistyped
+    configuration does not prevent opening a dataset.
+
+    Args:
+        backend (str): name of backend (see `CACHE_BACKENDS`)
+        cache_folder (str): location of cache folder
+
+    Returns:
+        object: pixel cache store
+
+    """
+    if backend == 'sqlite':
+        return SQLitePixelStore.from_folder(cache_folder)
+    elif backend != 'npz':
+        logger.warning('Unknown cache backend "%s" (options: %s). Using "npz"'
+                       % (backend, ', '.join(CACHE_BACKENDS)))
+    return NPZPixelStore(cache_folder)
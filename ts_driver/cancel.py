@@ -0,0 +1,39 @@
+""" Cancellation of requests to fetch timeseries data
+
+A `CancelToken` is shared between the thread requesting data and the thread
+running the ``fetch_data`` generators of a driver. Generators check the
+token between reads of images and raise `FetchCancelled` once it is
+cancelled, so no partially read data are kept or cached.
+"""
+import threading
+
+
+class FetchCancelled(Exception):
+    """ Raised when a request to fetch data is cancelled """
+    pass
+
+
+class CancelToken(object):
+    """ Thread safe flag used to cancel a request to fetch data
+    """
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        """ Cancel the request """
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        """ bool: True if the request has been cancelled """
+        return self._event.is_set()
+
+    def check(self):
+        """ Raise `FetchCancelled` if the request has been cancelled
+
+        Raises:
+            FetchCancelled: if the request has been cancelled
+
+        """
+        if self._event.is_set():
+            raise FetchCancelled('Request to fetch data was cancelled')
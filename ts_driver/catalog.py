@@ -0,0 +1,143 @@
+""" Persisted catalogs of the images within a timeseries dataset
+
+Opening a dataset normally walks the dataset directory tree to find images,
+parses the date of every image, and opens an image with GDAL. A catalog
+saves the result, as returned by `Series.to_index`, within the cache folder
+so later opens need only read one file.
+
+A catalog is only used if it was written for the same dataset location and
+search parameters, and if the modification time of every directory between
+the dataset location and its images is unchanged. Adding or removing an image
+directory changes the modification time of its parent, so the catalog is
+rewritten. Images added beneath a directory that contained no images when
+the catalog was written are not noticed; delete the catalog to rescan.
+Modification times are only trusted if they are older than the catalog by
+more than their resolution (see `ts_utils.MTIME_RESOLUTION`), since a
+directory changed just after it was searched may keep the same time.
+
+Catalogs also keep the directory listings of the last search for images
+(see `ts_utils.find_files`), so a search after the dataset changes only
+lists directories that were modified.
+"""
+import json
+import logging
+import os
+import time
+
+from .ts_utils import MTIME_RESOLUTION, atomic_write
+
+logger = logging.getLogger('tstools')
+
+#: str: filename of image catalog within a cache folder
+CATALOG_FILENAME = 'catalog.json'
+#: int: version of catalog format
+CATALOG_VERSION = 1
+
+
+def _image_dirs(location, paths):
+    """ Return all directories from ``location`` down to each image
+
+    Args:
+        location (str): root location of dataset
+        paths (iterable): paths to images within ``location``
+
+    Returns:
+        set: directories, relative to ``location``
+
+    """
+    dirs = set(['.'])
+    for path in paths:
+        d = os.path.dirname(os.path.relpath(path, location))
+        while d and d not in dirs:
+            dirs.add(d)
+            d = os.path.dirname(d)
+    return dirs
+
+
+def _dir_mtimes(location, dirs):
+    return dict((d, os.stat(os.path.join(location, d)).st_mtime)
+                for d in dirs)
+
+
+def read_catalog(filename, location, params):
+    """ Return a Series index and directory listings from a catalog
+
+    Args:
+        filename (str): filename of catalog
+        location (str): root location of dataset
+        params (dict): parameters used to find images and parse their dates
+            (e.g., search pattern, ignored directories, and date format)
+
+    Returns:
+        tuple: Series index (see `Series.to_index`), or None if the catalog
+            does not exist or is out of date, and directory listings saved by
+            the last search for images, used as ``state`` for
+            `ts_utils.find_files`, which are empty if the catalog does not
+            exist or was written for other parameters
+
+    """
+    catalog = _read(filename, location, params)
+    if catalog is None:
+        return None, {}
+    scan_state = catalog.get('scan_state') or {}
+    try:
+        mtimes = _dir_mtimes(location, catalog['mtimes'])
+        written = catalog.get('written', 0)
+        if (mtimes != catalog['mtimes'] or
+                any([mtime > written - MTIME_RESOLUTION
+                     for mtime in mtimes.values()])):
+            logger.debug('Image catalog %s is out of date' % filename)
+            return None, scan_state
+    except Exception as e:
+        logger.warning('Could not read image catalog %s: %s' % (filename, e))
+        return None, scan_state
+
+    return catalog['index'], scan_state
+
+
+def _read(filename, location, params):
+    """ Return a catalog written for a location and parameters, or None
+    """
+    if not os.path.isfile(filename):
+        return None
+    try:
+        with open(filename, 'r') as f:
+            catalog = json.load(f)
+    except Exception as e:
+        logger.warning('Could not read image catalog %s: %s' % (filename, e))
+        return None
+
+    if (catalog.get('version') != CATALOG_VERSION or
+            catalog.get('location') != os.path.abspath(location) or
+            catalog.get('params') != json.loads(json.dumps(params))):
+        logger.debug('Image catalog %s was written for another dataset or '
+                     'parameters' % filename)
+        return None
+    return catalog
+
+
+def write_catalog(filename, location, params, series, scan_state=None):
+    """ Save the images of a Series to a catalog
+
+    Args:
+        filename (str): filename of catalog
+        location (str): root location of dataset
+        params (dict): parameters used to find images and parse their dates
+        series (Series): Series to catalog
+        scan_state (dict, optional): directory listings from
+            `ts_utils.find_files`
+
+    """
+    index = series.to_index()
+    catalog = {
+        'version': CATALOG_VERSION,
+        'written': time.time(),
+        'location': os.path.abspath(location),
+        'params': params,
+        'mtimes': _dir_mtimes(location, _image_dirs(location,
+                                                    index['paths'])),
+        'index': index,
+        'scan_state': scan_state or {}
+    }
+    with atomic_write(filename, 'w') as f:
+        json.dump(catalog, f)
@@ -0,0 +1,240 @@
+""" Pixel-major timeseries "cubes" and a `Series` that reads from them
+
+Reading one pixel from a "stacked" timeseries requires one read from every
+image in the timeseries. A timeseries cube stores the same data transposed so
+that all bands of all images for a pixel are contiguous on disk. Cubes are
+split into chunks of rows, each saved as an uncompressed NumPy array of shape
+(nrow, ncol, nband, nimage), and described by a JSON index.
+
+Cubes are created outside of QGIS from the directory containing the plugin,
+for example::
+
+    python -m tstools.ts_driver.cube /path/to/stack --chunk-rows 8
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+from . import ts_utils
+from .reader import dataset_pool
+from .metrics import Metrics
+from .series import Series
+
+logger = logging.getLogger('tstools')
+
+INDEX_FILENAME = 'cube.json'
+
+
+def name_cube_chunk(row):
+    """ Return a filename for a cube chunk starting at a given row
+
+    Args:
+        row (int): first row of chunk
+
+    Returns:
+        str: chunk filename
+
+    """
+    return 'r%s.npy' % row
+
+
+def read_cube_index(location):
+    """ Read the JSON index of a timeseries cube
+
+    Args:
+        location (str): cube directory
+
+    Returns:
+        dict: cube index
+
+    Raises:
+        IOError: raise IOError if index does not exist
+
+    """
+    with open(os.path.join(location, INDEX_FILENAME), 'r') as f:
+        return json.load(f)
+
+
+def _chunk_is_current(path, shape, series):
+    """ Return True if a chunk was written with this shape and images
+    """
+    if not os.path.isfile(path) or not os.path.isfile(path + '.sha1'):
+        return False
+    try:
+        with open(path + '.sha1', 'r') as f:
+            fingerprint = f.read().strip()
+        chunk = np.load(path, mmap_mode='r')
+    except (IOError, ValueError) as e:
+        logger.debug('Could not read cube chunk %s: %s' % (path, e))
+        return False
+    return (fingerprint == series.fingerprint and chunk.shape == shape and
+            chunk.dtype == series.dtype)
+
+
+def convert_stack(series, location, chunk_rows=8):
+    """ Transpose a `Series` of stacked images into a timeseries cube
+
+    Chunks that already exist for the same shape and images (checked against
+    a ``.sha1`` sidecar holding the `Series` fingerprint) are skipped so an
+    interrupted conversion can be resumed. Other chunks are rewritten, for
+    example after images are added, and the index of the previous cube is
+    removed before any are rewritten. The index is written last, so a cube is
+    only used once it is complete.
+
+    Args:
+        series (Series): Series of images to convert
+        location (str): output cube directory
+        chunk_rows (int): number of rows within each chunk
+
+    Yields:
+        int: row of each chunk as it is written
+
+    """
+    if not os.path.isdir(location):
+        os.makedirs(location)
+
+    index_fn = os.path.join(location, INDEX_FILENAME)
+    chunks = []
+    for row in range(0, series.height, chunk_rows):
+        nrow = min(chunk_rows, series.height - row)
+        fname = name_cube_chunk(row)
+        chunks.append(fname)
+
+        path = os.path.join(location, fname)
+        shape = (nrow, series.width, series.count, series.n)
+        if _chunk_is_current(path, shape, series):
+            logger.debug('Skipping existing cube chunk %s' % path)
+            continue
+
+        # The previous cube must not be used while chunks are rewritten
+        if os.path.isfile(index_fn):
+            os.remove(index_fn)
+
+        cube = np.empty(shape, dtype=series.dtype)
+        for i_img, img in enumerate(series.images['path']):
+            with dataset_pool.dataset(img) as ds:
+                dat = ds.ReadAsArray(0, row, series.width, nrow)
+            if dat.ndim == 2:
+                dat = dat[np.newaxis, ...]
+            cube[..., i_img] = dat.transpose(1, 2, 0)
+
+        with ts_utils.atomic_write(path) as f:
+            np.save(f, cube)
+        with ts_utils.atomic_write(path + '.sha1', 'w') as f:
+            f.write(series.fingerprint)
+
+        yield row
+
+    index = series.to_index()
+    index['chunk_rows'] = chunk_rows
+    index['chunks'] = chunks
+    with ts_utils.atomic_write(index_fn, 'w') as f:
+        json.dump(index, f)
+
+
+class CubeSeries(Series):
+    """ A `Series` reading data from a pixel-major timeseries cube
+
+    Reading a pixel is a single slice of a memory-mapped chunk instead of one
+    read per image.
+
+    Args:
+        location (str): cube directory
+        config (dict, optional): class attributes to set
+
+    """
+    description = 'Stacked TimeSeries Cube'
+
+    def __init__(self, location, config=None):
+        self.location = location
+        self.index = read_cube_index(location)
+        self._init_index(self.index)
+        self._init_paths()
+        self.chunk_rows = self.index['chunk_rows']
+        self.data = np.zeros((self.count, self.n), dtype=self.dtype)
+        self._scratch_data = np.zeros_like(self.data)
+        self.mask = np.ones(self.n, dtype=np.bool)
+        self.metrics = Metrics()
+        self._remaining = None
+        self._chunks = {}
+
+        if config:
+            self.__dict__.update(config)
+
+    def fetch_data(self, mx, my, crs_wkt, **kwargs):
+        """ Read data for a given x, y coordinate in a given CRS
+
+        Cube data are not cached, so cache related keyword arguments are
+        accepted and ignored.
+
+        Args:
+            mx (float): map X location
+            my (float): map Y location
+            crs_wkt (str): Well Known Text (Wkt) Coordinate reference system
+                string describing (x, y)
+
+        Yields:
+            float: current retrieval progress (1 to n)
+
+        Raises:
+            IndexError: raise IndexError if map coordinates are outside of
+                dataset
+
+        """
+        start = time.time()
+        self.metrics.count('fetches')
+        self._locate(mx, my, crs_wkt)
+        self.cache_source, self.cache_entry = 'cube', None
+
+        i_chunk = self.py // self.chunk_rows
+        chunk = self._chunks.get(i_chunk)
+        if chunk is None:
+            chunk = np.load(os.path.join(self.location,
+                                         self.index['chunks'][i_chunk]),
+                            mmap_mode='r')
+            self._chunks[i_chunk] = chunk
+
+        self.data = np.array(
+            chunk[self.py - i_chunk * self.chunk_rows, self.px],
+            dtype=self.data.dtype)
+        self.metrics.count('cube_hits')
+        self.metrics.count('bytes_read',
+                           self.count * self.n * self.dtype.itemsize)
+        self.metrics.add_time('fetch_data', time.time() - start)
+        yield float(self.n)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description='Convert a stacked timeseries into a timeseries cube')
+    parser.add_argument('location', help='Root location of stacked dataset')
+    parser.add_argument('--output', default=None,
+                        help='Cube directory (default: LOCATION/cube)')
+    parser.add_argument('--pattern', default='L*stack',
+                        help='Stack pattern (default: %(default)s)')
+    parser.add_argument('--date-index', nargs=2, type=int, default=[9, 16],
+                        help='Index of date in ID (default: %(default)s)')
+    parser.add_argument('--date-format', default='%Y%j',
+                        help='Date format (default: %(default)s)')
+    parser.add_argument('--chunk-rows', type=int, default=8,
+                        help='Rows per chunk (default: %(default)s)')
+    args = parser.parse_args(args)
+
+    output = args.output or os.path.join(args.location, 'cube')
+    images = ts_utils.find_files(args.location, args.pattern,
+                                 ignore_dirs=[os.path.basename(output)])
+    series = Series(images, args.date_index, args.date_format)
+
+    for row in convert_stack(series, output, chunk_rows=args.chunk_rows):
+        print('Wrote rows {0}-{1} of {2}'.format(
+            row, min(row + args.chunk_rows, series.height), series.height))
+
+
+if __name__ == '__main__':
+    main()
@@ -57,6 +57,14 @@ class CCDCTimeSeries(timeseries_stacked.StackedTimeSeries):
     def fetch_results(self):
         """ Read results for current pixel
         """
+        key = self._results_key()
+        cached = self._memory_cache.get(key)
+        if cached is not None:
+            logger.debug('Read results from memory')
+            self.metrics.count('memory_cache_hits')
+            self.ccdc_results = cached
+            return
+
         path = os.path.join(self.location, self.config['results_folder'].value)
         row = self.series[0].py + 1
 
@@ -65,7 +73,9 @@ class CCDCTimeSeries(timeseries_stacked.StackedTimeSeries):
             logger.error('Could not find result for row %s' % row)
             return
 
-        ccdc_results = spio.loadmat(result[0], squeeze_me=True)['rec_cg']
+        with self.metrics.timer('fetch_results'):
+            ccdc_results = spio.loadmat(result[0],
+                                        squeeze_me=True)['rec_cg']
         pos = self.series[0].py * self.series[0].width + self.series[0].px + 1
 
         pos_search = np.where(ccdc_results['pos'] == pos)[0]
@@ -75,6 +85,7 @@ class CCDCTimeSeries(timeseries_stacked.StackedTimeSeries):
                          (row, self.series[0].px + 1))
             return
         self.ccdc_results = ccdc_results[pos_search]
+        self._memory_cache.put(key, self.ccdc_results)
 
     def get_prediction(self, series, band, dates=None):
         """ Return prediction for a given band
@@ -160,9 +171,10 @@ class CCDCTimeSeries(timeseries_stacked.StackedTimeSeries):
         if len(self.ccdc_results) > 0:
             for rec in self.ccdc_results:
                 if rec['t_break'] != 0:
-                    _bx = dt.datetime.fromordinal(ml2ordinal(rec['t_break']))
-                    index = np.where(self.series[series].images['date'] ==
-                                     _bx)[0]
+                    _ordinal = ml2ordinal(rec['t_break'])
+                    _bx = dt.datetime.fromordinal(_ordinal)
+                    index = np.where(self.series[series].images['ordinal'] ==
+                                     _ordinal)[0]
                     if (index.size > 0 and index[0] < n_obs):
                         bx.append(_bx)
                         by.append(self.series[series].data[band, index[0]])
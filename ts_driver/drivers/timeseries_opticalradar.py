@@ -51,7 +51,8 @@ class YATSMLandsatPALSARTS(YATSMTimeSeries):
         # Add series for RADAR HH/HV/ratio
         self._find_radar()
 
-    def fetch_data(self, mx, my, crs_wkt):
+    def fetch_data(self, mx, my, crs_wkt, bands=None, cancel=None,
+                   snapshot=None, snapshot_every=100):
         """ Read data for a given x, y coordinate in a given CRS
 
         Args:
@@ -59,6 +60,14 @@ class YATSMLandsatPALSARTS(YATSMTimeSeries):
           my (float): map Y location
           crs_wkt (str): Well Known Text (Wkt) Coordinate reference system
             string describing (x, y)
+          bands (dict, optional): 0-indexed bands to read first, keyed by
+            index of Series. Only used for the Landsat Series because all
+            RADAR bands are needed to convert them to dB
+          cancel (CancelToken, optional): token used to cancel the request
+          snapshot (callable, optional): function called with snapshots of
+            the Landsat data read so far. RADAR data are not converted to dB
+            until read, so no snapshots are made of them
+          snapshot_every (int): number of images read between snapshots
 
         Yields:
           float: current retrieval progress (0 to 1)
@@ -68,8 +77,17 @@ class YATSMLandsatPALSARTS(YATSMTimeSeries):
             dataset
 
         """
+        if bands:
+            bands = {0: bands.get(0)}
+
+        def _snapshot(i_series, data, read, bands):
+            if i_series == 0:
+                snapshot(i_series, data, read, bands)
+
         for progress in super(YATSMLandsatPALSARTS, self).fetch_data(
-                mx, my, crs_wkt):
+                mx, my, crs_wkt, bands=bands, cancel=cancel,
+                snapshot=_snapshot if snapshot is not None else None,
+                snapshot_every=snapshot_every):
             yield progress
 
         # Convert RADAR DNs to dB: dB = ( DN - 1 ) * 0.15 - 31.0
@@ -78,10 +96,13 @@ class YATSMLandsatPALSARTS(YATSMTimeSeries):
                 continue
             logger.debug('Rescaling %s to dB' % (series.description, ))
             logger.debug(series.data.shape)
-            series.data[0, :] = (series.data[0, :] - 1) * 0.15 - 31.0
-            if series.data.shape[0] > 1:
-                series.data[1, :] = (series.data[1, :] - 1) * 0.15 - 31.0
-                series.data[2, :] = series.data[0, :] / series.data[1, :]
+            # Data are read in their native type, but dB are floating point
+            db = series.data_float()
+            db[0, :] = (db[0, :] - 1) * 0.15 - 31.0
+            if db.shape[0] > 1:
+                db[1, :] = (db[1, :] - 1) * 0.15 - 31.0
+                db[2, :] = db[0, :] / db[1, :]
+            series.data = db
             logger.debug('Rescaled. Data min/max: {0}/{1}'.format(
                          series.data.min(axis=1), series.data.max(axis=1)))
 
@@ -1,11 +1,18 @@
 """ Timeseries driver for a simple 'stacked' timeseries dataset
 """
 from collections import OrderedDict
+from functools import partial
 import logging
 import os
+import time
 
 import numpy as np
 
+from .. import cache_store, catalog, reader
+from ..cache_manager import CacheManager
+from ..cancel import FetchCancelled
+from ..cube import INDEX_FILENAME, CubeSeries
+from ..metrics import Metrics, dump_metrics
 from ..ts_utils import find_files, ConfigItem
 from ..series import Series
 from ..timeseries import AbstractTimeSeriesDriver
@@ -30,6 +37,8 @@ class StackedTimeSeries(AbstractTimeSeriesDriver):
     series = []
     mask_values = np.array([2, 3, 4, 255])
     _pixel_pos = ''
+    _fetch_keys = []
+    snapshots = None
     has_results = False
 
     # Driver configuration
@@ -38,51 +47,141 @@ class StackedTimeSeries(AbstractTimeSeriesDriver):
         ('date_index', ConfigItem('Index of date in ID', [9, 16])),
         ('date_format', ConfigItem('Date format', '%Y%j')),
         ('cache_folder', ConfigItem('Cache folder', 'cache')),
+        ('cache_backend', ConfigItem('Cache backend (npz/sqlite)', 'npz')),
+        ('cache_quota_mb', ConfigItem('Cache quota (MB, 0 for none)', 0)),
+        ('cache_policy', ConfigItem('Cache eviction (lru/lfu)', 'lru')),
         ('mask_band', ConfigItem('Mask band', [8])),
+        ('dataset_pool_size', ConfigItem('Open dataset pool size (0 for '
+                                         'all images)', 0)),
+        ('read_threads', ConfigItem('Parallel image reads', 4)),
+        ('block_cache_mb', ConfigItem('Image block cache (MB)', 0)),
+        ('cube_folder', ConfigItem('Timeseries cube folder', 'cube')),
+        ('memory_cache_mb', ConfigItem('Recent pixel memory (MB)', 64)),
+        ('metrics_folder', ConfigItem('Metrics JSON folder', '')),
     ))
 
     _read_cache, _write_cache = False, False
+    _cache_store = None
+    _cache_manager = None
+    _metrics_file = None
+    _checkpoints = None
 
     def __init__(self, location, config=None):
         super(StackedTimeSeries, self).__init__(location, config=config)
 
+        if 'block_cache_mb' in self.config:
+            reader.block_cache.resize(
+                self.config['block_cache_mb'].value * 1024 ** 2)
+        self._memory_cache = cache_store.MemoryCache(
+            self.config['memory_cache_mb'].value * 1024 ** 2
+            if 'memory_cache_mb' in self.config else 0)
+
+        # One metrics file per session, if requested
+        self.metrics = Metrics()
+        if ('metrics_folder' in self.config and
+                self.config['metrics_folder'].value):
+            self._metrics_file = os.path.join(
+                self.location, self.config['metrics_folder'].value,
+                'tstools_metrics_%s_%i.json' % (
+                    time.strftime('%Y%m%d_%H%M%S'), os.getpid()))
+
         # Find images and init Series
         ignore_dirs = []
         if 'cache_folder' in self.config:
             ignore_dirs.append(self.config['cache_folder'].value)
         if 'results_folder' in self.config:
             ignore_dirs.append(self.config['results_folder'].value)
-        images = find_files(self.location,
-                            self.config['stack_pattern'].value,
-                            ignore_dirs=ignore_dirs)
-
-        self.series = [
-            Series(
+        if 'cube_folder' in self.config:
+            ignore_dirs.append(self.config['cube_folder'].value)
+        series_config = {
+            'description': 'Stacked TS',
+            'symbology_hint_indices': [4, 3, 2],
+            'symbology_hint_minmax': [[0, 4000], [0, 5000], [0, 3000]],
+            'cache_prefix': 'yatsm_',
+            'cache_suffix': '.npy'
+        }
+
+        # Use the image catalog, if current, instead of searching for images
+        catalog_params = {
+            'stack_pattern': self.config['stack_pattern'].value,
+            'ignore_dirs': ignore_dirs,
+            'date_index': self.config['date_index'].value,
+            'date_format': self.config['date_format'].value
+        }
+        catalog_fn = None
+        index = None
+        scan_state = {}
+        if 'cache_folder' in self.config:
+            catalog_fn = os.path.join(self.location,
+                                      self.config['cache_folder'].value,
+                                      catalog.CATALOG_FILENAME)
+            index, scan_state = catalog.read_catalog(
+                catalog_fn, self.location, catalog_params)
+
+        if index is not None:
+            logger.debug('Read images from catalog %s' % catalog_fn)
+            series = Series(index['paths'], config=series_config,
+                            index=index)
+        else:
+            threads = (self.config['read_threads'].value
+                       if 'read_threads' in self.config else 1)
+            images = find_files(self.location,
+                                self.config['stack_pattern'].value,
+                                ignore_dirs=ignore_dirs,
+                                threads=threads,
+                                state=scan_state)
+            series = Series(
                 images,
                 self.config['date_index'].value,
                 self.config['date_format'].value,
-                {
-                    'description': 'Stacked TS',
-                    'symbology_hint_indices': [4, 3, 2],
-                    'symbology_hint_minmax': [[0, 4000], [0, 5000], [0, 3000]],
-                    'cache_prefix': 'yatsm_',
-                    'cache_suffix': '.npy'
-                })
-        ]
+                series_config)
+        self.series = [series]
+
+        self._check_cube(series_config)
         self._check_cache()
 
+        if index is None and catalog_fn and self._write_cache:
+            try:
+                catalog.write_catalog(catalog_fn, self.location,
+                                      catalog_params, series,
+                                      scan_state=scan_state)
+            except Exception as e:
+                logger.warning('Could not write image catalog %s: %s' %
+                               (catalog_fn, e))
+
     @property
     def pixel_pos(self):
         return self._pixel_pos
 
-    def fetch_data(self, mx, my, crs_wkt):
+    def fetch_data(self, mx, my, crs_wkt, bands=None, cancel=None,
+                   snapshot=None, snapshot_every=100):
         """ Read data for a given x, y coordinate in a given CRS
 
+        If ``bands`` are given, only those bands and the mask band of each
+        Series are read from images not already cached. The other bands are
+        read by `fetch_remaining`.
+
+        If the request is cancelled, or the generator is closed before it
+        ends, every Series returns to the pixel it held before, including
+        Series read before the request was cancelled.
+
+        If ``snapshot`` is given, it is called with copies of the data read
+        so far every ``snapshot_every`` images read from a Series, and once
+        each Series is read, for use with `set_snapshot`.
+
         Args:
           mx (float): map X location
           my (float): map Y location
           crs_wkt (str): Well Known Text (Wkt) Coordinate reference system
             string describing (x, y)
+          bands (dict, optional): 0-indexed bands to read first, keyed by
+            index of Series, or None to read all bands
+          cancel (CancelToken, optional): token used to cancel the request
+          snapshot (callable, optional): function called with the index of
+            a Series, a 2D np.ndarray (nband, n) of its data read so far, a 1D
+            boolean np.ndarray (n) of the images read, and the 0-indexed bands
+            read (np.ndarray), or None if all bands are read
+          snapshot_every (int): number of images read between snapshots
 
         Yields:
           float: current retrieval progress (0 to 1)
@@ -90,28 +189,79 @@ class StackedTimeSeries(AbstractTimeSeriesDriver):
         Raises:
           IndexError: raise IndexError if map coordinates are outside of
             dataset
+          FetchCancelled: raise FetchCancelled if ``cancel`` is cancelled
 
         """
         cache_folder = os.path.join(self.location,
                                     self.config['cache_folder'].value)
 
+        threads = (self.config['read_threads'].value
+                   if 'read_threads' in self.config else 1)
+
+        start = time.time()
         i = 0
         n = sum([len(series.images) for series in self.series])
+        self._size_dataset_pool(n)
 
-        descs, rowcol = [], []
+        descs, rowcol, keys = [], [], []
         for j, series in enumerate(self.series):
             _mx, _my = geo_utils.reproject_point(mx, my, crs_wkt, series.crs)
             _px, _py = geo_utils.point2pixel(_mx, _my, series.gt)
 
             descs.append(series.description)
             rowcol.append('%i/%i' % (_py, _px))
-
-            for _i in series.fetch_data(mx, my, crs_wkt,
-                                        cache_folder=cache_folder,
-                                        read_cache=self._read_cache,
-                                        write_cache=self._write_cache):
-                i += _i
-                yield i / float(n) * 100.0
+            keys.append((j, _px, _py, series.fingerprint))
+
+        # Recently queried pixels are kept in memory
+        cached = [self._memory_cache.get(key) for key in keys]
+        if all([dat is not None for dat in cached]):
+            logger.debug('Read pixel from memory')
+            self.metrics.count('memory_cache_hits')
+            for series, key, dat in zip(self.series, keys, cached):
+                series.px, series.py = key[1], key[2]
+                series.data = dat.copy()
+                series._remaining = None
+            self._checkpoints = None
+            yield 100.0
+        else:
+            checkpoints = [series._checkpoint() for series in self.series]
+            try:
+                for j, (series, key) in enumerate(zip(self.series, keys)):
+                    _snapshot = partial(snapshot, j) if snapshot else None
+                    for _i in series.fetch_data(
+                            mx, my, crs_wkt,
+                            cache_folder=cache_folder,
+                            read_cache=self._read_cache,
+                            write_cache=self._write_cache,
+                            threads=threads,
+                            cache_store=self._cache_store,
+                            bands=self._first_bands(j, bands),
+                            cancel=cancel,
+                            snapshot=_snapshot,
+                            snapshot_every=snapshot_every):
+                        yield (i + _i) / float(n) * 100.0
+                    i += series.n
+                    if snapshot is not None:
+                        read_bands = series.remaining_bands
+                        if read_bands is not None:
+                            read_bands = np.setdiff1d(
+                                np.arange(series.count), read_bands)
+                        snapshot(j, series.data.copy(),
+                                 np.ones(series.n, dtype=np.bool), read_bands)
+                    # Partially read data are kept once `fetch_remaining` is
+                    # done
+                    if series.remaining_bands is None:
+                        self._fetched(series, key)
+            except (FetchCancelled, GeneratorExit):
+                self._rollback(checkpoints)
+                raise
+            # Kept so a cancelled `fetch_remaining` can return to them
+            if any([series.remaining_bands is not None
+                    for series in self.series]):
+                self._checkpoints = checkpoints
+            else:
+                self._checkpoints = None
+        self._fetch_keys = keys
 
         # Collapse pixel position if same row/column
         pos = []
@@ -123,14 +273,111 @@ class StackedTimeSeries(AbstractTimeSeriesDriver):
             pos.append('/'.join(entry) + ' - ' + u_rowcol)
 
         self._pixel_pos = 'Row/Col: ' + '; '.join(pos)
+        logger.debug('Dataset pool: {0}'.format(reader.dataset_pool.stats()))
+        logger.debug('Block cache: {0}'.format(reader.block_cache.stats()))
+        logger.debug('Memory cache: {0}'.format(self._memory_cache.stats()))
 
         # Update mask
         self.update_mask()
 
+        self.metrics.add_time('fetch_data', time.time() - start)
+        self.dump_metrics()
+
+    def fetch_remaining(self, cancel=None):
+        """ Read bands skipped by the last call to `fetch_data`
+
+        If the request is cancelled, or the generator is closed before it
+        ends, every Series returns to the pixel it held before `fetch_data`,
+        so no Series keeps bands left unread.
+
+        Args:
+          cancel (CancelToken, optional): token used to cancel the request
+
+        Yields:
+          float: current retrieval progress (0 to 1)
+
+        Raises:
+          FetchCancelled: raise FetchCancelled if ``cancel`` is cancelled
+
+        """
+        threads = (self.config['read_threads'].value
+                   if 'read_threads' in self.config else 1)
+        remaining = [(series, key) for series, key in
+                     zip(self.series, self._fetch_keys)
+                     if series.remaining_bands is not None]
+        if not remaining:
+            return
+
+        start = time.time()
+        i = 0
+        n = sum([series.n for series, _ in remaining])
+        try:
+            for series, key in remaining:
+                for _i in series.fetch_remaining(threads=threads,
+                                                 cancel=cancel):
+                    yield (i + _i) / float(n) * 100.0
+                i += series.n
+                self._fetched(series, key)
+        except (FetchCancelled, GeneratorExit):
+            if self._checkpoints is not None:
+                self._rollback(self._checkpoints)
+                self._checkpoints = None
+            raise
+        self._checkpoints = None
+
+        self.metrics.add_time('fetch_remaining', time.time() - start)
+        self.dump_metrics()
+
     def fetch_results(self):
         """ Read or calculate results for current pixel """
         pass
 
+    def get_metrics(self):
+        """ Return counters and timers describing data retrieval
+
+        Also includes statistics of the shared dataset pool and block cache,
+        and of the driver's memory cache.
+
+        Returns:
+            dict: driver, Series, and cache metrics
+
+        """
+        metrics = super(StackedTimeSeries, self).get_metrics()
+        metrics['dataset_pool'] = reader.dataset_pool.stats()
+        metrics['block_cache'] = reader.block_cache.stats()
+        metrics['memory_cache'] = self._memory_cache.stats()
+        return metrics
+
+    def dump_metrics(self):
+        """ Write metrics to this session's JSON file, if configured
+        """
+        if not self._metrics_file:
+            return
+        try:
+            dump_metrics(self._metrics_file, self.get_metrics())
+        except Exception as e:
+            logger.warning('Could not write metrics to %s: %s' %
+                           (self._metrics_file, e))
+
+    def close(self):
+        """ Write cache access records kept in memory, close the cache
+        access database, and release datasets and blocks of this driver's
+        images
+
+        The dataset pool keeps the first datasets returned to it, so the
+        datasets of a closed driver would otherwise fill the pool and keep
+        the datasets of the next driver from being pooled.
+        """
+        reader.dataset_pool.clear()
+        reader.block_cache.clear()
+        if self._cache_manager is None:
+            return
+        try:
+            self._cache_manager.close()
+        except Exception as e:
+            logger.warning('Could not close cache manager for %s: %s' %
+                           (self.cache_folder, e))
+
     def update_mask(self, mask_values=None):
         """ Update data mask. Optionally also update mask values
 
@@ -139,7 +386,11 @@ class StackedTimeSeries(AbstractTimeSeriesDriver):
 
         """
         if mask_values is not None:
-            self.mask_values = np.asarray(mask_values).copy()
+            mask_values = np.asarray(mask_values).copy()
+            if not np.array_equal(mask_values, self.mask_values):
+                # Drop results calculated with the previous mask values
+                self._memory_cache.clear()
+            self.mask_values = mask_values
 
         for mask_band, series in zip(self.config['mask_band'].value,
                                      self.series):
@@ -148,6 +399,41 @@ class StackedTimeSeries(AbstractTimeSeriesDriver):
             series.mask = np.in1d(series.data[mask_band - 1, :],
                                   self.mask_values, invert=True)
 
+        if self.snapshots:
+            for i_series, snapshot in list(self.snapshots.items()):
+                data, read, _, bands = snapshot
+                self.set_snapshot(i_series, data, read, bands=bands)
+
+    def set_snapshot(self, i_series, data, read, bands=None):
+        """ Show a snapshot of data being fetched instead of a Series' data
+
+        While any snapshots are set, `get_data` returns data from snapshots
+        and no data for Series without a snapshot, or for bands not yet read.
+
+        Args:
+          i_series (int): index of Series
+          data (np.ndarray): 2D array (nband, n) of data read so far
+          read (np.ndarray): 1D boolean array (n) of images read so far
+          bands (np.ndarray, optional): 0-indexed bands read so far, or None
+            if all bands are read
+
+        """
+        mask = read.copy()
+        mask_band = (self.config['mask_band'].value[i_series]
+                     if i_series < len(self.config['mask_band'].value)
+                     else 0)
+        if mask_band:
+            mask &= np.in1d(data[mask_band - 1, :], self.mask_values,
+                            invert=True)
+
+        if self.snapshots is None:
+            self.snapshots = {}
+        self.snapshots[i_series] = (data, read, mask, bands)
+
+    def clear_snapshots(self):
+        """ Return to showing the data of each Series """
+        self.snapshots = None
+
     def get_data(self, series, band, mask=True, indices=None):
         """ Return data for a given band
 
@@ -165,15 +451,31 @@ class StackedTimeSeries(AbstractTimeSeriesDriver):
 
         """
         X = self.series[series].images
-        # y = self.series[series].data[band, :]
-        y = self.series[series].data.take(band, axis=0)
+        data, series_mask = self.series[series].data, self.series[series].mask
+        if self.snapshots is not None:
+            # Only images and bands read so far are returned
+            data, read, series_mask, read_bands = self.snapshots.get(
+                series, (data, np.zeros(X.size, dtype=np.bool),
+                         np.zeros(X.size, dtype=np.bool), None))
+            if (read_bands is not None and
+                    not np.all(np.in1d(band, read_bands))):
+                read = series_mask = np.zeros(X.size, dtype=np.bool)
+            if mask is False:
+                mask = series_mask = read
+        elif (self.series[series].remaining_bands is not None and
+                np.any(np.in1d(band, self.series[series].remaining_bands))):
+            # Bands left unread by `fetch_data` hold no data yet
+            series_mask = np.zeros(X.size, dtype=np.bool)
+            if mask is False:
+                mask = series_mask
+        # y = data[band, :]
+        y = data.take(band, axis=0)
 
         if mask is True:
-            mask = self.series[series].mask
+            mask = series_mask
         if isinstance(indices, np.ndarray):
             if isinstance(mask, np.ndarray):
-                mask = indices[np.in1d(indices,
-                                       np.where(self.series[series].mask)[0])]
+                mask = indices[np.in1d(indices, np.where(series_mask)[0])]
             else:
                 mask = indices
         elif isinstance(mask, np.ndarray):
@@ -216,6 +518,47 @@ class StackedTimeSeries(AbstractTimeSeriesDriver):
 
         return geom, crs
 
+    def _results_key(self):
+        """ Return key for results of current pixel within memory cache
+
+        Results depend on the pixel, the images used, the values masked, and
+        any custom controls used to calculate them.
+        """
+        controls = ()
+        if isinstance(self.controls, dict):
+            controls = tuple((k, repr(v.value))
+                             for k, v in self.controls.items())
+        series = self.series[0]
+        return ('results', series.px, series.py, series.fingerprint,
+                tuple(self.mask_values), controls)
+
+    def _check_cube(self, series_config):
+        """ Read first Series from a timeseries cube, if an up to date one
+        exists
+        """
+        if ('cube_folder' not in self.config or
+                not self.config['cube_folder'].value):
+            return
+        cube_folder = os.path.join(self.location,
+                                   self.config['cube_folder'].value)
+        if not os.path.isfile(os.path.join(cube_folder, INDEX_FILENAME)):
+            return
+
+        try:
+            cube_series = CubeSeries(cube_folder, series_config)
+        except Exception as e:
+            logger.warning('Could not open timeseries cube %s: %s' %
+                           (cube_folder, e))
+            return
+
+        if cube_series.fingerprint != self.series[0].fingerprint:
+            logger.warning('Not using timeseries cube %s because its images '
+                           'are not the same as the dataset' % cube_folder)
+            return
+
+        logger.debug('Reading data from timeseries cube %s' % cube_folder)
+        self.series[0] = cube_series
+
     def _check_cache(self):
         """ Check for read/write from/to cache folder
         """
@@ -238,3 +581,74 @@ class StackedTimeSeries(AbstractTimeSeriesDriver):
 
         logger.debug('Cache read/write: {r}/{w}'.format(
             r=self._read_cache, w=self._write_cache))
+
+        if ((self._read_cache or self._write_cache) and
+                'cache_backend' in self.config):
+            self._cache_store = cache_store.open_store(
+                self.config['cache_backend'].value, self.cache_folder)
+            logger.debug('Cache store: {0!r}'.format(self._cache_store))
+
+        if self._write_cache and 'cache_quota_mb' in self.config:
+            self._cache_manager = CacheManager(
+                self.cache_folder,
+                quota_bytes=self.config['cache_quota_mb'].value * 1024 ** 2,
+                policy=self.config['cache_policy'].value)
+            self._record_cache_access(None)
+
+    def _size_dataset_pool(self, n):
+        """ Size the shared dataset pool for reading ``n`` images per query
+
+        Unless configured otherwise, the pool keeps every image open, up to
+        the limit on open files (see `reader.max_pool_size`).
+        """
+        if 'dataset_pool_size' not in self.config:
+            return
+        size = self.config['dataset_pool_size'].value or \
+            reader.max_pool_size(n)
+        if size != reader.dataset_pool.size:
+            reader.dataset_pool.resize(size)
+
+    def _rollback(self, checkpoints):
+        """ Return every Series to the pixel it held before a request
+
+        Args:
+          checkpoints (list): state of each Series (see `Series._checkpoint`)
+
+        """
+        for series, checkpoint in zip(self.series, checkpoints):
+            series._rollback(checkpoint)
+
+    def _first_bands(self, i_series, bands):
+        """ Return bands of a Series to read first, including its mask band
+        """
+        if not bands or bands.get(i_series) is None:
+            return None
+        first = list(bands[i_series])
+        if i_series < len(self.config['mask_band'].value):
+            mask_band = self.config['mask_band'].value[i_series]
+            if mask_band:
+                first.append(mask_band - 1)
+        return first
+
+    def _fetched(self, series, key):
+        """ Keep data of a Series once all of its bands are read
+        """
+        self._memory_cache.put(key, series.data.copy())
+        if self._cache_manager is not None:
+            self._record_cache_access(series)
+
+    def _record_cache_access(self, series):
+        """ Record cache use of a Series, or enforce quota if None given
+
+        Problems with the cache manager should never prevent reading data, so
+        errors are logged and otherwise ignored.
+        """
+        try:
+            if series is None:
+                self._cache_manager.enforce()
+            else:
+                self._cache_manager.record(series.cache_source,
+                                           series.cache_entry)
+        except Exception as e:
+            logger.warning('Could not update cache manager for %s: %s' %
+                           (self.cache_folder, e))
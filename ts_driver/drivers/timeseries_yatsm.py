@@ -16,7 +16,6 @@ import sklearn.externals.joblib as jl
 from . import timeseries_stacked
 from ..ts_utils import ConfigItem, find_files, parse_landsat_MTL
 from ... import settings
-from ...logger import qgis_log
 
 logger = logging.getLogger('tstools')
 
@@ -68,20 +67,14 @@ class YATSMTimeSeries(timeseries_stacked.StackedTimeSeries):
     has_results = True
 
     # Driver configuration
-    config = OrderedDict((
-        ('stack_pattern', ConfigItem('Stack pattern', 'L*stack')),
-        ('date_index', ConfigItem('Date index', [9, 16])),
-        ('date_format', ConfigItem('Date format', '%Y%j')),
-        ('cache_folder', ConfigItem('Cache folder', 'cache')),
-        ('results_folder', ConfigItem('Results folder', 'YATSM')),
-        ('results_pattern', ConfigItem('Results pattern', 'yatsm_r*')),
-        ('mask_band', ConfigItem('Mask band', [8])),
-        ('min_values', ConfigItem('Min data values', [0])),
-        ('max_values', ConfigItem('Max data values', [10000])),
-        ('metadata_file_pattern', ConfigItem('Metadata file pattern',
-                                             'L*MTL.txt')),
-        ('calc_pheno', ConfigItem('LTM phenology', False)),
-    ))
+    config = timeseries_stacked.StackedTimeSeries.config.copy()
+    config['results_folder'] = ConfigItem('Results folder', 'YATSM')
+    config['results_pattern'] = ConfigItem('Results pattern', 'yatsm_r*')
+    config['min_values'] = ConfigItem('Min data values', [0])
+    config['max_values'] = ConfigItem('Max data values', [10000])
+    config['metadata_file_pattern'] = ConfigItem('Metadata file pattern',
+                                                 'L*MTL.txt')
+    config['calc_pheno'] = ConfigItem('LTM phenology', False)
 
     # Driver controls
     controls_title = 'YATSM Algorithm Options'
@@ -118,7 +111,7 @@ class YATSMTimeSeries(timeseries_stacked.StackedTimeSeries):
         # Setup YATSM
         self.yatsm_model = None
         self.X = None
-        self.Y = None
+        self._design_info = None
         self.coef_name = 'coef'
 
         # Setup min/max values
@@ -149,10 +142,22 @@ class YATSMTimeSeries(timeseries_stacked.StackedTimeSeries):
 
     def fetch_results(self):
         """ Read or calculate results for current pixel """
-        if self.controls['calculate_live'].value:
-            self._fetch_results_live()
+        key = self._results_key()
+        cached = self._memory_cache.get(key)
+        if cached is not None:
+            logger.debug('Read results from memory')
+            self.metrics.count('memory_cache_hits')
+            self.yatsm_model, self.X, self._design_info = cached
         else:
-            self._fetch_results_saved()
+            with self.metrics.timer('fetch_results'):
+                if self.controls['calculate_live'].value:
+                    results = self._fetch_results_live()
+                else:
+                    results = self._fetch_results_saved()
+            self._memory_cache.put(key, results)
+            # Results are fetched outside of the GUI thread, so are only
+            # changed once complete
+            self.yatsm_model, self.X, self._design_info = results
 
         # Update multitemporal screening metadata
         if self.yatsm_model:
@@ -180,6 +185,8 @@ class YATSMTimeSeries(timeseries_stacked.StackedTimeSeries):
                     self.series[0].pheno[idx[_sum]] = 'SUM'
                     self.series[0].pheno[idx[_aut]] = 'AUT'
 
+        self.dump_metrics()
+
     def get_prediction(self, series, band, dates=None):
         """ Return prediction for a given band
 
@@ -267,8 +274,8 @@ class YATSMTimeSeries(timeseries_stacked.StackedTimeSeries):
             for rec in self.yatsm_model.record:
                 if rec['break'] != 0:
                     _bx = dt.fromordinal(int(rec['break']))
-                    index = np.where(self.series[series].images['date'] ==
-                                     _bx)[0]
+                    index = np.where(self.series[series].images['ordinal'] ==
+                                     int(rec['break']))[0]
                     if (index.size > 0 and
                             index[0] < self.series[series].data.shape[1]):
                         bx.append(_bx)
@@ -354,8 +361,14 @@ class YATSMTimeSeries(timeseries_stacked.StackedTimeSeries):
 
 # RESULTS HELPER METHODS
     def _fetch_results_saved(self):
-        """ Read YATSM results and return """
-        self.yatsm_model = MockResult()
+        """ Read YATSM results and return
+
+        Returns:
+            tuple: model holding the saved record, design matrix, and design
+                information of the results
+
+        """
+        yatsm_model = MockResult()
         row, col = self.series[0].py, self.series[0].px
 
         data_cfg = {
@@ -368,9 +381,11 @@ class YATSMTimeSeries(timeseries_stacked.StackedTimeSeries):
         logger.info('Attempting to open: {f}'.format(f=result_filename))
 
         if not os.path.isfile(result_filename):
-            qgis_log('Could not find result for row {r} ({fn})'.format(
+            # Results are fetched outside of the GUI thread, so cannot use
+            # the QGIS message bar
+            logger.warning('Could not find result for row {r} ({fn})'.format(
                 r=row, fn=result_filename))
-            return
+            return yatsm_model, self.X, None
 
         z = np.load(result_filename)
         if 'record' not in z.files:
@@ -383,27 +398,33 @@ class YATSMTimeSeries(timeseries_stacked.StackedTimeSeries):
         if 'design' not in metadata['YATSM']:
             raise KeyError('Cannot find "design" within saved result metadata '
                            '({})'.format(result_filename))
-        self._design_info = metadata['YATSM']['design']
+        design_info = metadata['YATSM']['design']
 
         rec = z['record']
         idx = np.where((rec['px'] == col) & (rec['py'] == row))[0]
-        self.yatsm_model.record = rec[idx]
+        yatsm_model.record = rec[idx]
+        return yatsm_model, self.X, design_info
 
     def _fetch_results_live(self):
-        """ Run YATSM and get results """
+        """ Run YATSM and get results
+
+        Returns:
+            tuple: fitted model, design matrix, and design information of
+                the results
+
+        """
         logger.debug('Calculating YATSM results on the fly')
         # Setup design matrix, Y, and dates
-        self.X = patsy.dmatrix(self.controls['design'].value,
-                               {'x': self.series[0].images['ordinal'],
-                                'sensor': self.series[0].sensor,
-                                'pr': self.series[0].pathrow})
-        self._design_info = self.X.design_info.column_name_indexes
-        self.Y = self.series[0].data.astype(np.int16)
-        self.dates = np.asarray(self.series[0].images['ordinal'])
-
-        mask = self.Y[self.config['mask_band'].value[0] - 1, :]
-        Y_data = np.delete(self.Y, self.config['mask_band'].value[0] - 1,
-                           axis=0)
+        X = patsy.dmatrix(self.controls['design'].value,
+                          {'x': self.series[0].images['ordinal'],
+                           'sensor': self.series[0].sensor,
+                           'pr': self.series[0].pathrow})
+        design_info = X.design_info.column_name_indexes
+        Y = self.series[0].data
+        dates = np.asarray(self.series[0].images['ordinal'])
+
+        mask = Y[self.config['mask_band'].value[0] - 1, :]
+        Y_data = np.delete(Y, self.config['mask_band'].value[0] - 1, axis=0)
 
         # Mask out masked values
         clear = np.in1d(mask, self.mask_values, invert=True)
@@ -444,25 +465,25 @@ class YATSMTimeSeries(timeseries_stacked.StackedTimeSeries):
             dynamic_rmse=self.controls['dynamic_rmse'].value,
         )
 
-        self.yatsm_model = CCDCesque(**version_kwargs(kwargs))
+        yatsm_model = CCDCesque(**version_kwargs(kwargs))
         # Don't want to have DEBUG logging when we run YATSM
         log_level = logger.level
         logger.setLevel(logging.INFO)
 
         if self.controls['reverse'].value:
-            self.yatsm_model.fit(
-                np.flipud(self.X[clear, :]),
+            yatsm_model.fit(
+                np.flipud(X[clear, :]),
                 np.fliplr(Y_data[:, clear]),
-                self.dates[clear][::-1])
+                dates[clear][::-1])
         else:
-            self.yatsm_model.fit(
-                self.X[clear, :],
+            yatsm_model.fit(
+                X[clear, :],
                 Y_data[:, clear],
-                self.dates[clear])
+                dates[clear])
 
         if self.controls['commit_test'].value:
-            self.yatsm_model.record = postprocess.commission_test(
-                self.yatsm_model, self.controls['commit_alpha'].value)
+            yatsm_model.record = postprocess.commission_test(
+                yatsm_model, self.controls['commit_alpha'].value)
 
         # if self.controls['robust_results'].value:
         #     self.coef_name = 'robust_coef'
@@ -474,11 +495,13 @@ class YATSMTimeSeries(timeseries_stacked.StackedTimeSeries):
         if self.config['calc_pheno'].value:
             # TODO: parameterize band indices & scale factor
             ltm = pheno.LongTermMeanPhenology()
-            self.yatsm_model.record = ltm.fit(self.yatsm_model)
+            yatsm_model.record = ltm.fit(yatsm_model)
 
         # Restore log level
         logger.setLevel(log_level)
 
+        return yatsm_model, X, design_info
+
 # SETUP
     def _init_metadata(self):
         """ Setup metadata for series """
@@ -0,0 +1,202 @@
+""" Build line caches for every row of a stacked timeseries
+
+`Series.fetch_data` reads line caches, if they exist, before reading data
+from the images. Building line caches for an entire dataset ahead of time
+makes every query a cache hit.
+
+Line caches are built outside of QGIS from the directory containing the
+plugin, for example::
+
+    python -m tstools.ts_driver.line_cache /path/to/stack --processes 4
+
+Rows that already have valid line caches are skipped, so an interrupted
+build can be resumed by running the same command again.
+"""
+from __future__ import print_function
+
+import argparse
+import logging
+from multiprocessing import Pool
+import os
+
+import numpy as np
+
+from . import ts_utils
+from .reader import dataset_pool
+from .series import Series
+
+logger = logging.getLogger('tstools')
+
+
+def _has_line(filename, image_IDs, fingerprint):
+    """ Return True if a valid line cache exists """
+    if not os.path.isfile(filename):
+        return False
+    try:
+        if filename.endswith('.npy'):
+            with open(filename + '.sha1', 'r') as f:
+                return f.read().strip() == fingerprint
+        z = ts_utils.load_cache_npz(filename)
+        if 'fingerprint' in z.files:
+            return str(z['fingerprint']) == fingerprint
+        return np.array_equal(z['image_IDs'], image_IDs)
+    except Exception:
+        return False
+
+
+def _build_block(args):
+    """ Read a block of rows from every image and write their line caches
+
+    Args:
+        args (tuple): image paths, image IDs, series fingerprint, first row
+            of the block, and filenames of line caches for each row in the
+            block
+
+    Returns:
+        int: number of rows written
+
+    """
+    paths, image_IDs, fingerprint, row, filenames = args
+    nrow = len(filenames)
+
+    Y = None
+    for i_img, path in enumerate(paths):
+        with dataset_pool.dataset(path) as ds:
+            dat = ds.ReadAsArray(0, row, ds.RasterXSize, nrow)
+        if dat.ndim == 2:
+            dat = dat[np.newaxis, ...]
+        if Y is None:
+            Y = np.empty((nrow, dat.shape[0], len(paths), dat.shape[2]),
+                         dtype=dat.dtype)
+        Y[:, :, i_img, :] = dat.transpose(1, 0, 2)
+
+    for i_row, filename in enumerate(filenames):
+        if filename.endswith('.npy'):
+            ts_utils.write_cache_line_npy(filename, Y[i_row], fingerprint)
+        else:
+            ts_utils.write_cache_line(filename, Y[i_row], image_IDs,
+                                      fingerprint)
+
+    return nrow
+
+
+def build_line_cache(series, cache_folder, rows=None, block_rows=4,
+                     processes=1, fmt='npz'):
+    """ Build line caches for a range of rows of a `Series`
+
+    Each image is read once per block of rows, and blocks are read by a pool
+    of processes. Each process holds one block of data for all images in
+    memory, so ``block_rows`` trades memory for fewer reads.
+
+    Args:
+        series (Series): Series to cache
+        cache_folder (str): location of cache folder
+        rows (tuple, optional): first and last (exclusive) row to cache, or
+            None for all rows
+        block_rows (int): number of rows read from each image at once
+        processes (int): number of processes reading blocks
+        fmt (str): line cache format, either "npz" for NumPy zipped arrays or
+            "npy" for memory-mappable NumPy arrays
+
+    Yields:
+        int: number of rows cached, including rows with existing caches
+
+    """
+    if not os.path.isdir(cache_folder):
+        os.makedirs(cache_folder)
+    start, end = rows if rows else (0, series.height)
+    end = min(end, series.height)
+
+    image_IDs = series.images['id']
+    fingerprint = series.fingerprint
+    paths = list(series.images['path'])
+
+    # Find rows without valid caches and group them into contiguous blocks
+    tasks, done = [], 0
+    block = []
+    for row in range(start, end):
+        filename = os.path.join(cache_folder, ts_utils.name_cache_line(
+            row, (series.count, series.n),
+            prefix=series.cache_prefix, suffix=series.cache_suffix,
+            ext='.' + fmt))
+        if _has_line(filename, image_IDs, fingerprint):
+            done += 1
+        else:
+            if block and (len(block) == block_rows or
+                          block[-1][0] != row - 1):
+                tasks.append((paths, image_IDs, fingerprint, block[0][0],
+                              [b[1] for b in block]))
+                block = []
+            block.append((row, filename))
+    if block:
+        tasks.append((paths, image_IDs, fingerprint, block[0][0],
+                      [b[1] for b in block]))
+
+    if done:
+        logger.info('Skipping %i rows with existing line caches' % done)
+        yield done
+
+    if processes > 1:
+        pool = Pool(processes)
+        try:
+            for n in pool.imap_unordered(_build_block, tasks):
+                done += n
+                yield done
+            pool.close()
+            pool.join()
+        finally:
+            pool.terminate()
+    else:
+        for task in tasks:
+            done += _build_block(task)
+            yield done
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description='Build line caches for a stacked timeseries')
+    parser.add_argument('location', help='Root location of stacked dataset')
+    parser.add_argument('--rows', nargs=2, type=int, default=None,
+                        help='First and last (exclusive) row to cache')
+    parser.add_argument('--cache-folder', default='cache',
+                        help='Cache folder within LOCATION '
+                             '(default: %(default)s)')
+    parser.add_argument('--pattern', default='L*stack',
+                        help='Stack pattern (default: %(default)s)')
+    parser.add_argument('--date-index', nargs=2, type=int, default=[9, 16],
+                        help='Index of date in ID (default: %(default)s)')
+    parser.add_argument('--date-format', default='%Y%j',
+                        help='Date format (default: %(default)s)')
+    parser.add_argument('--prefix', default='yatsm_',
+                        help='Cache filename prefix (default: %(default)s)')
+    parser.add_argument('--suffix', default='.npy',
+                        help='Cache filename suffix (default: %(default)s)')
+    parser.add_argument('--block-rows', type=int, default=4,
+                        help='Rows read from each image at once '
+                             '(default: %(default)s)')
+    parser.add_argument('--format', default='npz', choices=['npz', 'npy'],
+                        help='Line cache format (default: %(default)s)')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='Number of processes (default: %(default)s)')
+    args = parser.parse_args(args)
+
+    images = ts_utils.find_files(args.location, args.pattern,
+                                 ignore_dirs=[args.cache_folder])
+    series = Series(images, args.date_index, args.date_format,
+                    {'cache_prefix': args.prefix,
+                     'cache_suffix': args.suffix})
+
+    start, end = args.rows if args.rows else (0, series.height)
+    total = min(end, series.height) - start
+    for done in build_line_cache(series,
+                                 os.path.join(args.location,
+                                              args.cache_folder),
+                                 rows=args.rows,
+                                 block_rows=args.block_rows,
+                                 processes=args.processes,
+                                 fmt=args.format):
+        print('Cached {0} of {1} rows'.format(done, total))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+""" Counters and timers describing how timeseries data are retrieved
+
+Each `Series` collects a `Metrics` instance counting cache hits, reads from
+images, and bytes read, and timing each phase of `Series.fetch_data`.
+Drivers expose these through `AbstractTimeSeriesDriver.get_metrics` and can
+write them to a JSON file for each session (see `dump_metrics`).
+"""
+from contextlib import contextmanager
+import json
+import os
+import threading
+import time
+
+from .ts_utils import atomic_write
+
+
+class Metrics(object):
+    """ Thread safe named counters and timers
+
+    Counters hold integer counts (e.g., "pixel_cache_hits" or
+    "bytes_read"). Timers hold the number of times a phase ran, and the
+    total, last, and maximum wall time of the phase in seconds.
+
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.timers = {}
+
+    def count(self, name, n=1):
+        """ Increment a counter
+
+        Args:
+            name (str): name of counter
+            n (int): amount to increment by
+
+        """
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def add_time(self, phase, seconds):
+        """ Record one run of a phase
+
+        Args:
+            phase (str): name of phase
+            seconds (float): wall time of phase in seconds
+
+        """
+        with self._lock:
+            timer = self.timers.setdefault(
+                phase, {'count': 0, 'total': 0.0, 'last': 0.0, 'max': 0.0})
+            timer['count'] += 1
+            timer['total'] += seconds
+            timer['last'] = seconds
+            timer['max'] = max(timer['max'], seconds)
+
+    @contextmanager
+    def timer(self, phase):
+        """ Time a block of code as one run of a phase
+
+        Args:
+            phase (str): name of phase
+
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.time() - start)
+
+    def reset(self):
+        """ Clear all counters and timers """
+        with self._lock:
+            self.counters = {}
+            self.timers = {}
+
+    def as_dict(self):
+        """ Return copies of all counters and timers
+
+        Returns:
+            dict: "counters" and "timers"
+
+        """
+        with self._lock:
+            return {
+                'counters': dict(self.counters),
+                'timers': dict((k, dict(v)) for k, v in self.timers.items())
+            }
+
+
+def dump_metrics(filename, metrics):
+    """ Write metrics to a JSON file, replacing it atomically
+
+    Args:
+        filename (str): filename of JSON file
+        metrics (dict): metrics, as returned by
+            `AbstractTimeSeriesDriver.get_metrics`
+
+    """
+    dirname = os.path.dirname(filename)
+    if dirname and not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    with atomic_write(filename, 'w') as f:
+        json.dump(metrics, f, indent=2, sort_keys=True, default=str)
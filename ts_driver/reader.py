@@ -1,6 +1,9 @@
 """ Functions and classes useful for reading remote sensing imagery in GDAL
 """
+from collections import OrderedDict
+from contextlib import contextmanager
 import logging
+import threading
 
 import numpy as np
 from osgeo import gdal, gdal_array
@@ -11,24 +14,362 @@ gdal.AllRegister()
 gdal.UseExceptions()
 
 
-def read_pixel_GDAL(filename, x, y):
+class DatasetPool(object):
+    """ A bounded pool of read-only GDAL datasets
+
+    Opening a dataset is often the most expensive part of reading a single
+    pixel, especially on network file systems. The pool keeps up to ``size``
+    idle datasets open, keyed by filename.
+
+    Each query reads every image of a Series in the same order, so evicting
+    the least recently used dataset to make room would close every dataset
+    just before it is needed again when the pool is smaller than the Series.
+    Instead, a dataset returned to a full pool is closed and the datasets
+    already within the pool are kept, so the first ``size`` images read stay
+    open across queries. Size the pool to the number of images read per
+    query (see `max_pool_size`) to keep all of them open.
+
+    A dataset is checked out of the pool while it is in use so that a GDAL
+    handle is never shared between threads. If a dataset for the same
+    filename is requested while it is checked out, another handle is opened.
+
+    Args:
+        size (int): maximum number of idle datasets to keep open. A size of 0
+            disables pooling and datasets are closed after each use
+
+    Attributes:
+        opens (int): number of times a dataset was opened with GDAL
+        hits (int): number of times a dataset was reused from the pool
+        evictions (int): number of datasets closed to keep the pool within
+            ``size``, including datasets returned to a full pool
+
+    """
+    def __init__(self, size=256):
+        self.size = size
+        self.opens = 0
+        self.hits = 0
+        self.evictions = 0
+
+        self._idle = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._idle)
+
+    @contextmanager
+    def dataset(self, filename):
+        """ Context manager yielding an open, read-only GDAL dataset
+
+        Args:
+            filename (str): filename of dataset to open
+
+        Yields:
+            gdal.Dataset: open dataset, returned to the pool on exit
+
+        """
+        ds = self._checkout(filename)
+        try:
+            yield ds
+        finally:
+            self._checkin(filename, ds)
+
+    def resize(self, size):
+        """ Change maximum size of the pool, evicting datasets if needed
+
+        Args:
+            size (int): maximum number of idle datasets to keep open
+
+        """
+        with self._lock:
+            self.size = max(int(size), 0)
+            self._evict()
+
+    def evict(self, filename):
+        """ Close idle dataset for a filename, if it is within the pool
+
+        Args:
+            filename (str): filename of dataset to close
+
+        """
+        with self._lock:
+            if self._idle.pop(filename, None) is not None:
+                self.evictions += 1
+
+    def clear(self):
+        """ Close all idle datasets """
+        with self._lock:
+            self.evictions += len(self._idle)
+            self._idle.clear()
+
+    def stats(self):
+        """ Return pool counters, useful for sizing the pool
+
+        Returns:
+            dict: number of opens, hits, evictions, the number of datasets
+                currently held open, and the maximum size of the pool
+
+        """
+        with self._lock:
+            return {
+                'opens': self.opens,
+                'hits': self.hits,
+                'evictions': self.evictions,
+                'open': len(self._idle),
+                'size': self.size
+            }
+
+    def _checkout(self, filename):
+        with self._lock:
+            ds = self._idle.pop(filename, None)
+            if ds is not None:
+                self.hits += 1
+                return ds
+            self.opens += 1
+
+        # Open outside of lock so slow file systems don't block other readers
+        return gdal.Open(filename, gdal.GA_ReadOnly)
+
+    def _checkin(self, filename, ds):
+        with self._lock:
+            if self.size <= 0 or filename in self._idle:
+                # Another handle was returned while this one was checked out
+                return
+            if len(self._idle) >= self.size:
+                # Keep datasets already pooled instead of cycling through them
+                self.evictions += 1
+                return
+            self._idle[filename] = ds
+
+    def _evict(self):
+        while len(self._idle) > self.size:
+            self._idle.popitem(last=False)
+            self.evictions += 1
+
+
+class BlockCache(object):
+    """ A least recently used cache of image blocks bounded by total size
+
+    Neighboring pixels are usually stored within the same GDAL "natural"
+    block (e.g., a 256x256 tile or a strip of rows), so caching the entire
+    block read for one pixel answers queries for nearby pixels from memory.
+
+    Args:
+        max_bytes (int): maximum size of all cached blocks in bytes. A size
+            of 0 disables the cache
+
+    Attributes:
+        hits (int): number of pixels read from a cached block
+        misses (int): number of blocks read from disk
+        evictions (int): number of blocks dropped to stay within
+            ``max_bytes``
+        nbytes (int): current size of all cached blocks in bytes
+
+    """
+    def __init__(self, max_bytes=0):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.nbytes = 0
+
+        self._blocks = OrderedDict()
+        self._block_sizes = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._blocks)
+
+    def resize(self, max_bytes):
+        """ Change maximum size of the cache, evicting blocks if needed
+
+        Args:
+            max_bytes (int): maximum size of all cached blocks in bytes
+
+        """
+        with self._lock:
+            self.max_bytes = max(int(max_bytes), 0)
+            self._evict()
+
+    def clear(self):
+        """ Drop all cached blocks """
+        with self._lock:
+            self.evictions += len(self._blocks)
+            self._blocks.clear()
+            self._block_sizes.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        """ Return cache counters
+
+        Returns:
+            dict: number of hits, misses, evictions, the number of blocks
+                and bytes cached, and the maximum size of the cache
+
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'blocks': len(self._blocks),
+                'nbytes': self.nbytes,
+                'max_bytes': self.max_bytes
+            }
+
+    def read_pixel(self, filename, x, y, bands=None, out=None):
+        """ Read a pixel from an image, reading its entire block if needed
+
+        Args:
+            filename (str): filename to read from
+            x (int): column
+            y (int): row
+            bands (iterable, optional): 0-indexed bands to read, or None for
+                all bands
+            out (np.ndarray, optional): 1D array (nband) to read data into
+
+        Returns:
+            np.ndarray: 1D array (nband) containing the pixel data
+
+        """
+        block_size = self._block_sizes.get(filename)
+        if block_size is not None:
+            block, xoff, yoff = self._get(filename, x, y, block_size)
+        if block_size is None or block is None:
+            block, xoff, yoff = self._read_block(filename, x, y)
+
+        if bands is None:
+            dat = block[:, y - yoff, x - xoff]
+        else:
+            dat = block[np.asarray(bands, dtype=np.intp), y - yoff, x - xoff]
+
+        if out is None:
+            return dat.copy()
+        out[...] = dat
+        return out
+
+    def _key(self, filename, x, y, block_size):
+        bx, by = block_size
+        return (filename, x // bx, y // by), (x // bx) * bx, (y // by) * by
+
+    def _get(self, filename, x, y, block_size):
+        key, xoff, yoff = self._key(filename, x, y, block_size)
+        with self._lock:
+            block = self._blocks.pop(key, None)
+            if block is not None:
+                self._blocks[key] = block
+                self.hits += 1
+        return block, xoff, yoff
+
+    def _read_block(self, filename, x, y):
+        with dataset_pool.dataset(filename) as ds:
+            block_size = tuple(ds.GetRasterBand(1).GetBlockSize())
+            key, xoff, yoff = self._key(filename, x, y, block_size)
+            xsize = min(block_size[0], ds.RasterXSize - xoff)
+            ysize = min(block_size[1], ds.RasterYSize - yoff)
+            block = ds.ReadAsArray(xoff, yoff, xsize, ysize)
+        if block.ndim == 2:
+            block = block[np.newaxis, ...]
+
+        with self._lock:
+            self.misses += 1
+            self._block_sizes[filename] = block_size
+            if self.max_bytes > 0 and key not in self._blocks:
+                self._blocks[key] = block
+                self.nbytes += block.nbytes
+                self._evict()
+
+        return block, xoff, yoff
+
+    def _evict(self):
+        while self._blocks and self.nbytes > self.max_bytes:
+            _, block = self._blocks.popitem(last=False)
+            self.nbytes -= block.nbytes
+            self.evictions += 1
+
+
+def max_pool_size(n_images, reserve=256):
+    """ Return a dataset pool size for reading a number of images per query
+
+    The pool is sized to keep every image open, but is capped by the limit on
+    open files of the process, leaving ``reserve`` files for QGIS, threads
+    reading the images, and caches.
+
+    Args:
+        n_images (int): number of images read per query
+        reserve (int): number of open files to leave for everything else
+
+    Returns:
+        int: maximum number of idle datasets to keep open
+
+    """
+    try:
+        import resource
+    except ImportError:  # Windows does not limit open files per process
+        return int(n_images)
+
+    soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY:
+        return int(n_images)
+    return max(min(int(n_images), soft - reserve), 0)
+
+
+#: DatasetPool: pool of open datasets shared by every `Series`
+dataset_pool = DatasetPool()
+#: BlockCache: cache of image blocks shared by every `Series`, off by default
+block_cache = BlockCache()
+
+
+def read_pixel(filename, x, y, bands=None, out=None):
+    """ Read a pixel, using the block cache if it is enabled
+
+    Args:
+      filename (str): filename to read from
+      x (int): column
+      y (int): row
+      bands (iterable, optional): 0-indexed bands to read, or None for all
+        bands
+      out (np.ndarray, optional): 1D array (nband) to read data into
+
+    Returns:
+      np.ndarray: 1D array (nband) containing the pixel data
+
+    """
+    if block_cache.max_bytes > 0:
+        return block_cache.read_pixel(filename, x, y, bands=bands, out=out)
+    return read_pixel_GDAL(filename, x, y, bands=bands, out=out)
+
+
+def read_pixel_GDAL(filename, x, y, bands=None, out=None):
     """ Reads in a pixel of data from an images using GDAL
 
+    All requested bands are read with one dataset-level ``ReadRaster`` call
+    instead of one read per band.
+
     Args:
       filename (str): filename to read from
       x (int): column
       y (int): row
+      bands (iterable, optional): 0-indexed bands to read, or None for all
+        bands
+      out (np.ndarray, optional): 1D array (nband) to read data into, e.g., a
+        column of `Series._scratch_data`
 
     Returns:
       np.ndarray: 1D array (nband) containing the pixel data
 
     """
-    ds = gdal.Open(filename, gdal.GA_ReadOnly)
-    dtype = gdal_array.GDALTypeCodeToNumericTypeCode(
-        ds.GetRasterBand(1).DataType)
+    with dataset_pool.dataset(filename) as ds:
+        dtype = gdal_array.GDALTypeCodeToNumericTypeCode(
+            ds.GetRasterBand(1).DataType)
+        if bands is None:
+            band_list = list(range(1, ds.RasterCount + 1))
+        else:
+            band_list = [int(b) + 1 for b in bands]
 
-    dat = np.empty(ds.RasterCount, dtype=dtype)
-    for i in range(ds.RasterCount):
-        dat[i] = ds.GetRasterBand(i + 1).ReadAsArray(x, y, 1, 1)
+        buf = ds.ReadRaster(x, y, 1, 1, band_list=band_list)
 
-    return dat
+    dat = np.frombuffer(buf, dtype=dtype)
+    if out is None:
+        return dat.copy()
+    out[...] = dat
+    return out
@@ -2,13 +2,19 @@
 """
 from datetime import datetime as dt
 import logging
+from multiprocessing.pool import ThreadPool
 import os
+import threading
+import time
 
 import numpy as np
 from osgeo import gdal, gdal_array
 
 from . import ts_utils
-from .reader import read_pixel_GDAL
+from .cache_store import NPZPixelStore
+from .cancel import FetchCancelled
+from .metrics import Metrics
+from .reader import read_pixel
 from ..utils import geo_utils
 
 logger = logging.getLogger('tstools')
@@ -26,6 +32,10 @@ class Series(object):
         date_index (tuple): start and end index of an image filename or ID
             that contains the image's date
         date_format (str): format of date in an image's filename or ID
+        config (dict, optional): class attributes to set
+        index (dict, optional): description of the images, as returned by
+            `to_index`, used instead of parsing dates from ``filenames`` and
+            opening an image (e.g., when read from an image catalog)
 
     Attributes:
         description (str): description of timeseries series
@@ -33,6 +43,9 @@ class Series(object):
             all timeseries images. Structured array columns must include
             "filename" (str), "path" (str), "id" (str), "date" (dt.Date), and
             "ordinal" (int).
+        paths (np.ndarray): "path" column of `images` as an array of
+            fixed-width strings, for finding images by path with one
+            comparison
         band_names (iterable): list of names describing each band
 
         symbology_hint_indices (tuple): three band indices (RGB) used for
@@ -50,6 +63,18 @@ class Series(object):
 
         cache_prefix (str): cache filename prefix
         cache_suffix (str): cache filename suffix
+        fingerprint (str): hash of image IDs, band count, and data type used
+            to validate cached data
+        cache_source (str or None): kind of cache data were last read from
+            ("pixel", "line_npy", or "line"), or None if read from images
+        cache_entry (str or None): key of cache entry last read or written
+        data (np.ndarray): 2D np.ndarray (nband, nimage) of data for the
+            current pixel, read in the native data type of the images
+            (`dtype`). Drivers may replace it with rescaled floating point
+            data (see `data_float`), so it is replaced, not written into,
+            when the next pixel is read
+        metrics (Metrics): counters and timers of cache hits, image reads,
+            bytes read, and phases of `fetch_data`
 
     Methods:
         fetch_data: read data for a given X/Y, yielding progress as percentage
@@ -64,7 +89,9 @@ class Series(object):
                              ('id', object),
                              ('date', object),
                              ('ordinal', 'u4'),
-                             ('doy', 'u2')])
+                             ('doy', 'u2'),
+                             ('year', 'u2')])
+    paths = np.empty(0, dtype='U1')
     band_names = []
 
     # Basic symbology hints by default
@@ -83,21 +110,47 @@ class Series(object):
 
     px, py = 0, 0
 
+    cache_source = None
+    cache_entry = None
+
     def __init__(self, filenames, date_index=(9, 16), date_format='%Y%j',
-                 config=None):
-        self._init_images(filenames, date_index, date_format)
-        self.data = np.zeros((self.count, self.n), dtype=np.float)
+                 config=None, index=None):
+        if index is not None:
+            self._init_index(index)
+        else:
+            self._init_images(filenames, date_index, date_format)
+        self._init_paths()
+        self.data = np.zeros((self.count, self.n), dtype=self.dtype)
         self._scratch_data = np.zeros_like(self.data)
         self.mask = np.ones(self.n, dtype=np.bool)
+        self.metrics = Metrics()
+        self._remaining = None
 
         if config:
             self.__dict__.update(config)
 
     def fetch_data(self, mx, my, crs_wkt,
                    cache_folder='',
-                   read_cache=False, write_cache=False):
+                   read_cache=False, write_cache=False,
+                   threads=1, cache_store=None, bands=None, cancel=None,
+                   snapshot=None, snapshot_every=100):
         """ Read data for a given x, y coordinate in a given CRS
 
+        If data must be read from the images and ``bands`` is given, only
+        those bands are read and all other bands are left as zero until
+        `fetch_remaining` reads them. The pixel is only cached once all bands
+        are read.
+
+        If ``snapshot`` is given, images are read newest first and
+        ``snapshot`` is called every ``snapshot_every`` images read with a
+        copy of the data read so far, so they can be shown before all images
+        are read.
+
+        If ``cancel`` is cancelled while images are read, images not yet read
+        are skipped and `FetchCancelled` is raised, leaving the Series at the
+        pixel it held before and the cache unchanged. Closing the generator
+        before it ends does the same.
+
         Args:
             mx (float): map X location
             my (float): map Y location
@@ -106,6 +159,20 @@ class Series(object):
             cache_folder (str): path to cache folder
             read_cache (bool): allow reading from cache
             write_cache (bool): allow writing to cache
+            threads (int): number of images to read concurrently if data
+                must be read from the images
+            cache_store (object, optional): pixel cache store (see
+                `cache_store` module). Defaults to one NumPy zipped array file
+                per pixel within ``cache_folder``
+            bands (iterable, optional): 0-indexed bands to read first if data
+                must be read from the images, or None to read all bands
+            cancel (CancelToken, optional): token used to cancel the request
+            snapshot (callable, optional): function called with a 2D
+                np.ndarray (nband, n) of data read so far, which is zero for
+                images and bands not yet read, a 1D boolean np.ndarray (n) of
+                the images read, and the 0-indexed bands read (np.ndarray), or
+                None if all bands are read
+            snapshot_every (int): number of images read between snapshots
 
         Yields:
             float: current retrieval progress (1 to n)
@@ -113,77 +180,320 @@ class Series(object):
         Raises:
             IndexError: raise IndexError if map coordinates are outside of
                 dataset
+            FetchCancelled: raise FetchCancelled if ``cancel`` is cancelled
 
         """
-        mx, my = geo_utils.reproject_point(mx, my, crs_wkt, self.crs)
-        self.px, self.py = geo_utils.point2pixel(mx, my, self.gt)
-
-        if (self.px < 0 or self.py < 0 or
-                self.px > self.width or self.py > self.height):
-            raise IndexError('Coordinate specific outside of dataset: '
-                             '%i/%i' % (self.px, self.py))
+        checkpoint = self._checkpoint()
+        try:
+            for i in self._fetch_data(mx, my, crs_wkt, cache_folder,
+                                      read_cache, write_cache, threads,
+                                      cache_store, bands, cancel, snapshot,
+                                      snapshot_every, checkpoint):
+                yield i
+        except (FetchCancelled, GeneratorExit):
+            self._rollback(checkpoint)
+            raise
+
+    def _fetch_data(self, mx, my, crs_wkt, cache_folder, read_cache,
+                    write_cache, threads, cache_store, bands, cancel,
+                    snapshot, snapshot_every, checkpoint):
+        """ Read data for `fetch_data`, which restores ``checkpoint`` (see
+        `_checkpoint`) if cancelled
+        """
+        start = time.time()
+        self.metrics.count('fetches')
+        with self.metrics.timer('locate'):
+            self._locate(mx, my, crs_wkt)
+        self.cache_source, self.cache_entry = None, None
+        self._remaining = None
 
         got_cache = False
+        if cache_store is None:
+            cache_store = NPZPixelStore(cache_folder)
         pixel = ts_utils.name_cache_pixel(self.px, self.py,
                                           self.data.shape,
                                           prefix=self.cache_prefix,
                                           suffix=self.cache_suffix)
-        pixel_fn = os.path.join(cache_folder, pixel)
 
         line = ts_utils.name_cache_line(self.py,
                                         self.data.shape,
                                         prefix=self.cache_prefix,
                                         suffix=self.cache_suffix)
         line_fn = os.path.join(cache_folder, line)
+        line_npy_fn = os.path.join(
+            cache_folder,
+            ts_utils.name_cache_line(self.py, self.data.shape,
+                                     prefix=self.cache_prefix,
+                                     suffix=self.cache_suffix,
+                                     ext='.npy'))
 
         i = 0
         # First try pixel cache
-        if read_cache and os.path.isfile(pixel_fn):
-            logger.debug('Trying to read pixel from cache')
+        dat = None
+        if read_cache:
+            try:
+                if cache_store.has_pixel(pixel):
+                    logger.debug('Trying to read pixel from cache')
+                    with self.metrics.timer('read_pixel_cache'):
+                        dat = cache_store.read_pixel(pixel, self)
+            except Exception as e:
+                self.metrics.count('cache_errors')
+                logger.warning('Could not read %s from cache %r: %s' %
+                               (pixel, cache_store, e))
+            if dat is not None:
+                logger.debug('Read pixel from cache')
+                self.data = dat
+                got_cache = True
+                self.cache_source = 'pixel'
+                self.cache_entry = cache_store.entry_key(pixel)
+                self.metrics.count('pixel_cache_hits')
+                self.metrics.count('bytes_read', dat.nbytes)
+                i += self.data.shape[1]
+                yield float(i)
+
+        # If pixel cache fails, try memory-mapped line and then zipped line
+        if read_cache and os.path.isfile(line_npy_fn) and not got_cache:
+            logger.debug('Trying to read column from line cache')
             try:
-                dat = ts_utils.read_cache_pixel(pixel_fn, self)
+                with self.metrics.timer('read_line_cache'):
+                    dat = ts_utils.read_cache_line_column(line_npy_fn, self,
+                                                          self.px)
             except Exception as e:
+                self.metrics.count('cache_errors')
                 logger.warning('Could not read from cache file %s: %s' %
-                               (pixel_fn, e.message))
+                               (line_npy_fn, e.message))
             else:
-                logger.debug('Read pixel from cache')
+                logger.debug('Read column from line cache')
                 self.data = dat
                 got_cache = True
+                self.cache_source = 'line_npy'
+                self.cache_entry = os.path.basename(line_npy_fn)
+                self.metrics.count('line_cache_hits')
+                self.metrics.count('bytes_read', dat.nbytes)
                 i += self.data.shape[1]
                 yield float(i)
 
-        # If pixel cache fails, try line
         if read_cache and os.path.isfile(line_fn) and not got_cache:
             logger.debug('Trying to read line from cache')
             try:
-                dat = ts_utils.read_cache_line(line_fn, self)
+                with self.metrics.timer('read_line_cache'):
+                    dat = ts_utils.read_cache_line(line_fn, self)
             except Exception as e:
+                self.metrics.count('cache_errors')
                 logger.warning('Could not read from cache file %s: %s' %
                                (line_fn, e.message))
             else:
                 logger.debug('Read line from cache')
                 self.data = dat[..., self.px]
                 got_cache = True
+                self.cache_source = 'line'
+                self.cache_entry = line
+                self.metrics.count('line_cache_hits')
+                self.metrics.count('bytes_read', dat.nbytes)
                 i += self.data.shape[1]
                 yield float(i)
 
+        # Caches written by older versions may hold data as float
+        if got_cache and self.data.dtype != self.dtype:
+            self.data = self.data.astype(self.dtype)
+
+        # Upgrade a pixel cache written before new images were added
+        previous = None
+        if read_cache and not got_cache:
+            try:
+                with self.metrics.timer('find_previous_cache'):
+                    previous = cache_store.find_previous(self.px, self.py,
+                                                         self)
+            except Exception as e:
+                self.metrics.count('cache_errors')
+                logger.warning('Could not search cache %r: %s' %
+                               (cache_store, e.message))
+            if previous is not None:
+                _, cached_IDs, cached_Y = previous
+                if not np.all(np.in1d(cached_IDs, self.images['id'])):
+                    previous = None
+
+        if previous is not None:
+            logger.debug('Adding new images to pixel cache %s' % previous[0])
+            self.metrics.count('cache_upgrades')
+            _start = time.time()
+            for _ in self._snapshots(
+                    self._merge_cache(previous[1], previous[2],
+                                      threads=threads, cancel=cancel),
+                    snapshot, snapshot_every):
+                i += 1
+                yield float(i)
+            self.metrics.add_time('read_images', time.time() - _start)
+
+            self.data = self._scratch_data.copy()
+
         # Last resort -- read from images
-        if not got_cache:
-            for i_img in range(self.n):
-                self._scratch_data[:, i_img] = read_pixel_GDAL(
-                    self.images['path'][i_img], self.px, self.py)
+        elif not got_cache:
+            self.metrics.count('gdal_fallbacks')
+            if bands is not None:
+                bands = np.unique(np.asarray(bands, dtype=np.intp))
+                if bands.size == self.count:
+                    bands = None
+            # Read newest images first so snapshots show recent years first
+            indices = range(self.n - 1, -1, -1) if snapshot else None
+            _start = time.time()
+            if bands is None or bands.size:
+                for _ in self._snapshots(
+                        self._read_images(threads=threads, indices=indices,
+                                          bands=bands, cancel=cancel),
+                        snapshot, snapshot_every, bands=bands):
+                    i += 1
+                    yield float(i)
+            self.metrics.add_time('read_images', time.time() - _start)
+
+            # Copy from scratch variable if it completes
+            if bands is None:
+                self.data = self._scratch_data.copy()
+            else:
+                data = np.zeros_like(self._scratch_data)
+                data[bands] = self._scratch_data[bands]
+                self.data = data
+                self._remaining = (
+                    np.setdiff1d(np.arange(self.count), bands),
+                    pixel, cache_store if write_cache else None, checkpoint)
+
+        if write_cache and not got_cache and self._remaining is None:
+            self._write_cache(pixel, cache_store, previous)
+
+        self.metrics.add_time('fetch_data', time.time() - start)
+
+    def data_float(self):
+        """ Return a floating point copy of the data, for scaling
+
+        Returns:
+            np.ndarray: 2D array (nband, n) of data as np.float
+
+        """
+        return self.data.astype(np.float)
+
+    @property
+    def remaining_bands(self):
+        """ np.ndarray or None: 0-indexed bands not yet read for the current
+        pixel (see `fetch_remaining`)
+        """
+        if self._remaining is None:
+            return None
+        return self._remaining[0]
+
+    def fetch_remaining(self, threads=1, cancel=None):
+        """ Read bands skipped by the last call to `fetch_data`
+
+        Once all bands are read, the pixel is cached if `fetch_data` was
+        allowed to write to the cache. If ``cancel`` is cancelled or the
+        generator is closed before it ends, the Series returns to the pixel
+        it held before `fetch_data`, so data with bands left unread are not
+        kept.
+
+        Args:
+            threads (int): number of images to read concurrently
+            cancel (CancelToken, optional): token used to cancel the request
+
+        Yields:
+            float: current retrieval progress (1 to n)
+
+        Raises:
+            FetchCancelled: raise FetchCancelled if ``cancel`` is cancelled
+
+        """
+        if self._remaining is None:
+            return
+        bands, pixel, cache_store, checkpoint = self._remaining
+
+        i = 0
+        _start = time.time()
+        try:
+            for _ in self._read_images(threads=threads, bands=bands,
+                                       cancel=cancel):
                 i += 1
                 yield float(i)
+        except (FetchCancelled, GeneratorExit):
+            self._rollback(checkpoint)
+            raise
+        self.metrics.add_time('read_images', time.time() - _start)
 
-                # Copy from scratch variable if it completes
-                np.copyto(self.data, self._scratch_data)
+        # Data already read may be in use (e.g., plotted) by another thread,
+        # so they are replaced instead of modified
+        data = self.data.copy()
+        data[bands] = self._scratch_data[bands]
+        self.data = data
+        self._remaining = None
 
-        if write_cache and not got_cache:
-            try:
-                ts_utils.write_cache_pixel(pixel_fn, self)
-            except Exception as e:
-                logger.warning('Could not cache pixel to %s: %s' %
-                               (pixel_fn, e.message))
+        if cache_store is not None:
+            self._write_cache(pixel, cache_store)
+
+    def _write_cache(self, pixel, cache_store, previous=None):
+        """ Cache the current pixel, replacing a previous cache entry
+
+        Args:
+            pixel (str): name of pixel cache entry
+            cache_store (object): pixel cache store
+            previous (tuple, optional): previous cache entry, as returned by
+                ``find_previous`` of the cache store, to delete
+
+        """
+        try:
+            with self.metrics.timer('write_cache'):
+                cache_store.write_pixel(pixel, self)
+                self.cache_entry = cache_store.entry_key(pixel)
+                if previous is not None:
+                    cache_store.delete_pixel(previous[0])
+        except Exception as e:
+            self.metrics.count('cache_errors')
+            logger.warning('Could not cache pixel %s to %r: %s' %
+                           (pixel, cache_store, e.message))
+        else:
+            self.metrics.count('cache_writes')
+
+    def _checkpoint(self):
+        """ Return the data and position of the current pixel
+
+        Data are replaced rather than modified when a pixel is read, so the
+        arrays are not copied.
+
+        Returns:
+            tuple: state of the current pixel, for `_rollback`
+
+        """
+        return (self.data, self.mask, self.px, self.py, self.cache_source,
+                self.cache_entry, self._remaining)
+
+    def _rollback(self, checkpoint):
+        """ Return to a pixel saved by `_checkpoint`
+
+        Args:
+            checkpoint (tuple): state of a pixel returned by `_checkpoint`
+
+        """
+        (self.data, self.mask, self.px, self.py, self.cache_source,
+         self.cache_entry, self._remaining) = checkpoint
+
+    def to_index(self):
+        """ Return a JSON serializable description of the Series images
+
+        Returns:
+            dict: image IDs, filenames, paths, and ordinal dates, and the band
+                names, size, data type, geotransform, and projection of the
+                images
+
+        """
+        return {
+            'image_IDs': list(self.images['id']),
+            'filenames': list(self.images['filename']),
+            'paths': list(self.images['path']),
+            'ordinals': [int(o) for o in self.images['ordinal']],
+            'band_names': list(self.band_names),
+            'geotransform': list(self.gt),
+            'crs': self.crs,
+            'width': self.width,
+            'height': self.height,
+            'count': self.count,
+            'dtype': np.dtype(self.dtype).str
+        }
 
     def get_geometry(self):
         """ Return geometry and projection for data queried
@@ -197,6 +507,156 @@ class Series(object):
 
         return geom.ExportToWkt(), self.crs
 
+    def _locate(self, mx, my, crs_wkt):
+        """ Set pixel column and row for a given x, y coordinate in a CRS
+
+        Raises:
+            IndexError: raise IndexError if map coordinates are outside of
+                dataset
+
+        """
+        mx, my = geo_utils.reproject_point(mx, my, crs_wkt, self.crs)
+        self.px, self.py = geo_utils.point2pixel(mx, my, self.gt)
+
+        if (self.px < 0 or self.py < 0 or
+                self.px > self.width or self.py > self.height):
+            raise IndexError('Coordinate specific outside of dataset: '
+                             '%i/%i' % (self.px, self.py))
+
+    def _read_images(self, threads=1, indices=None, bands=None,
+                     cancel=None):
+        """ Read pixel from images into `_scratch_data`
+
+        GDAL releases the GIL while reading, so reading images from a pool of
+        threads overlaps the I/O latency of each read.
+
+        Args:
+            threads (int): number of images to read concurrently
+            indices (iterable, optional): indices of images to read, or None
+                to read all images
+            bands (np.ndarray, optional): 0-indexed bands to read, or None to
+                read all bands
+            cancel (CancelToken, optional): token checked before and after
+                each read. Images queued within the pool are skipped once it
+                is cancelled, and reads in progress are waited for, so no
+                read writes to `_scratch_data` after this generator ends
+
+        Yields:
+            int: index of each image as it is read, in order of completion
+
+        Raises:
+            FetchCancelled: raise FetchCancelled if ``cancel`` is cancelled
+
+        """
+        if indices is None:
+            indices = range(self.n)
+        nbytes = np.dtype(self.dtype).itemsize * (
+            self.count if bands is None else len(bands))
+
+        stop = threading.Event()
+
+        def _read(i_img):
+            if stop.is_set() or (cancel is not None and cancel.cancelled):
+                return i_img
+            if bands is None:
+                read_pixel(self.images['path'][i_img], self.px, self.py,
+                           out=self._scratch_data[:, i_img])
+            else:
+                self._scratch_data[bands, i_img] = read_pixel(
+                    self.images['path'][i_img], self.px, self.py,
+                    bands=bands)
+            self.metrics.count('images_read')
+            self.metrics.count('bytes_read', nbytes)
+            return i_img
+
+        if threads > 1 and len(indices) > 1:
+            pool = ThreadPool(min(threads, len(indices)))
+            try:
+                for i_img in pool.imap_unordered(_read, indices):
+                    self._check_cancel(cancel)
+                    yield i_img
+            finally:
+                # Skip queued reads and wait for reads in progress
+                stop.set()
+                pool.close()
+                pool.join()
+        else:
+            for i_img in indices:
+                self._check_cancel(cancel)
+                _read(i_img)
+                self._check_cancel(cancel)
+                yield i_img
+
+    def _snapshots(self, images, snapshot, snapshot_every, bands=None):
+        """ Pass on indices of images read, publishing snapshots of data
+
+        Args:
+            images (iterable): indices of images as they are read into
+                `_scratch_data`
+            snapshot (callable or None): function to publish snapshots to
+                (see `fetch_data`)
+            snapshot_every (int): number of images read between snapshots
+            bands (np.ndarray, optional): 0-indexed bands being read, or None
+                if all bands are being read
+
+        Yields:
+            int: index of each image read
+
+        """
+        if snapshot is None:
+            for i_img in images:
+                yield i_img
+            return
+
+        rows = np.arange(self.count) if bands is None else bands
+        read = np.zeros(self.n, dtype=np.bool)
+        for i, i_img in enumerate(images, 1):
+            read[i_img] = True
+            if i % snapshot_every == 0 and i < self.n:
+                idx = np.ix_(rows, np.where(read)[0])
+                data = np.zeros_like(self._scratch_data)
+                data[idx] = self._scratch_data[idx]
+                snapshot(data, read.copy(), bands)
+            yield i_img
+
+    def _check_cancel(self, cancel):
+        """ Raise `FetchCancelled`, counting it, if a request is cancelled
+        """
+        if cancel is not None and cancel.cancelled:
+            self.metrics.count('cancelled')
+            cancel.check()
+
+    def _merge_cache(self, cached_IDs, cached_Y, threads=1, cancel=None):
+        """ Merge cached data with data read from images missing in cache
+
+        Cached data are placed by image ID into `_scratch_data`, in date
+        order, and only images not within the cache are read.
+
+        Args:
+            cached_IDs (np.ndarray): image IDs of cached data, all of which
+                are within this Series
+            cached_Y (np.ndarray): 2D np.ndarray (nband, nimage) of cached
+                data
+            threads (int): number of images to read concurrently
+            cancel (CancelToken, optional): token used to cancel the request
+
+        Yields:
+            int: index of each image as it is merged or read
+
+        """
+        column = dict((_id, i) for i, _id in enumerate(cached_IDs))
+        missing = []
+        for i_img, _id in enumerate(self.images['id']):
+            if _id in column:
+                self._scratch_data[:, i_img] = cached_Y[:, column[_id]]
+                yield i_img
+            else:
+                missing.append(i_img)
+
+        for i_img in self._read_images(threads=threads, indices=missing,
+                                       cancel=cancel):
+            yield i_img
+
     def _init_images(self, images, date_index=[9, 16], date_format='%Y%j'):
         n = len(images)
         if n == 0:
@@ -207,18 +667,34 @@ class Series(object):
 
         # Extract images information
         _images = np.empty(self.n, dtype=self.images.dtype)
-
-        for i, img in enumerate(images):
-            _images[i]['filename'] = os.path.basename(img)
-            _images[i]['path'] = img
-            _images[i]['id'] = os.path.basename(os.path.dirname(img))
-
+        _images['filename'] = [os.path.basename(img) for img in images]
+        _images['path'] = images
+        _images['id'] = [os.path.basename(os.path.dirname(img))
+                         for img in images]
+
+        # Parse dates from IDs, then filenames, all at once if possible
+        start, end = date_index[0], date_index[1]
+        dates, valid = ts_utils.parse_dates(
+            [_id[start:end] for _id in _images['id']], date_format)
+        if not valid.all():
+            _dates, _valid = ts_utils.parse_dates(
+                [f[start:end] for f in _images['filename']], date_format)
+            dates = np.where(valid, dates, _dates)
+            valid = valid | _valid
+
+        _images['ordinal'] = ts_utils.dates_to_ordinal(dates)
+        _images['doy'] = ts_utils.dates_to_doy(dates)
+        _images['year'] = ts_utils.dates_to_year(dates)
+        _images['date'] = dates.astype('datetime64[us]').astype(object)
+
+        # Fall back to `strptime` for dates not parsed above
+        for i in np.where(~valid)[0]:
             try:
-                date = _images[i]['id'][date_index[0]:date_index[1]]
+                date = _images[i]['id'][start:end]
                 date = dt.strptime(date, date_format)
             except:
                 try:
-                    date = _images[i]['filename'][date_index[0]:date_index[1]]
+                    date = _images[i]['filename'][start:end]
                     date = dt.strptime(date, date_format)
                 except:
                     raise Exception(
@@ -228,8 +704,9 @@ class Series(object):
                          _images[i]['id'], _images[i]['filename'])
                     )
             _images[i]['date'] = date
-            _images[i]['ordinal'] = dt.toordinal(_images[i]['date'])
-            _images[i]['doy'] = int(_images[i]['date'].strftime('%j'))
+            _images[i]['ordinal'] = dt.toordinal(date)
+            _images[i]['doy'] = int(date.strftime('%j'))
+            _images[i]['year'] = date.year
 
         sort_idx = np.argsort(_images['ordinal'])
         _images = _images[sort_idx]
@@ -266,3 +743,36 @@ class Series(object):
             ds.GetRasterBand(1).DataType)
         self.gt = ds.GetGeoTransform()
         self.crs = ds.GetProjection()
+        self.fingerprint = ts_utils.image_fingerprint(
+            self.images['id'], self.count, self.dtype)
+
+    def _init_paths(self):
+        """ Initialize `paths` from `images` """
+        self.paths = np.asarray(list(self.images['path']), dtype='U')
+
+    def _init_index(self, index):
+        """ Initialize images and attributes from `to_index` output """
+        self.n = len(index['image_IDs'])
+        if self.n == 0:
+            raise Exception('Cannot initialize a Series of 0 images')
+
+        images = np.empty(self.n, dtype=self.images.dtype)
+        images['filename'] = index['filenames']
+        images['path'] = index['paths']
+        images['id'] = index['image_IDs']
+        images['ordinal'] = index['ordinals']
+        dates = ts_utils.ordinal_to_dates(images['ordinal'])
+        images['date'] = dates.astype('datetime64[us]').astype(object)
+        images['doy'] = ts_utils.dates_to_doy(dates)
+        images['year'] = ts_utils.dates_to_year(dates)
+        self.images = images
+
+        self.band_names = list(index['band_names'])
+        self.width = index['width']
+        self.height = index['height']
+        self.count = index['count']
+        self.dtype = np.dtype(index['dtype'])
+        self.gt = tuple(index['geotransform'])
+        self.crs = index['crs']
+        self.fingerprint = ts_utils.image_fingerprint(
+            self.images['id'], self.count, self.dtype)
@@ -51,6 +51,9 @@ class AbstractTimeSeriesDriver(object):
     Extra Methods:
         set_custom_controls(values): setter for custom control variables
             defined in `controls`. Required to enable custom controls
+        get_metrics: return counters and timers describing data retrieval
+        reset_metrics: clear counters and timers
+        close: release resources held by the driver before it is replaced
 
     """
 
@@ -210,6 +213,45 @@ class AbstractTimeSeriesDriver(object):
         """
         pass
 
+    def get_metrics(self):
+        """ Return counters and timers describing data retrieval
+
+        Returns:
+            dict: "counters" and "timers" of the driver, if it keeps
+                `metrics.Metrics` as ``self.metrics``, and of each Series
+                within "series"
+
+        """
+        metrics = {
+            'description': self.description,
+            'location': self.location,
+            'series': []
+        }
+        if hasattr(self, 'metrics'):
+            metrics.update(self.metrics.as_dict())
+        for series in self.series:
+            if hasattr(series, 'metrics'):
+                _metrics = series.metrics.as_dict()
+                _metrics['description'] = series.description
+                metrics['series'].append(_metrics)
+        return metrics
+
+    def reset_metrics(self):
+        """ Clear counters and timers of the driver and each Series """
+        if hasattr(self, 'metrics'):
+            self.metrics.reset()
+        for series in self.series:
+            if hasattr(series, 'metrics'):
+                series.metrics.reset()
+
+    def close(self):
+        """ Release resources held by the driver before it is replaced
+
+        Drivers may be used again after closing, reopening any resources.
+        """
+        # Nothing to release by default
+        pass
+
     def get_plot(self, series, band, axis, desc):
         """ Plot some information on an axis for a plot of some description
 
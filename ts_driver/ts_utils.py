@@ -1,21 +1,161 @@
 """ Various utilities useful for timeseries drivers
 """
 from collections import namedtuple
+from contextlib import contextmanager
+import errno
 import fnmatch
+import hashlib
 import logging
+from multiprocessing.pool import ThreadPool
 import os
+import time
+import uuid
+import zipfile
 
 import numpy as np
 
 try:
-    from scandir import walk
+    import fcntl
 except ImportError:
-    from os import walk
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+try:
+    from scandir import scandir
+except ImportError:
+    try:
+        from os import scandir
+    except ImportError:
+        scandir = None
 
 logger = logging.getLogger('tstools')
 
+#: str: name of advisory lock file used by writers within a cache folder
+CACHE_LOCK_FILENAME = '.tstools.lock'
+#: set: cache folders written to without a lock, warned about once
+_unlocked_folders = set()
+
 
 # READ/WRITE DATA
+@contextmanager
+def atomic_write(filename, mode='wb'):
+    """ Open a temporary file that replaces ``filename`` when closed
+
+    The temporary file is written within the same directory as ``filename``
+    and renamed over it only if writing succeeds, so readers see either the
+    previous file or the complete new file, never a partial write. Temporary
+    files are hidden (starting with ".") and end with ".tmp".
+
+    Args:
+        filename (str): filename to write
+        mode (str): file mode of temporary file
+
+    Yields:
+        file: opened temporary file
+
+    """
+    dirname, basename = os.path.split(filename)
+    tmp = os.path.join(dirname, '.%s.%i.%s.tmp' % (
+        basename, os.getpid(), uuid.uuid4().hex[:8]))
+    try:
+        with open(tmp, mode) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        _replace(tmp, filename)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def _replace(src, dst):
+    """ Rename ``src`` to ``dst``, replacing ``dst`` if it exists
+
+    Python 2 has no `os.replace`, and `os.rename` will not replace an
+    existing file on Windows, so ``dst`` is removed first if needed.
+    """
+    if hasattr(os, 'replace'):
+        os.replace(src, dst)
+        return
+    try:
+        os.rename(src, dst)
+    except OSError:
+        if os.name != 'nt' or not os.path.exists(dst):
+            raise
+        os.remove(dst)
+        os.rename(src, dst)
+
+
+@contextmanager
+def cache_lock(cache_folder):
+    """ Hold an exclusive advisory lock on a cache folder
+
+    Locks are held between processes, possibly of different users sharing a
+    cache folder, using `fcntl` (or `msvcrt` on Windows). The lock file is
+    created writable by every user. Readers do not need to lock because
+    cache files are replaced atomically (see `atomic_write`). If neither
+    locking module is available, or the lock file cannot be opened for
+    writing (e.g., it was created by another user without write permission
+    for others), no lock is held.
+
+    Args:
+        cache_folder (str): location of cache folder
+
+    """
+    filename = os.path.join(cache_folder, CACHE_LOCK_FILENAME)
+    try:
+        f = _open_lock(filename)
+    except (IOError, OSError) as e:
+        if cache_folder not in _unlocked_folders:
+            _unlocked_folders.add(cache_folder)
+            logger.warning('Could not open cache lock %s. Writing to cache '
+                           'folder without locking: %s' % (filename, e))
+        f = None
+    if f is None:
+        yield
+        return
+
+    try:
+        if fcntl is not None:
+            fcntl.lockf(f, fcntl.LOCK_EX)
+        elif msvcrt is not None:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.lockf(f, fcntl.LOCK_UN)
+            elif msvcrt is not None:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+    finally:
+        f.close()
+
+
+def _open_lock(filename):
+    """ Open a lock file for writing, creating it writable by every user
+    """
+    try:
+        fd = os.open(filename, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o666)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+        fd = os.open(filename, os.O_RDWR)
+    else:
+        # The umask of the user creating the file would keep others out
+        try:
+            os.chmod(filename, 0o666)
+        except OSError as e:
+            logger.debug('Could not allow all users to write to cache lock '
+                         '%s: %s' % (filename, e))
+    return os.fdopen(fd, 'r+')
+
+
 def check_cache(cache_folder):
     """ Checks location for ability to read/write from cache
 
@@ -79,9 +219,11 @@ def write_cache_pixel(filename, series):
 
     """
     logger.debug('Caching pixel to %s' % filename)
-    np.savez(filename,
-             **{'Y': series.data,
-                'image_IDs': series.images['id']})
+    with cache_lock(os.path.dirname(filename)), atomic_write(filename) as f:
+        np.savez(f,
+                 **{'Y': series.data,
+                    'image_IDs': np.array(list(series.images['id'])),
+                    'fingerprint': series.fingerprint})
 
 
 def read_cache_pixel(filename, series):
@@ -100,18 +242,86 @@ def read_cache_pixel(filename, series):
             or images used in timeseries series
 
     """
-    z = np.load(filename)
-    if 'Y' not in z.files or 'image_IDs' not in z.files:
+    z = load_cache_npz(filename)
+    _validate_cache(z, series)
+    return z['Y']
+
+
+def load_cache_npz(filename):
+    """ Open a NumPy zipped array cache file
+
+    Image IDs are stored as strings, but caches written by earlier versions
+    store them as object arrays, which NumPy (>=1.16.3) only reads if
+    allowed to unpickle them. Files that are not zipped arrays are never
+    unpickled.
+
+    Args:
+        filename (str): filename of cache file
+
+    Returns:
+        np.lib.npyio.NpzFile: opened cache file
+
+    Raises:
+        IOError: raise IOError if file is not a NumPy zipped array file
+
+    """
+    if not zipfile.is_zipfile(filename):
+        raise IOError('%s is not a NumPy zipped array file' % filename)
+    try:
+        return np.load(filename, allow_pickle=True)
+    except TypeError:  # NumPy < 1.10 has no `allow_pickle` and allows it
+        return np.load(filename)
+
+
+def image_fingerprint(image_IDs, nband, dtype):
+    """ Return a compact hash describing the data of a series
+
+    Args:
+        image_IDs (iterable): ordered image IDs of series
+        nband (int): number of bands in series
+        dtype (np.dtype): data type of images in series
+
+    Returns:
+        str: hexadecimal digest
+
+    """
+    h = hashlib.sha1('\n'.join(image_IDs).encode('utf-8'))
+    h.update(('%i%s' % (nband, np.dtype(dtype).str)).encode('utf-8'))
+    return h.hexdigest()
+
+
+def _validate_cache(z, series):
+    """ Check a NumPy zipped array cache file against a series
+
+    The fingerprint is compared before any data are read from the file.
+    Cache files written without a fingerprint are validated using their
+    image IDs.
+
+    Args:
+        z (np.lib.npyio.NpzFile): opened cache file
+        series (Series): Series within timeseries driver to read
+
+    Raises:
+        IndexError: raise IndexError if cached data does not match dimensions
+            or images used in timeseries series
+
+    """
+    if 'Y' not in z.files:
         raise IndexError('Cache file is not in the correct format')
 
-    if np.array_equal(z['image_IDs'], series.images['id']):
-        return z['Y']
+    if 'fingerprint' in z.files:
+        valid = str(z['fingerprint']) == series.fingerprint
+    elif 'image_IDs' in z.files:
+        valid = np.array_equal(z['image_IDs'], series.images['id'])
     else:
+        raise IndexError('Cache file is not in the correct format')
+
+    if not valid:
         raise IndexError('Could not find cache data for series %s. image_IDs '
                          'are not the same' % series.description)
 
 
-def name_cache_line(y, shape, prefix='', suffix=''):
+def name_cache_line(y, shape, prefix='', suffix='', ext='.npz'):
     """ Return a filename for a line cache file
 
     Args:
@@ -119,6 +329,8 @@ def name_cache_line(y, shape, prefix='', suffix=''):
         shape (tuple): shape of Y data to save
         prefix (str, optional): prefix to pixel cache filename
         suffix (str, optional): suffix to pixel cache filename
+        ext (str, optional): file extension, either ".npz" for NumPy zipped
+            arrays or ".npy" for memory-mappable NumPy arrays
 
     Returns:
         str: cache filename
@@ -126,7 +338,32 @@ def name_cache_line(y, shape, prefix='', suffix=''):
     """
     f = 'r%s_n%s_b%s' % (y, shape[1], shape[0])
 
-    return prefix + f + suffix + '.npz'
+    return prefix + f + suffix + ext
+
+
+def write_cache_line(filename, Y, image_IDs, fingerprint):
+    """ Save data for one row of a series to NumPy zipped array
+
+    Cache files given by filename are written atomically while holding the
+    lock of their cache folder.
+
+    Args:
+        filename (str or file): filename or file object of cache file
+        Y (np.ndarray): 3D np.ndarray (nband, nimage, ncol) of row data
+        image_IDs (np.ndarray): image IDs of series
+        fingerprint (str): fingerprint of series (see `image_fingerprint`)
+
+    Raises:
+        IOError: raise IOError if it cannot write to cache
+
+    """
+    data = {'Y': Y, 'image_IDs': np.array(list(image_IDs)),
+            'fingerprint': fingerprint}
+    if hasattr(filename, 'write'):
+        np.savez(filename, **data)
+        return
+    with cache_lock(os.path.dirname(filename)), atomic_write(filename) as f:
+        np.savez(f, **data)
 
 
 def read_cache_line(filename, series):
@@ -145,51 +382,357 @@ def read_cache_line(filename, series):
             or images used in timeseries series
 
     """
-    z = np.load(filename)
-    if 'Y' not in z.files or 'image_IDs' not in z.files:
-        raise IndexError('Cache file is not in the correct format')
+    z = load_cache_npz(filename)
+    _validate_cache(z, series)
+    return z['Y']
 
-    if np.array_equal(z['image_IDs'], series.images['id']):
-        return z['Y']
-    else:
+
+def write_cache_line_npy(filename, Y, fingerprint):
+    """ Save data for one row of a series to a memory-mappable NumPy array
+
+    Data are stored column-major (ncol, nband, nimage) so the data for one
+    pixel are contiguous on disk. The fingerprint of the series is stored in
+    a sidecar file named ``filename + '.sha1'``. Both are written to
+    temporary files before the array replaces the previous array and the
+    sidecar replaces the previous sidecar, so readers always find both
+    files and only validate a new array once its sidecar is in place.
+
+    Args:
+        filename (str): filename of cache file
+        Y (np.ndarray): 3D np.ndarray (nband, nimage, ncol) of row data
+        fingerprint (str): fingerprint of series (see `image_fingerprint`)
+
+    Raises:
+        IOError: raise IOError if it cannot write to cache
+
+    """
+    with cache_lock(os.path.dirname(filename)):
+        # Sidecar is replaced when leaving the outer block, after the array
+        with atomic_write(filename + '.sha1', 'w') as f_sha1:
+            f_sha1.write(fingerprint)
+            with atomic_write(filename) as f:
+                np.save(f, np.ascontiguousarray(Y.transpose(2, 0, 1)))
+
+
+def read_cache_line_column(filename, series, col):
+    """ Returns data for one column read from a memory-mapped line cache
+
+    Args:
+        filename (str): filename of cache file
+        series (Series): Series within timeseries driver to read
+        col (int): column of pixel
+
+    Returns:
+        np.ndarray: 2D np.ndarray of 'Y' data for series
+
+    Raises:
+        IOError: raise IOError if cache file cannot correctly be read from disk
+        IndexError: raise IndexError if cached data does not match dimensions
+            or images used in timeseries series
+
+    """
+    with open(filename + '.sha1', 'r') as f:
+        fingerprint = f.read().strip()
+
+    if fingerprint != series.fingerprint:
         raise IndexError('Could not find cache data for series %s. image_IDs '
                          'are not the same' % series.description)
 
+    Y = np.load(filename, mmap_mode='r')
+    if (Y.ndim != 3 or Y.shape[1:] != (series.count, series.n) or
+            not 0 <= col < Y.shape[0]):
+        raise IndexError('Cache file %s of shape %s does not contain column '
+                         '%i of series %s' %
+                         (filename, Y.shape, col, series.description))
+    return np.array(Y[col])
+
 
-def find_files(location, pattern, ignore_dirs=[], maxdepth=float('inf')):
+#: float: seconds within which file system modification times may not change
+MTIME_RESOLUTION = 2.0
+
+
+def _list_dir(path, pattern):
+    """ Return files matching a pattern and all subdirectories of a directory
+
+    Directories that cannot be listed are treated as empty.
+    """
+    files, dirs = [], []
+    try:
+        if scandir is not None:
+            for entry in scandir(path):
+                if entry.is_dir():
+                    dirs.append(entry.name)
+                elif fnmatch.fnmatch(entry.name, pattern):
+                    files.append(entry.name)
+        else:
+            for name in os.listdir(path):
+                if os.path.isdir(os.path.join(path, name)):
+                    dirs.append(name)
+                elif fnmatch.fnmatch(name, pattern):
+                    files.append(name)
+    except OSError as e:
+        logger.debug('Could not list %s: %s' % (path, e))
+    return files, dirs
+
+
+def find_files(location, pattern, ignore_dirs=[], maxdepth=float('inf'),
+               threads=1, state=None):
     """ Find paths to images on disk matching an given pattern
 
+    Directories are listed one level at a time, optionally by a pool of
+    threads so that listing many directories on a network share overlaps.
+    Ignored directories and directories deeper than ``maxdepth`` are never
+    listed.
+
+    When given, ``state`` saves the modification time, listing, and time of
+    listing of each directory. Passing the same ``state`` to a later search
+    for the same pattern and ignored directories only lists directories
+    whose modification time has changed, or was within `MTIME_RESOLUTION`
+    of when they were listed, since a change just after listing may not
+    change the modification time. ``state`` is JSON serializable.
+
     Args:
         location (str): root directory to search
         pattern (str): glob style pattern to search for
         ignore_dirs (iterable): list of directories to ignore from search
         maxdepth (int): maximum depth to recursively search
+        threads (int): number of directories to list concurrently
+        state (dict, optional): directory listings from a previous search,
+            updated in place
 
     Returns:
-        list: list of files within location matching pattern
+        list: sorted list of files within location matching pattern
 
     """
-    results = []
-
     if isinstance(ignore_dirs, str):
-        ignore_dirs = list(ignore_dirs)
+        ignore_dirs = [ignore_dirs]
+    ignore_dirs = set(ignore_dirs)
 
     location = os.path.normpath(location)
-    num_sep = location.count(os.path.sep) - 1
 
-    for root, dirs, files in walk(location, followlinks=True):
-        if ignore_dirs:
-            dirs[:] = [d for d in dirs if d not in ignore_dirs]
+    def _list(args):
+        path, depth = args
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return path, depth, [], []
+        if state is not None:
+            cached = state.get(path)
+            if (cached is not None and len(cached) == 4 and
+                    cached[0] == mtime and
+                    mtime <= cached[3] - MTIME_RESOLUTION):
+                return path, depth, cached[1], cached[2]
+        listed = time.time()
+        files, dirs = _list_dir(path, pattern)
+        if state is not None:
+            state[path] = [mtime, files, dirs, listed]
+        return path, depth, files, dirs
+
+    results, visited = [], set()
+    level = [(location, 1)]
+    pool = ThreadPool(threads) if threads > 1 else None
+    try:
+        while level:
+            if pool is not None and len(level) > 1:
+                listings = pool.map(_list, level)
+            else:
+                listings = [_list(args) for args in level]
+
+            level = []
+            for path, depth, files, dirs in listings:
+                visited.add(path)
+                results.extend([os.path.abspath(os.path.join(path, f))
+                                for f in files])
+                if depth < maxdepth:
+                    level.extend([(os.path.join(path, d), depth + 1)
+                                  for d in dirs if d not in ignore_dirs])
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+    # Forget directories that were removed or are no longer searched
+    if state is not None:
+        for path in set(state) - visited:
+            del state[path]
+
+    return sorted(results)
+
+
+# DATES
+#: dict: width of each `strptime` directive supported by `parse_dates`
+_DATE_FIELD_WIDTHS = {'Y': 4, 'y': 2, 'm': 2, 'd': 2, 'j': 3}
+
+#: int: proleptic Gregorian ordinal of 1970-01-01, the datetime64 epoch
+_EPOCH_ORDINAL = 719163
+
+
+def _date_fields(date_format):
+    """ Return the fields of a fixed-width date format, or None
+
+    Args:
+        date_format (str): `strptime` date format
+
+    Returns:
+        tuple or None: total width of format and a list of (start, end,
+            directive or literal character, is directive) for each field, or
+            None if the format contains unsupported directives
+
+    """
+    fields, i, start = [], 0, 0
+    while i < len(date_format):
+        c = date_format[i]
+        if c == '%':
+            if i + 1 >= len(date_format):
+                return None
+            d = date_format[i + 1]
+            if d == '%':
+                fields.append((start, start + 1, '%', False))
+                start += 1
+            elif d in _DATE_FIELD_WIDTHS:
+                fields.append((start, start + _DATE_FIELD_WIDTHS[d], d, True))
+                start += _DATE_FIELD_WIDTHS[d]
+            else:
+                return None
+            i += 2
+        else:
+            fields.append((start, start + 1, c, False))
+            start += 1
+            i += 1
+    return start, fields
+
+
+def parse_dates(strings, date_format):
+    """ Parse dates from many fixed-width strings at once
+
+    Strings are split into digits using array operations instead of calling
+    `datetime.datetime.strptime` for each string. Only zero padded formats
+    of the directives %Y, %y, %m, %d, and %j (and literal characters) are
+    supported; strings that do not match are reported as invalid so callers
+    can fall back to `strptime`.
 
-        depth = root.count(os.path.sep) - num_sep
-        if depth > maxdepth:
-            dirs[:] = []
-            files[:] = []
+    Args:
+        strings (iterable): strings containing only a date
+        date_format (str): `strptime` date format
+
+    Returns:
+        tuple (np.ndarray, np.ndarray): dates as ``datetime64[D]`` and a
+            boolean mask of strings that were parsed. All strings are invalid
+            if the format is not supported
+
+    """
+    strings = np.asarray(strings, dtype='U')
+    n = strings.size
+    dates = np.zeros(n, dtype='datetime64[D]')
+
+    spec = _date_fields(date_format)
+    if spec is None or n == 0:
+        return dates, np.zeros(n, dtype=np.bool_)
+    width, fields = spec
+    if width == 0:
+        return dates, np.zeros(n, dtype=np.bool_)
+
+    valid = np.char.str_len(strings) == width
+    chars = np.zeros((n, width), dtype='U1')
+    chars[valid] = strings[valid].astype('U%i' % width).view('U1').reshape(
+        -1, width)
+    codes = chars.view(np.uint32).reshape(n, width).astype(np.int64)
+
+    values = {}
+    for start, end, c, is_directive in fields:
+        if not is_directive:
+            valid &= np.all(codes[:, start:end] == ord(c), axis=1)
+            continue
+        digits = codes[:, start:end] - ord('0')
+        valid &= np.all((digits >= 0) & (digits <= 9), axis=1)
+        values[c] = np.dot(digits, 10 ** np.arange(end - start - 1, -1, -1))
+
+    if 'Y' in values:
+        year = values['Y']
+    elif 'y' in values:
+        # Same pivot as `strptime`: 69-99 are 1900s, 00-68 are 2000s
+        year = np.where(values['y'] < 69, 2000, 1900) + values['y']
+    else:
+        year = np.full(n, 1900, dtype=np.int64)
+    valid &= year >= 1
+
+    year = np.where(valid, year, 1970)
+    year_start = (year - 1970).astype('datetime64[Y]').astype(
+        'datetime64[D]')
+
+    if 'j' in values:
+        doy = np.where(valid, values['j'], 1)
+        dates = year_start + (doy - 1).astype('timedelta64[D]')
+        valid &= (doy >= 1) & (dates.astype('datetime64[Y]') ==
+                               year_start.astype('datetime64[Y]'))
+    else:
+        month = values.get('m', np.ones(n, dtype=np.int64))
+        day = values.get('d', np.ones(n, dtype=np.int64))
+        valid &= (month >= 1) & (month <= 12) & (day >= 1)
+        month = np.where(valid, month, 1)
+        day = np.where(valid, day, 1)
+        month_start = (year_start.astype('datetime64[M]') +
+                       (month - 1).astype('timedelta64[M]'))
+        dates = (month_start.astype('datetime64[D]') +
+                 (day - 1).astype('timedelta64[D]'))
+        valid &= dates.astype('datetime64[M]') == month_start
+
+    return dates, valid
+
+
+def dates_to_ordinal(dates):
+    """ Return proleptic Gregorian ordinals of ``datetime64[D]`` dates
+
+    Args:
+        dates (np.ndarray): dates as ``datetime64[D]``
+
+    Returns:
+        np.ndarray: ordinals, as returned by `datetime.date.toordinal`
+
+    """
+    return dates.astype(np.int64) + _EPOCH_ORDINAL
+
+
+def dates_to_doy(dates):
+    """ Return the day of year of ``datetime64[D]`` dates
+
+    Args:
+        dates (np.ndarray): dates as ``datetime64[D]``
 
-        for fname in fnmatch.filter(files, pattern):
-            results.append(os.path.abspath(os.path.join(root, fname)))
+    Returns:
+        np.ndarray: day of year, starting from 1
+
+    """
+    return (dates - dates.astype('datetime64[Y]').astype('datetime64[D]')
+            ).astype(np.int64) + 1
+
+
+def dates_to_year(dates):
+    """ Return the year of ``datetime64[D]`` dates
+
+    Args:
+        dates (np.ndarray): dates as ``datetime64[D]``
+
+    Returns:
+        np.ndarray: year
+
+    """
+    return dates.astype('datetime64[Y]').astype(np.int64) + 1970
+
+
+def ordinal_to_dates(ordinal):
+    """ Return ``datetime64[D]`` dates of proleptic Gregorian ordinals
+
+    Args:
+        ordinal (np.ndarray): ordinals, as returned by
+            `datetime.date.toordinal`
+
+    Returns:
+        np.ndarray: dates as ``datetime64[D]``
+
+    """
+    return (np.asarray(ordinal, dtype=np.int64) -
+            _EPOCH_ORDINAL).astype('datetime64[D]')
 
-    return results
 
 # CONFIGURATION
 
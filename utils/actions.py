@@ -37,7 +37,7 @@ def apply_symbology(rlayers=None):
         # Find corresponding Series
         i_series = None
         for i, series in enumerate(tsm.ts.series):
-            if rlayer.source() in series.images['path']:
+            if np.any(series.paths == rlayer.source()):
                 i_series = i
                 break
         if i_series is None: